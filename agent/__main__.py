@@ -2,7 +2,7 @@
 import argparse
 
 import agent.core as core
-from git_management.git_handler import GitHandler
+from git_management.git_handler import get_git_handler
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -14,10 +14,14 @@ if __name__ == "__main__":
     parser.add_argument("--run_task_from_issues", action="store_true")
     parser.add_argument("--no_branch_and_commit", action="store_true")
     parser.add_argument("--populate_db", action="store_true")
+    parser.add_argument("--sync_db", action="store_true")
+    parser.add_argument("--embed_db", action="store_true")
+    parser.add_argument("--search", metavar="QUERY")
+    parser.add_argument("--test_report", action="store_true")
     args = parser.parse_args()
 
     # Create new handler for git commands
-    git_handler = GitHandler()
+    git_handler = get_git_handler()
 
     if args.generate_tests:
         if not args.no_branch_and_commit:
@@ -71,3 +75,15 @@ if __name__ == "__main__":
 
     if args.populate_db:
         core.populate_db()
+
+    if args.sync_db:
+        core.sync_db()
+
+    if args.embed_db:
+        core.embed_db()
+
+    if args.search:
+        core.search_db(args.search)
+
+    if args.test_report:
+        core.report_tests()
@@ -7,21 +7,30 @@ import ast
 import os
 
 import black
+from sqlalchemy.exc import IntegrityError
 
 import llm.llm_interface as llm
 import utils
 from code_management import readme_manager
 from code_management.code_database import (
-    setup_db,
+    session_scope,
     CodeFunction,
     add_test_to_db,
+    build_callee_context,
     link_tests,
     compute_test_name,
     reset_db,
 )
-from code_management.code_reader import create_code_objects
+from code_management.code_embeddings import embed_functions
+from code_management.code_queries import functions_without_tests
+from code_management.code_reader import bulk_create_code_objects
+from code_management.code_search import search_code
+from code_management.db_snapshots import sync_db
+from code_management.test_history import history_report
+from code_management.test_writer import run_affected_tests
+from code_management.vector_index import index_path_for_db, update_vector_index
 from functions import logger
-from git_management.git_handler import GitHandler
+from git_management.git_handler import get_git_handler
 from github_management.issue_management import GitHubIssues
 from llm.task_management import process_task
 
@@ -216,6 +225,9 @@ def run_task(task_description: str = None, depth: int = 0, max_depth: int = 3):
     # Recursive cases:
     if function == "generate_function_for_task":
         generate_function_for_task(**parameters)
+        if parameters.get("function_file"):
+            # Rerun the tests that run code in the edited file
+            run_affected_tests(changed_files=[parameters["function_file"]])
     elif function == "get_further_information_from_user":
         extra_info_string = get_further_information(**parameters)
         # Resubmit the task description with the extra information.
@@ -242,8 +254,9 @@ def run_task_from_next_issue():
     logger.info("Creating new branch for issue %s", issue.number)
     branch_name = gh_issues.generate_branch_name(issue)
     # Switch to the new branch
-    git_handler = GitHandler()
+    git_handler = get_git_handler()
     git_handler.create_new_branch(branch_name)
+    sync_db(git_handler=git_handler)
     # Run the task.
     logger.info("Running task.")
     run_task(task_description)
@@ -292,18 +305,70 @@ def populate_db(start_dir: str = ".", with_reset: bool = False):
     """
     if with_reset:
         reset_db()
-    db_session = setup_db()
-    for file_path in utils.get_python_files(start_dir, skip_tests=False):
-        create_code_objects(db_session, file_path)
-    db_session.commit()
-    link_tests(db_session)
-    db_session.close()
+    with session_scope() as db_session:
+        file_paths = utils.get_python_files(start_dir, skip_tests=False)
+        bulk_create_code_objects(db_session, file_paths, prune=True)
+        link_tests(db_session)
 
 
-def generate_test_from_function(function: CodeFunction, test_name: str):
+def embed_db(batch_size: int = 100):
+    """Embed the functions in the database whose source has changed.
+
+    Run after populate_db so that new and edited functions get fresh vectors. The
+    approximate nearest-neighbour index next to the database is updated to match.
+
+    Args:
+        batch_size (int): The number of functions per embedding request.
+    """
+    with session_scope() as db_session:
+        embedded_ids = embed_functions(db_session, batch_size=batch_size)
+        update_vector_index(db_session, embedded_ids, index_path_for_db())
+
+
+def search_db(query: str, limit: int = 20):
+    """Print the stored classes, functions and tests that best match a query.
+
+    Args:
+        query (str): The text to search for.
+        limit (int): The maximum number of results.
+    """
+    with session_scope() as db_session:
+        results = search_code(db_session, query, limit=limit)
+    if not results:
+        print(f"No matches for {query!r}.")
+    for result in results:
+        print(f"{result['file_path']}: {result['kind']} {result['name']}")
+        print(f"    {' '.join(result['snippet'].split())}")
+
+
+def report_tests(limit: int = 10):
+    """Print the slowest and the flakiest tests from the recorded test runs.
+
+    Args:
+        limit (int): The number of tests in each list.
+    """
+    with session_scope() as db_session:
+        report = history_report(db_session, limit=limit)
+    print("Slowest tests (mean duration over recorded runs):")
+    for test in report["slowest"]:
+        duration = test["mean_duration"]
+        print(f"    {duration:.3f}s {test['identifier']} ({test['runs']} runs)")
+    print("Flakiest tests (share of runs that flipped outcome):")
+    for test in report["flakiest"]:
+        print(f"    {test['score']:.2f} {test['identifier']} ({test['runs']} runs)")
+
+
+def generate_test_from_function(
+    function: CodeFunction, test_name: str, db_session=None
+):
     logger.info("Generating test for function %s", function.function_name)
+    # Signatures of the helpers it calls, so the test does not misuse them
+    callee_context = build_callee_context(db_session, function) if db_session else None
     test_code, imports = llm.generate_test(
-        function.function_string, function_file=function.file_path, test_name=test_name
+        function.function_string,
+        function_file=function.file_path,
+        test_name=test_name,
+        callee_context=callee_context,
     )
     if test_code is None:
         logger.info("Failed to generate test for function %s", function.function_name)
@@ -328,28 +393,38 @@ def write_test_to_file(function, test_code, imports):
 
 
 def generate_tests_from_db():
-    """Generate tests for all functions in the database."""
+    """Generate tests for all functions in the database.
+
+    The functions are streamed through a session that only reads, so the LLM calls
+    happen outside any write transaction. Each test is stored and committed in a
+    session of its own, which holds the write lock only briefly and means a failure
+    loses only that function's test, not those generated before it.
+    """
     # Get all the functions from the database.
-    db_session = setup_db()
-    functions = db_session.query(CodeFunction).all()
-    # Iterate through the functions.
-    for function in functions:
-        # Check for existing tests.
-        if function.tests:
-            logger.info("Function %s already has a test.", function.function_name)
-            continue
-        # Generate a test name
-        test_name = compute_test_name(db_session, function)
-        # Generate a test for the function.
-        outputs = generate_test_from_function(function, test_name)
-        if outputs is None:
-            continue
-        test_code, imports = outputs
-        # Write tests to file
-        test_file_name = write_test_to_file(function, test_code, imports)
-        if test_file_name is None:
-            continue
-        # Add the test to the database
-        add_test_to_db(db_session, function, test_code, test_file_name)
-    db_session.commit()
-    db_session.close()
+    with session_scope() as db_session:
+        # Iterate through the functions that have no tests yet.
+        for function in functions_without_tests(db_session):
+            # Generate a test name
+            test_name = compute_test_name(db_session, function)
+            # Generate a test for the function.
+            outputs = generate_test_from_function(function, test_name, db_session)
+            if outputs is None:
+                continue
+            test_code, imports = outputs
+            # Write tests to file
+            test_file_name = write_test_to_file(function, test_code, imports)
+            if test_file_name is None:
+                continue
+            # Add the test to the database
+            try:
+                with session_scope() as write_session:
+                    add_test_to_db(
+                        write_session,
+                        write_session.get(CodeFunction, function.id),
+                        test_code,
+                        test_file_name,
+                    )
+            except IntegrityError as error:
+                logger.error(
+                    "Failed to store the test for %s: %s", function.function_name, error
+                )
@@ -1,7 +1,11 @@
 """
     Functions to analyse test results and improve the code.
 """
+import ast
 import logging
+import os
+import queue
+import threading
 
 import utils
 from functions import logger
@@ -11,6 +15,9 @@ def parse_node_id(node_id: str) -> tuple[tuple[str, str]]:
     """
     Parse a node ID into a file path and a function name.
 
+    The parameters of a parametrized test and the class of a test method are dropped,
+    so every case of a test maps to the same function.
+
     Args:
         node_id (str): The node ID to parse.
 
@@ -18,8 +25,9 @@ def parse_node_id(node_id: str) -> tuple[tuple[str, str]]:
         tuple[tuple[str, str]]: The file path and function name for the
         original function and the test function.
     """
-    # Split the string at the "::" separator.
-    file_path, function_name = node_id.split("::")
+    # Split the string at the first "::" separator.
+    file_path, _, test_path = node_id.partition("::")
+    function_name = test_path.split("::")[-1].split("[", 1)[0]
 
     # Split the file path at the "/" separator and take the last element.
     test_filename = file_path.split("/")[-1]
@@ -51,76 +59,234 @@ def get_full_path(filename: str) -> str:
     return ""
 
 
-def run_tests_and_analyze_failures():
+def _failed_phases(node: dict) -> list[tuple[str, dict]]:
+    """Get the setup, call and teardown phases of a test's result that failed."""
+    return [
+        (phase, node[phase])
+        for phase in ("setup", "call", "teardown")
+        if node.get(phase) and node[phase].get("outcome") == "failed"
+    ]
+
+
+class FailureAnalyzer:
+    """
+    Analyse failed tests, finding and parsing each file only once.
+
+    Failures are grouped into one record per test function, so the cases of a
+    parametrized test share a record. The source files are found with one walk of
+    the project, and each file is parsed the first time one of its functions is
+    needed, so the cost of triage grows with the number of distinct files rather
+    than the number of failures.
+    """
+
+    def __init__(self, directory: str = "."):
+        self.directory = directory
+        self.records = {}
+        self.stats = {"failures": 0, "files_parsed": 0}
+        self._paths = None
+        self._functions = {}
+
+    def find_file(self, filename: str) -> str:
+        """
+        Get the path to a source file from its name.
+
+        Args:
+            filename (str): The name of the file.
+
+        Returns:
+            str: The path to the file, or an empty string if there is none.
+        """
+        if self._paths is None:
+            self._paths = {}
+            for path in utils.get_python_files(self.directory):
+                self._paths.setdefault(os.path.basename(path), path)
+        return self._paths.get(filename, "")
+
+    def function_code(self, file_path: str, function_name: str) -> str:
+        """
+        Get the source code of a function, parsing its file if not done already.
+
+        Args:
+            file_path (str): The path to the Python file.
+            function_name (str): The name of the function, or of a method.
+
+        Returns:
+            str: The source code of the function, or None if it was not found.
+        """
+        if file_path not in self._functions:
+            self._functions[file_path] = self._parse(file_path)
+        return self._functions[file_path].get(function_name)
+
+    def _parse(self, file_path: str) -> dict[str, str]:
+        """Get the code of the functions and methods in a file, by name."""
+        functions = {}
+        try:
+            with open(file_path, "r", encoding="utf-8") as file:
+                contents = file.read()
+            module = ast.parse(contents)
+        except (OSError, SyntaxError) as error:
+            logger.error("Could not parse %s: %s", file_path, error)
+            return functions
+        self.stats["files_parsed"] += 1
+        nodes = list(module.body)
+        for node in module.body:
+            if isinstance(node, ast.ClassDef):
+                nodes.extend(node.body)
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                functions.setdefault(node.name, ast.get_source_segment(contents, node))
+        return functions
+
+    def add(self, node: dict) -> dict:
+        """
+        Add a failed test to the record of its test function.
+
+        Args:
+            node (dict): The test's result, as reported by utils.run_pytest.
+
+        Returns:
+            dict: The record, with the test and source files and functions, their
+                code, and the node IDs and errors of the failed cases.
+        """
+        self.stats["failures"] += 1
+        nodeid = node.get("nodeid")
+        original_details, test_details = parse_node_id(nodeid)
+        test_file = os.path.join(self.directory, nodeid.partition("::")[0])
+        key = (test_file, test_details[1])
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = self._new_record(
+                test_file, test_details[1], *original_details
+            )
+        record["nodeids"].append(nodeid)
+        record["errors"][nodeid] = [
+            (phase, report.get("longrepr")) for phase, report in _failed_phases(node)
+        ]
+        return record
+
+    def _new_record(
+        self, test_file: str, test_name: str, filename: str, function_name: str
+    ) -> dict:
+        """Start the record of a failing test function."""
+        source_file = self.find_file(filename)
+        if not source_file:
+            logger.error("Could not find file %s", filename)
+        return {
+            "test_file": test_file,
+            "test_name": test_name,
+            "test_code": self.function_code(test_file, test_name),
+            "source_file": source_file,
+            "function_name": function_name,
+            "function_code": (
+                self.function_code(source_file, function_name) if source_file else None
+            ),
+            "nodeids": [],
+            "errors": {},
+        }
+
+    def analyse_all(self, nodes: list[dict]) -> list[dict]:
+        """
+        Analyse a batch of failed tests.
+
+        Args:
+            nodes (list[dict]): The failed tests' results.
+
+        Returns:
+            list[dict]: The record of each failing test function.
+        """
+        for node in nodes:
+            self.add(node)
+        return list(self.records.values())
+
+
+def analyse_failure(node: dict, analyzer: FailureAnalyzer = None) -> dict:
+    """
+    Retrieve the code for a failed test and the function it tests, and log the failure.
+
+    Args:
+        node (dict): The test's result, as reported by utils.run_pytest.
+        analyzer (FailureAnalyzer): The analyzer whose file cache to use, if any.
+
+    Returns:
+        dict: The record of the failing test function.
+    """
+    analyzer = analyzer or FailureAnalyzer()
+    record = analyzer.add(node)
+    # The code is logged with the first failing case of each test
+    if len(record["nodeids"]) == 1:
+        logger.info(
+            "Retrieved code for function %s in file %s and test %s in file %s",
+            record["function_name"],
+            record["source_file"],
+            record["test_name"],
+            record["test_file"],
+        )
+        logger.debug("Function code: %s", record["function_code"])
+        logger.debug("Test function code: %s", record["test_code"])
+    logger.error("Test failed.")
+    logger.error(node.get("nodeid"))
+    # Look to see which of setup, call, or teardown failed
+    for phase, report in _failed_phases(node):
+        logger.error("%s failed.", phase.capitalize())
+        logger.error(report)
+    return record
+
+
+def _triage_failures(failures: queue.Queue, analyzer: FailureAnalyzer):
+    """Analyse failed tests from a queue until it yields None."""
+    while True:
+        node = failures.get()
+        if node is None:
+            return
+        try:
+            analyse_failure(node, analyzer)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Could not analyse %s: %s", node.get("nodeid"), error)
+
+
+def run_tests_and_analyze_failures() -> list[dict]:
     """
     Runs pytest, captures the output of failed tests, identifies the failing test and the function
     being tested, retrieves the code for both, and sends that information to an LLM for analysis.
+
+    Each failure is analysed on a separate thread as soon as it is reported, while the
+    rest of the suite is still running. The thread shares one FailureAnalyzer, so each
+    file is parsed once however many of its tests fail.
+
+    Returns:
+        list[dict]: The record of each failing test function.
     """
-    # Run pytest and load test output from JSON
+    failures = queue.Queue()
+    analyzer = FailureAnalyzer()
+    triage = threading.Thread(
+        target=_triage_failures, args=(failures, analyzer), name="test-triage"
+    )
+    triage.start()
+
+    def queue_failure(node: dict):
+        if node.get("outcome") == "failed":
+            failures.put(node)
 
-    result = utils.run_pytest()
+    try:
+        result = utils.run_pytest(on_test=queue_failure)
+    finally:
+        failures.put(None)
+        triage.join()
     logging.shutdown()
 
-    # result has two main items "collectors" and "tests"
-    # If collectors has results but tests is empty, collecting tests failed
-    if result.get("collectors") and not result.get("tests"):
+    failed_collectors = [
+        node for node in result.get("collectors", []) if node.get("outcome") == "failed"
+    ]
+    if failed_collectors and not result.get("tests"):
         logger.error("Collecting tests failed.")
-        for node in result.get("collectors"):
-            if node.get("outcome") == "failed":
-                logger.error("Collector failed.")
-                logger.error(node.get("nodeid"))
-                logger.error(node.get("longrepr"))
-            return
+        for node in failed_collectors:
+            logger.error("Collector failed.")
+            logger.error(node.get("nodeid"))
+            logger.error(node.get("longrepr"))
+        return []
 
-    if result.get("collectors") and result.get("tests"):
-        logger.info("Collecting tests succeeded.")
-        if any(node.get("outcome") == "failed" for node in result.get("tests")):
-            logger.error("Some tests failed.")
-        else:
-            logger.info("All tests passed.")
-            return
-        for node in result.get("tests"):
-            if node.get("outcome") == "failed":
-                original_details, test_details = parse_node_id(node.get("nodeid"))
-                filename, function_name = original_details
-                full_path = get_full_path(filename)
-                if not full_path:
-                    logger.error("Could not find file %s", filename)
-                    continue
-                logger.info(
-                    "Retrieving code for function %s in file %s",
-                    function_name,
-                    full_path,
-                )
-                function_code = utils.get_function_code(full_path, function_name)
-                test_filename, test_function_name = test_details
-                test_full_path = get_full_path(test_filename)
-                logger.info(
-                    "Retrieving code for function %s in file %s",
-                    function_name,
-                    full_path,
-                )
-                test_function_code = utils.get_function_code(
-                    test_full_path, test_function_name
-                )
-                logger.debug("Function code: %s", function_code)
-                logger.debug("Test function code: %s", test_function_code)
-                logger.error("Test failed.")
-                logger.error(node.get("nodeid"))
-                # Look to see which of setup, call, or teardown failed
-                if node.get("setup"):
-                    setup_outcome = node.get("setup").get("outcome")
-                    if setup_outcome == "failed":
-                        logger.error("Setup failed.")
-                        logger.error(node.get("setup"))
-                if node.get("call"):
-                    call_outcome = node.get("call").get("outcome")
-                    if call_outcome == "failed":
-                        logger.error("Call failed.")
-                        logger.error(node.get("call"))
-                if node.get("teardown"):
-                    teardown_outcome = node.get("teardown").get("outcome")
-                    if teardown_outcome == "failed":
-                        logger.error("Teardown failed.")
-                        logger.error(node.get("teardown"))
-    return
+    if any(node.get("outcome") == "failed" for node in result.get("tests", [])):
+        logger.error("Some tests failed.")
+    elif result.get("tests"):
+        logger.info("All tests passed.")
+    return list(analyzer.records.values())
@@ -0,0 +1,112 @@
+"""
+Benchmark test generation with and without callee signatures in the prompt.
+
+For a sample of functions in the code DB, generates a test, runs it, and revises it
+(as revise_and_test_loop does) until it passes or max_attempts is reached. Reports the
+average number of revise attempts and the total tokens spent per passing test.
+
+This makes real LLM calls. Run from the project root after populating the DB:
+    python -m benchmarks.bench_callee_context --sample 20
+"""
+
+import argparse
+import os
+import random
+
+import llm.llm_interface as llm
+from code_management.code_database import (
+    CodeFunction,
+    build_callee_context,
+    compute_test_name,
+    get_callees,
+    setup_db,
+)
+from code_management.test_writer import run_specific_test
+
+SCRATCH_TEST_FILE = "tests/test_bench_callee_context.py"
+
+
+def write_scratch_test(test_code: str, imports: list[str]):
+    """Write a generated test on its own into the scratch test file."""
+    with open(SCRATCH_TEST_FILE, "w", encoding="utf-8") as file:
+        file.write("\n".join(imports or []) + "\n\n\n" + (test_code or "") + "\n")
+
+
+def run_case(session, function, with_context: bool, max_attempts: int) -> dict:
+    """Generate, run and revise a test for one function."""
+    test_name = compute_test_name(session, function)
+    callee_context = build_callee_context(session, function) if with_context else None
+    tokens_before = llm.token_usage["total_tokens"]
+    test_code, imports = llm.generate_test(
+        function.function_string,
+        function_file=function.file_path,
+        test_name=test_name,
+        callee_context=callee_context,
+    )
+    write_scratch_test(test_code, imports)
+    output, passed = run_specific_test(f"{SCRATCH_TEST_FILE}::{test_name}")
+    attempts = 0
+    while not passed and attempts < max_attempts:
+        attempts += 1
+        test_code, imports = llm.revise_test(
+            test_code, function.function_string, output
+        )
+        write_scratch_test(test_code, imports)
+        output, passed = run_specific_test(f"{SCRATCH_TEST_FILE}::{test_name}")
+    return {
+        "passed": passed,
+        "attempts": attempts,
+        "tokens": llm.token_usage["total_tokens"] - tokens_before,
+    }
+
+
+def summarise(label: str, results: list[dict]):
+    """Print the summary statistics for one mode."""
+    passing = sum(result["passed"] for result in results)
+    attempts = sum(result["attempts"] for result in results) / max(len(results), 1)
+    tokens = sum(result["tokens"] for result in results)
+    per_pass = tokens / passing if passing else float("inf")
+    print(
+        f"{label:>16}: {passing}/{len(results)} passing, "
+        f"{attempts:.2f} revise attempts/test, {per_pass:,.0f} tokens/passing test"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="sqlite:///code.db")
+    parser.add_argument("--sample", type=int, default=20)
+    parser.add_argument("--max_attempts", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    session = setup_db(args.db)
+    # Only functions that call other project functions can benefit
+    functions = [
+        function
+        for function in session.query(CodeFunction).all()
+        if not function.function_name.startswith("test_")
+        and get_callees(session, function)
+    ]
+    random.Random(args.seed).shuffle(functions)
+    functions = functions[: args.sample]
+    print(f"Benchmarking {len(functions)} functions with project callees")
+
+    results = {"without context": [], "with context": []}
+    try:
+        for function in functions:
+            for label in results:
+                results[label].append(
+                    run_case(
+                        session, function, label == "with context", args.max_attempts
+                    )
+                )
+    finally:
+        if os.path.exists(SCRATCH_TEST_FILE):
+            os.remove(SCRATCH_TEST_FILE)
+    for label, label_results in results.items():
+        summarise(label, label_results)
+
+
+if __name__ == "__main__":
+    main()
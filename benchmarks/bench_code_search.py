@@ -0,0 +1,90 @@
+"""
+Benchmark full-text search over the code DB against a LIKE scan.
+
+Fills a temporary DB with synthetic functions (or uses an existing code DB) and
+reports the average latency of search_code and of the equivalent LIKE query.
+
+Run from the project root:
+    python -m benchmarks.bench_code_search --size 200000
+    python -m benchmarks.bench_code_search --db sqlite:///code.db
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import insert, select
+
+from code_management.code_database import CodeFunction, session_scope
+from code_management.code_search import search_code
+
+WORDS = [f"word{i}" for i in range(5000)]
+
+
+def synthetic_functions(size: int, seed: int = 0) -> list[dict]:
+    """Generate functions whose bodies draw from a Zipf-like vocabulary."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    rows = []
+    for i in range(size):
+        body = " ".join(rng.choices(WORDS, weights, k=30))
+        rows.append(
+            {
+                "function_name": f"function_{i}",
+                "function_string": f"def function_{i}():\n    return '{body}'",
+                "doc_string": " ".join(rng.choices(WORDS, weights, k=8)),
+                "file_path": f"module_{i // 100}.py",
+            }
+        )
+    return rows
+
+
+def time_queries(run, terms: list[str]) -> float:
+    """Average milliseconds per query."""
+    start = time.perf_counter()
+    for term in terms:
+        run(term)
+    return (time.perf_counter() - start) * 1000 / len(terms)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="SQLAlchemy URL of an existing code DB")
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = args.db or f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        if not args.db:
+            rows = synthetic_functions(args.size)
+            start = time.perf_counter()
+            with session_scope(db_path) as session:
+                session.execute(insert(CodeFunction), rows)
+            print(f"insert {len(rows)} rows: {time.perf_counter() - start:.2f}s")
+
+        with session_scope(db_path) as session:
+            names = session.scalars(select(CodeFunction.function_name)).all()
+            print(f"{len(names)} functions")
+            rng = random.Random(1)
+            terms = [rng.choice(WORDS[100:]) for _ in range(args.queries)]
+            if args.db:
+                terms = [rng.choice(names) for _ in range(args.queries)]
+
+            fts_ms = time_queries(lambda term: search_code(session, term), terms)
+            like_ms = time_queries(
+                lambda term: session.execute(
+                    select(CodeFunction.id)
+                    .where(CodeFunction.function_string.like(f"%{term}%"))
+                    .limit(20)
+                ).all(),
+                terms,
+            )
+            print(f"FTS5 search: {fts_ms:.2f} ms/query")
+            print(f"LIKE scan:   {like_ms:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark the git handlers on the revise loop's pattern of commits.
+
+Makes a scratch repository with a number of test files, then commits an edit
+to one file at a time, as the revise loop does after each revised test. The
+commits are made once with GitHandler, which runs the git command for each
+operation, and once with DulwichGitHandler, which works in-process, if dulwich
+is installed. Each commit also reads the current branch and checks the working
+tree. Reports the time taken and the commits per second.
+
+Run from the project root:
+    python -m benchmarks.bench_git --commits 1000
+"""
+
+import argparse
+import os
+import shutil
+import subprocess  # nosec
+import tempfile
+import time
+
+from git_management.git_handler import GitHandler
+
+try:
+    from git_management.dulwich_handler import DulwichGitHandler
+except ImportError:  # dulwich is optional
+    DulwichGitHandler = None
+
+GIT_PATH = shutil.which("git")
+
+
+def make_repo(directory: str, files: int) -> list[str]:
+    """Make a repository with one commit of some test files, returning their paths."""
+    for command in (
+        ["init", "-q", "-b", "main"],
+        ["config", "user.name", "Benchmark"],
+        ["config", "user.email", "benchmark@example.com"],
+        ["config", "commit.gpgsign", "false"],
+    ):
+        subprocess.check_call([GIT_PATH, "-C", directory, *command])  # nosec B603
+    os.makedirs(os.path.join(directory, "tests"))
+    paths = [f"tests/test_{index}.py" for index in range(files)]
+    for path in paths:
+        with open(os.path.join(directory, path), "w", encoding="utf-8") as file:
+            file.write("def test():\n    pass\n")
+    subprocess.check_call([GIT_PATH, "-C", directory, "add", "."])  # nosec B603
+    subprocess.check_call(
+        [GIT_PATH, "-C", directory, "commit", "-q", "-m", "Initial commit"]
+    )  # nosec B603
+    return paths
+
+
+def run(label: str, handler_class, commits: int, files: int) -> None:
+    """Commit one file at a time in a new repository and print the time taken."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_repo(directory, files)
+        os.chdir(directory)
+        try:
+            handler = handler_class()
+            start = time.perf_counter()
+            for commit in range(commits):
+                path = paths[commit % files]
+                with open(path, "w", encoding="utf-8") as file:
+                    file.write(f"def test():\n    assert {commit} == {commit}\n")
+                handler.get_current_branch()
+                handler.commit_files(f"Revised test {path}", [path])
+                handler.is_working_tree_clean("*.py")
+            seconds = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    print(f"{label:>10}: {seconds:7.2f}s, {commits / seconds:7.1f} commits/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=50)
+    args = parser.parse_args()
+
+    run("subprocess", GitHandler, args.commits, args.files)
+    if DulwichGitHandler is None:
+        print("    dulwich: not installed")
+    else:
+        run("dulwich", DulwichGitHandler, args.commits, args.files)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark populating the code DB: per-file ingestion against bulk ingestion.
+
+Ingests the Python files under a directory into fresh databases, once with a
+baseline that adds one ORM row at a time with a copy of its source, as
+populate_db did before bulk ingestion, and once with bulk_create_code_objects,
+which stores each file once, compressed, and references it by byte span.
+Reports the time taken and the database size.
+
+Run from the project root:
+    python -m benchmarks.bench_ingest --dir . --copies 10
+"""
+
+import argparse
+import ast
+import os
+import tempfile
+import time
+
+import utils
+from code_management.code_database import (
+    CodeClass,
+    CodeFunction,
+    CodeTest,
+    dispose_engines,
+    get_engine,
+    session_scope,
+)
+from code_management.code_reader import (
+    _is_test,
+    bulk_create_code_objects,
+    extract_classes_and_functions,
+)
+
+
+def copy_tree(source_dir: str, target_dir: str, copies: int) -> list[str]:
+    """
+    Copy the Python files of a project several times, returning the new paths.
+
+    Each copy ends with a comment naming it, so no two files are identical and
+    bulk ingestion cannot store the copies as one file blob.
+    """
+    file_paths = []
+    for file_path in utils.get_python_files(source_dir, skip_tests=False):
+        with open(file_path, "rb") as file:
+            data = file.read()
+        for copy in range(copies):
+            target = os.path.join(target_dir, f"copy{copy}", file_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as file:
+                file.write(data + f"\n# copy {copy}\n".encode("utf-8"))
+            file_paths.append(target)
+    return file_paths
+
+
+def ingest_per_file(session, file_paths: list[str]) -> None:
+    """
+    Baseline: store each class, method, function and test as its own ORM row with
+    an inline copy of its source, committing once per file. Only for the scratch
+    databases of this benchmark; populate_db uses bulk_create_code_objects.
+    """
+    for file_path in file_paths:
+        try:
+            with open(file_path, "r", encoding="utf-8") as file:
+                contents = file.read()
+            classes, functions = extract_classes_and_functions(contents)
+        except (SyntaxError, UnicodeDecodeError):
+            continue
+        for class_name, class_string, doc_string, body in classes:
+            code_class = CodeClass(
+                class_name=class_name,
+                class_string=class_string,
+                file_path=file_path,
+                doc_string=doc_string,
+            )
+            session.add(code_class)
+            for node in body:
+                if isinstance(node, ast.FunctionDef):
+                    session.add(
+                        CodeFunction(
+                            function_name=node.name,
+                            function_string=ast.get_source_segment(contents, node),
+                            file_path=file_path,
+                            doc_string=ast.get_docstring(node) or "",
+                            code_class=code_class,
+                            is_function=True,
+                        )
+                    )
+        for name, function_string, doc_string in functions:
+            if _is_test(name, file_path):
+                row = CodeTest(test_name=name, test_string=function_string)
+            else:
+                row = CodeFunction(
+                    function_name=name,
+                    function_string=function_string,
+                    is_function=True,
+                )
+            row.file_path = file_path
+            row.doc_string = doc_string
+            session.add(row)
+        session.commit()
+
+
+def database_size(db_file: str, db_path: str) -> int:
+    """Size of the database once the write-ahead log is checkpointed."""
+    with get_engine(db_path).connect() as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.exec_driver_sql("VACUUM")
+    return os.path.getsize(db_file)
+
+
+def run(label: str, directory: str, ingest) -> None:
+    """Ingest into a new database and print the time and size."""
+    db_file = os.path.join(directory, f"{label}.db")
+    db_path = f"sqlite:///{db_file}"
+    start = time.perf_counter()
+    with session_scope(db_path) as session:
+        ingest(session)
+    seconds = time.perf_counter() - start
+    size = database_size(db_file, db_path)
+    print(f"{label:>8}: {seconds:7.2f}s, {size / 1024:10,.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=".")
+    parser.add_argument("--copies", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_paths = copy_tree(args.dir, os.path.join(directory, "src"), args.copies)
+        source_size = sum(os.path.getsize(file_path) for file_path in file_paths)
+        print(f"{len(file_paths)} files, {source_size / 1024:,.0f} KiB of source")
+
+        run("per-file", directory, lambda session: ingest_per_file(session, file_paths))
+        run(
+            "bulk",
+            directory,
+            lambda session: bulk_create_code_objects(session, file_paths),
+        )
+        dispose_engines()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark the IVF vector index against exact (brute-force) search.
+
+Reports recall@k and queries per second for a range of n_probe values, on either
+synthetic clustered vectors or the embeddings stored in a code DB.
+
+Run from the project root:
+    python -m benchmarks.bench_vector_index --size 100000 --dim 256
+    python -m benchmarks.bench_vector_index --db sqlite:///code.db
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from code_management.code_database import setup_db
+from code_management.code_embeddings import load_vector_matrix
+from code_management.vector_index import IVFIndex, _normalise
+
+
+def synthetic_vectors(size: int, dim: int, seed: int = 0):
+    """Generate vectors in many small, overlapping clusters, like code embeddings."""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, size // 50)
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size)
+    noise = rng.standard_normal((size, dim)).astype(np.float32) * 2.0
+    return np.arange(size, dtype=np.int64), _normalise(centres[labels] + noise)
+
+
+def exact_top_k(matrix: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Exact top-k row indices for each query."""
+    scores = queries @ matrix.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="SQLAlchemy URL of a code DB with embeddings")
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n_lists", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.db:
+        ids, matrix = load_vector_matrix(setup_db(args.db))
+    else:
+        ids, matrix = synthetic_vectors(args.size, args.dim)
+    print(f"{len(ids)} vectors of dimension {matrix.shape[1]}")
+
+    rng = np.random.default_rng(1)
+    queries = matrix[rng.choice(len(matrix), args.queries, replace=False)]
+
+    start = time.perf_counter()
+    truth = exact_top_k(matrix, queries, args.k)
+    exact_seconds = time.perf_counter() - start
+    # Time exact search one query at a time, as the index is queried
+    start = time.perf_counter()
+    for query in queries:
+        scores = matrix @ query
+        np.argpartition(-scores, args.k - 1)[: args.k]
+    exact_qps = len(queries) / (time.perf_counter() - start)
+    print(f"exact: batch {exact_seconds:.3f}s, {exact_qps:,.0f} QPS, recall 1.000")
+
+    start = time.perf_counter()
+    index = IVFIndex()
+    index.build(ids, matrix, n_lists=args.n_lists)
+    print(f"build: {time.perf_counter() - start:.2f}s, {index.n_lists} lists")
+
+    truth_ids = [set(ids[row].tolist()) for row in truth]
+    for n_probe in (1, 2, 4, 8, 16, 32, 64):
+        if n_probe > index.n_lists:
+            break
+        start = time.perf_counter()
+        results = [index.search(query, k=args.k, n_probe=n_probe) for query in queries]
+        qps = len(queries) / (time.perf_counter() - start)
+        recall = np.mean(
+            [
+                len(expected & {function_id for function_id, _ in found}) / args.k
+                for expected, found in zip(truth_ids, results)
+            ]
+        )
+        print(f"n_probe={n_probe:3d}: {qps:10,.0f} QPS, recall@{args.k} {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
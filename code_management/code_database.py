@@ -1,31 +1,168 @@
 """Code to store a copy of the code in an SQLite DB."""
 
-from sqlalchemy import ForeignKey, create_engine
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import (
+    ForeignKey,
+    Index,
+    LargeBinary,
+    case,
+    create_engine,
+    event,
+    func,
+    literal_column,
+    select,
+    update,
+)
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     Mapped,
     declarative_base,
+    declared_attr,
     mapped_column,
     relationship,
     sessionmaker,
     Session,
 )
-from functions import logger
+import utils
+from code_management.migrations import drop_unmanaged_schema, migrate
+from functions import logger, num_tokens_from_string
 
 Base = declarative_base()
 
+DEFAULT_DB_PATH = "sqlite:///code.db"
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+}
+
+# Process-wide engines and session factories, keyed by database URL
+_engines = {}
+_session_makers = {}
+_engines_lock = threading.Lock()
+
+# Token budget for the callee signatures included in test generation prompts
+CALLEE_CONTEXT_TOKEN_BUDGET = 800
+SOURCE_COMPRESSION_LEVEL = 6
+
+
+@lru_cache(maxsize=64)
+def decompress_source(data: bytes) -> bytes:
+    """Decompress a file blob, caching recent files as their rows are read together."""
+    return zlib.decompress(data)
+
+
+def _code_span(data: bytes, start_byte: int, end_byte: int) -> str:
+    """SQL function code_span: the text at a byte span of a compressed file blob."""
+    if data is None:
+        return None
+    return str(memoryview(decompress_source(data))[start_byte:end_byte], "utf-8")
+
+
+class CodeFileBlob(Base):
+    """Model for the compressed contents of a source file, stored once per version."""
+
+    __tablename__ = "code_file_blob"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    content_hash: Mapped[str] = mapped_column(unique=True)
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+    size: Mapped[int] = mapped_column()
+
+    @property
+    def content(self) -> bytes:
+        """The uncompressed contents of the file."""
+        return decompress_source(self.data)
+
+    def __repr__(self):
+        return f"<CodeFileBlob({self.id}, {self.size} bytes)>"
+
+
+class SourceSpanMixin:
+    """Locates the source of a row as a byte span of a file blob.
+
+    Rows read from files store no copy of their source: it is sliced from the
+    file blob on access. Source set directly, such as a generated test, is stored
+    inline in the row instead.
+    """
+
+    blob_id: Mapped[int] = mapped_column(
+        ForeignKey("code_file_blob.id"), nullable=True, index=True
+    )
+    start_byte: Mapped[int] = mapped_column(nullable=True)
+    end_byte: Mapped[int] = mapped_column(nullable=True)
+
+    @declared_attr
+    def blob(cls):
+        # Loaded when the source is first read, once per file in a session, so
+        # queries that only need names or statuses never load the file blobs
+        return relationship("CodeFileBlob", lazy="select")
+
+    @property
+    def source_view(self) -> memoryview:
+        """The source of the row as a slice of its file, without copying."""
+        return memoryview(self.blob.content)[self.start_byte : self.end_byte]
+
+
+def _span_source(column: str) -> hybrid_property:
+    """
+    Build a source attribute that reads the span of the row's file blob if it has
+    one, and the inline column otherwise. It also works in SQL expressions.
 
-class CodeClass(Base):
+    Args:
+        column (str): The name of the attribute mapped to the inline column.
+
+    Returns:
+        hybrid_property: The attribute.
+    """
+
+    def get_source(self):
+        if self.blob_id is None:
+            return getattr(self, column)
+        return str(self.source_view, "utf-8")
+
+    def set_source(self, value):
+        setattr(self, column, value)
+        self.blob_id = self.start_byte = self.end_byte = None
+
+    def source_expression(cls):
+        blob_data = (
+            select(CodeFileBlob.data)
+            .where(CodeFileBlob.id == cls.blob_id)
+            .scalar_subquery()
+        )
+        return case(
+            (cls.blob_id.is_(None), getattr(cls, column)),
+            else_=func.code_span(blob_data, cls.start_byte, cls.end_byte),
+        )
+
+    return hybrid_property(get_source, set_source, expr=source_expression)
+
+
+class CodeClass(SourceSpanMixin, Base):
     """Model for a class in a Python file."""
 
     __tablename__ = "code_class"
     id: Mapped[int] = mapped_column(primary_key=True)
-    class_string: Mapped[str] = mapped_column()
-    class_name: Mapped[str] = mapped_column()
+    _class_string: Mapped[str] = mapped_column("class_string")
+    class_string = _span_source("_class_string")
+    class_name: Mapped[str] = mapped_column(index=True)
     file_path: Mapped[str] = mapped_column(nullable=True)
     doc_string: Mapped[str] = mapped_column(nullable=True)
     imports: Mapped[str] = mapped_column(nullable=True)
-    test_status: Mapped[str] = mapped_column(nullable=True)
+    test_status: Mapped[str] = mapped_column(nullable=True, index=True)
     # Other fields as needed...
+    # Hash of the source and its line span in the file, for change detection
+    content_hash: Mapped[str] = mapped_column(nullable=True)
+    start_line: Mapped[int] = mapped_column(nullable=True)
+    end_line: Mapped[int] = mapped_column(nullable=True)
 
     # Relationship to functions
     functions = relationship("CodeFunction", back_populates="code_class")
@@ -34,54 +171,74 @@ class CodeClass(Base):
         return f"<CodeClass({self.id}, {self.class_name})>"
 
 
-class CodeFunction(Base):
+class CodeFunction(SourceSpanMixin, Base):
     """Model for a function in a Python file."""
 
     __tablename__ = "code_function"
     id: Mapped[int] = mapped_column(primary_key=True)
-    function_string: Mapped[str] = mapped_column()
-    function_name: Mapped[str] = mapped_column()
+    _function_string: Mapped[str] = mapped_column("function_string")
+    function_string = _span_source("_function_string")
+    function_name: Mapped[str] = mapped_column(index=True)
     file_path: Mapped[str] = mapped_column(nullable=True)
     doc_string: Mapped[str] = mapped_column(nullable=True)
-    vector: Mapped[str] = mapped_column(nullable=True)
-    test_status: Mapped[str] = mapped_column(nullable=True)
+    # Embedding packed as float32 bytes, plus the hash of the source it was built from
+    vector: Mapped[bytes] = mapped_column(LargeBinary, nullable=True)
+    vector_hash: Mapped[str] = mapped_column(nullable=True)
+    test_status: Mapped[str] = mapped_column(nullable=True, index=True)
     imports: Mapped[str] = mapped_column(nullable=True)
     # Can be "function" or "test"
     code_type: Mapped[str] = mapped_column(nullable=True)
     is_test: Mapped[bool] = mapped_column(nullable=True)
     is_function: Mapped[bool] = mapped_column(nullable=True)
+    # Hash of the source and its line span in the file, for change detection
+    content_hash: Mapped[str] = mapped_column(nullable=True)
+    start_line: Mapped[int] = mapped_column(nullable=True)
+    end_line: Mapped[int] = mapped_column(nullable=True)
 
     # Foreign Key to class
-    class_id: Mapped[int] = mapped_column(ForeignKey("code_class.id"), nullable=True)
+    class_id: Mapped[int] = mapped_column(
+        ForeignKey("code_class.id"), nullable=True, index=True
+    )
     code_class = relationship("CodeClass", back_populates="functions")
 
     def __repr__(self):
         return f"<CodeFunction({self.id}, {self.function_name})>"
 
 
-class CodeTest(Base):
+class CodeTest(SourceSpanMixin, Base):
     """Model for a test in a Python file."""
 
     __tablename__ = "code_test"
     id: Mapped[int] = mapped_column(primary_key=True)
-    test_string: Mapped[str] = mapped_column()
+    _test_string: Mapped[str] = mapped_column("test_string")
+    test_string = _span_source("_test_string")
     test_name: Mapped[str] = mapped_column()
     file_path: Mapped[str] = mapped_column(nullable=True)
     doc_string: Mapped[str] = mapped_column(nullable=True)
     test_status: Mapped[str] = mapped_column(
-        nullable=True
-    )  # e.g., "pass", "fail", etc.
+        nullable=True, index=True
+    )  # "pass", "fail" or "timeout"
     # Does the test relate to a class method
     class_test: Mapped[bool] = mapped_column(nullable=True)
+    # Seconds the test took in its last run, used to balance parallel runs
+    duration: Mapped[float] = mapped_column(nullable=True)
+    # The content_hash of the test when its dependencies were last recorded
+    dependencies_hash: Mapped[str] = mapped_column(nullable=True)
+    # Hash of the source and its line span in the file, for change detection
+    content_hash: Mapped[str] = mapped_column(nullable=True)
+    start_line: Mapped[int] = mapped_column(nullable=True)
+    end_line: Mapped[int] = mapped_column(nullable=True)
 
     # Foreign Key to function being tested
     function_id: Mapped[int] = mapped_column(
-        ForeignKey("code_function.id"), nullable=True
+        ForeignKey("code_function.id"), nullable=True, index=True
     )
     tested_function = relationship("CodeFunction", backref="tests")
 
     # Foreign Key to class being tested
-    class_id: Mapped[int] = mapped_column(ForeignKey("code_class.id"), nullable=True)
+    class_id: Mapped[int] = mapped_column(
+        ForeignKey("code_class.id"), nullable=True, index=True
+    )
     tested_class = relationship("CodeClass", backref="tests")
 
     def __repr__(self):
@@ -93,17 +250,139 @@ class CodeTest(Base):
         return f"{self.file_path}::{self.test_name}"
 
 
-def setup_db(db_path: str = "sqlite:///code.db"):
-    """Set up an SQLite DB with SQLAlchemy to store code as strings and classes.
+class CodeTestDependency(Base):
+    """Model for a file, and function if known, that a test executed when traced."""
+
+    __tablename__ = "code_test_dependency"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    test_id: Mapped[int] = mapped_column(ForeignKey("code_test.id"), index=True)
+    file_path: Mapped[str] = mapped_column(index=True)
+    function_id: Mapped[int] = mapped_column(
+        ForeignKey("code_function.id"), nullable=True, index=True
+    )
+
+    def __repr__(self):
+        return f"<CodeTestDependency({self.test_id}, {self.file_path})>"
+
+
+class CodeTestRun(Base):
+    """Model for the outcome of one run of a test."""
+
+    __tablename__ = "code_test_run"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    test_id: Mapped[int] = mapped_column(ForeignKey("code_test.id"), index=True)
+    outcome: Mapped[str] = mapped_column()  # "pass" or "fail"
+    duration: Mapped[float] = mapped_column(nullable=True)
+    # Normalised error of a failed run, to tell distinct failures apart
+    failure_signature: Mapped[str] = mapped_column(nullable=True)
+    # The content_hash of the test when it ran
+    test_hash: Mapped[str] = mapped_column(nullable=True)
+    run_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    def __repr__(self):
+        return f"<CodeTestRun({self.test_id}, {self.outcome})>"
+
+
+# Natural keys: the columns that identify a row across re-ingestion of the code.
+# A NULL class_id would never conflict in a unique index, hence the coalesce.
+CODE_CLASS_NATURAL_KEY = [CodeClass.file_path, CodeClass.class_name]
+CODE_FUNCTION_NATURAL_KEY = [
+    CodeFunction.file_path,
+    func.coalesce(CodeFunction.class_id, literal_column("0")),
+    CodeFunction.function_name,
+]
+CODE_TEST_NATURAL_KEY = [CodeTest.file_path, CodeTest.test_name]
+
+Index("ux_code_class_natural_key", *CODE_CLASS_NATURAL_KEY, unique=True)
+Index("ux_code_function_natural_key", *CODE_FUNCTION_NATURAL_KEY, unique=True)
+Index("ux_code_test_natural_key", *CODE_TEST_NATURAL_KEY, unique=True)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune a new SQLite connection and register the SQL functions the schema uses."""
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+    dbapi_connection.create_function("code_span", 3, _code_span, deterministic=True)
+
+
+def get_engine(db_path: str = DEFAULT_DB_PATH, echo: bool = False):
+    """Get the shared engine for a database, creating it and its tables on first use.
+
+    Existing databases are brought up to date with the schema migrations.
 
     Args:
-        db_path (str): The path to the SQLite DB. Defaults to 'sqlite:///code.db'.
+        db_path (str): The SQLAlchemy URL of the DB. Defaults to 'sqlite:///code.db'.
+        echo (bool): Whether to log all SQL statements. Defaults to False.
+
+    Returns:
+        Engine: The engine for the database.
     """
-    engine = create_engine(db_path, echo=True)
+    with _engines_lock:
+        engine = _engines.get(db_path)
+        if engine is None:
+            engine = create_engine(db_path, echo=echo)
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _set_sqlite_pragmas)
+            Base.metadata.create_all(engine)
+            migrate(engine)
+            _engines[db_path] = engine
+        elif echo:
+            engine.echo = True
+        return engine
+
+
+def dispose_engines():
+    """Close all pooled connections and forget the shared engines."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _session_makers.clear()
+
+
+@contextmanager
+def session_scope(db_path: str = DEFAULT_DB_PATH, echo: bool = False):
+    """Provide a transactional scope around a series of operations.
+
+    The session is committed on success, rolled back on error and always closed.
+    Loaded objects stay usable after the scope ends.
+
+    Args:
+        db_path (str): The SQLAlchemy URL of the DB. Defaults to 'sqlite:///code.db'.
+        echo (bool): Whether to log all SQL statements. Defaults to False.
+
+    Yields:
+        Session: The session.
+    """
+    engine = get_engine(db_path, echo=echo)
+    with _engines_lock:
+        session_maker = _session_makers.get(db_path)
+        if session_maker is None:
+            session_maker = sessionmaker(bind=engine, expire_on_commit=False)
+            _session_makers[db_path] = session_maker
+    session = session_maker()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
-    # Create tables for the CodeClass and CodeFunction models
-    Base.metadata.create_all(engine)
 
+def setup_db(db_path: str = DEFAULT_DB_PATH, echo: bool = False):
+    """Set up an SQLite DB with SQLAlchemy to store code as strings and classes.
+
+    Prefer session_scope, which also closes the session.
+
+    Args:
+        db_path (str): The path to the SQLite DB. Defaults to 'sqlite:///code.db'.
+        echo (bool): Whether to log all SQL statements. Defaults to False.
+    """
+    engine = get_engine(db_path, echo=echo)
     session_maker = sessionmaker(bind=engine)
     session = session_maker()
     return session
@@ -113,9 +392,8 @@ def compute_test_name(db_session, function):
     """Compute the name of the test for a function."""
     # Check whether function is part of a class
     if function.class_id:
-        # Get the class name
-        class_obj = db_session.query(CodeClass).filter_by(id=function.class_id).first()
-        class_name = class_obj.class_name
+        # Get the class name, which functions_without_tests has already loaded
+        class_name = function.code_class.class_name
         # Set the test name
         test_name = f"test_{class_name}_{function.function_name}"
     else:
@@ -124,34 +402,220 @@ def compute_test_name(db_session, function):
 
 
 def add_test_to_db(db_session, function, test_code, test_file_name):
-    """Add a test to the database."""
+    """Add a test to the database, returning its CodeTest.
+
+    A stored test with the same file and name, such as one generated for the
+    function before, is updated in place, as the pair is unique.
+    """
     test_name = compute_test_name(db_session, function)
     class_test = True if function.class_id else False
-    new_test = CodeTest(
-        test_string=test_code,
-        test_name=test_name,
-        file_path=test_file_name,
-        doc_string="",
-        test_status="",
-        function_id=function.id,
-        class_id=function.class_id,
-        class_test=class_test,
+    stmt = select(CodeTest).where(
+        CodeTest.file_path == test_file_name, CodeTest.test_name == test_name
+    )
+    test = db_session.scalar(stmt)
+    if test is None:
+        test = CodeTest(test_name=test_name, file_path=test_file_name)
+        db_session.add(test)
+    else:
+        logger.info("Replacing stored test %s in %s", test_name, test_file_name)
+        # The code changed, so its recorded dependencies no longer apply
+        test.content_hash = None
+    test.test_string = test_code
+    test.doc_string = ""
+    test.test_status = ""
+    test.function_id = function.id
+    test.class_id = function.class_id
+    test.class_test = class_test
+    return test
+
+
+def _module_path(module: str) -> tuple[str, str]:
+    """Get the file paths, relative to the project root, a dotted module may be at."""
+    path = module.replace(".", "/")
+    return f"{path}.py", f"{path}/__init__.py"
+
+
+def _in_module(file_path: str, module: str) -> bool:
+    """Check whether a stored file path is the file of a dotted module."""
+    if not file_path:
+        return False
+    path = os.path.normpath(file_path).replace(os.sep, "/")
+    return any(
+        path == module_path or path.endswith("/" + module_path)
+        for module_path in _module_path(module)
     )
-    db_session.add(new_test)
 
 
-def is_class_name_in_test_string(class_names, test_string):
+def _caller_module_aliases(function: CodeFunction) -> dict[str, str]:
+    """Get the names bound by the imports of a function and of the file it is in."""
+    sources = [function.imports or "", function.function_string or ""]
+    if function.blob_id is not None:
+        sources.append(function.blob.content.decode("utf-8"))
+    elif function.file_path and os.path.isfile(function.file_path):
+        with open(function.file_path, "r", encoding="utf-8") as file:
+            sources.append(file.read())
+    aliases = {}
+    for source in sources:
+        try:
+            aliases.update(utils.extract_module_aliases(source))
+        except SyntaxError:
+            continue
+    return aliases
+
+
+def get_callees(session: Session, function: CodeFunction) -> list[CodeFunction]:
     """
-    Checks if any of the class names are present in the test string.
+    Resolve the functions called by a function to their rows in the database.
+
+    A bare call such as `helper()` resolves to a module-level function, preferring
+    one in the same file. A method call resolves only where the receiver is known:
+    `self.` or `cls.` to a method of the same class, and an imported module, as in
+    `utils.helper()`, to a function of that module. Other calls, such as
+    `data.get()`, are left out, as their receiver's type is unknown.
+
+    Args:
+        session (Session): The database session.
+        function (CodeFunction): The calling function.
 
-    :param class_names: A list of class names (e.g., ['GitHandler', 'MyClass'])
-    :param test_string: A test string of the format 'test_[ClassName]_[function_name]'
-    :return: True if any class name is in the test string, False otherwise
+    Returns:
+        list[CodeFunction]: The callees, in order of first call.
     """
-    for class_name in class_names:
-        if class_name in test_string:
-            return True
-    return False
+    try:
+        calls = utils.extract_calls(function.function_string)
+    except SyntaxError:
+        return []
+    aliases = _caller_module_aliases(function)
+    resolvable = []
+    for receiver, name in calls:
+        if receiver in ("self", "cls"):
+            if function.class_id is not None:
+                resolvable.append((receiver, name))
+        elif receiver == "":
+            resolvable.append((receiver, name))
+        elif receiver is not None and receiver.split(".")[0] in aliases:
+            root, _, rest = receiver.partition(".")
+            module = ".".join(filter(None, [aliases[root], rest]))
+            resolvable.append((module, name))
+    resolvable = [
+        (receiver, name)
+        for receiver, name in resolvable
+        if not (receiver in ("", "self", "cls") and name == function.function_name)
+    ]
+    if not resolvable:
+        return []
+    candidates = (
+        session.query(CodeFunction)
+        .filter(CodeFunction.function_name.in_({name for _, name in resolvable}))
+        .filter(CodeFunction.is_test.isnot(True))
+        .all()
+    )
+
+    def matches(candidate, receiver: str) -> bool:
+        if receiver in ("self", "cls"):
+            return candidate.class_id == function.class_id
+        if candidate.class_id is not None:
+            return False
+        return receiver == "" or _in_module(candidate.file_path, receiver)
+
+    def preference(candidate):
+        return candidate.file_path != function.file_path
+
+    callees = []
+    for receiver, name in resolvable:
+        found = [
+            candidate
+            for candidate in candidates
+            if candidate.function_name == name and matches(candidate, receiver)
+        ]
+        if found:
+            callee = min(found, key=preference)
+            if callee not in callees:
+                callees.append(callee)
+    return callees
+
+
+def build_callee_context(
+    session: Session,
+    function: CodeFunction,
+    token_budget: int = CALLEE_CONTEXT_TOKEN_BUDGET,
+) -> str:
+    """
+    Build a listing of the signatures of a function's callees within a token budget.
+
+    Args:
+        session (Session): The database session.
+        function (CodeFunction): The function being tested.
+        token_budget (int): The maximum number of tokens to use.
+
+    Returns:
+        str: The callee signatures, one block per callee, or "" if there are none.
+    """
+    blocks = []
+    tokens = 0
+    for callee in get_callees(session, function):
+        try:
+            signature = utils.get_function_signature(callee.function_string)
+        except SyntaxError:
+            continue
+        if not signature:
+            continue
+        block = f"# {callee.file_path}\n{signature}"
+        block_tokens = num_tokens_from_string(block)
+        if tokens + block_tokens > token_budget:
+            logger.debug("No budget left for callee %s", callee.function_name)
+            continue
+        blocks.append(block)
+        tokens += block_tokens
+    return "\n\n".join(blocks)
+
+
+# Marks the end of a name in a trie built by build_name_trie
+_TRIE_END = ""
+
+
+def build_name_trie(names) -> dict:
+    """
+    Build a character trie of names for longest-prefix matching.
+
+    Args:
+        names: The names to add.
+
+    Returns:
+        dict: Nested dicts keyed by character; a complete name is marked by a ""
+            key holding the name.
+    """
+    trie = {}
+    for name in names:
+        node = trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[_TRIE_END] = name
+    return trie
+
+
+def match_name_prefixes(trie: dict, text: str, separator: str = "_") -> list[str]:
+    """
+    Find the names in a trie that are prefixes of a text, ending at a separator.
+
+    A name only matches whole: "Git" does not match "GitHandler_commit".
+
+    Args:
+        trie (dict): A trie built by build_name_trie.
+        text (str): The text to match.
+        separator (str): The character that must follow a matched name.
+
+    Returns:
+        list[str]: The matching names, longest first.
+    """
+    matches = []
+    node = trie
+    for position, char in enumerate(text):
+        node = node.get(char)
+        if node is None:
+            break
+        if _TRIE_END in node and text[position + 1 : position + 2] in (separator, ""):
+            matches.append(node[_TRIE_END])
+    return matches[::-1]
 
 
 def get_class_names(session: Session):
@@ -161,53 +625,88 @@ def get_class_names(session: Session):
     return class_names
 
 
-def link_tests(session: Session):
-    """Link tests to the functions they test."""
-    class_names = get_class_names(session)
-    tests = session.query(CodeTest).all()
-    for test in tests:
-        if test.class_test is None:
-            logger.debug("Setting class_test for %s", test.test_name)
-            test.class_test = is_class_name_in_test_string(class_names, test.test_name)
-            session.commit()
-        if not test.class_test and not test.function_id:
-            function_name = test.test_name.replace("test_", "")
-            logger.debug("Looking for function %s", function_name)
-            function = (
-                session.query(CodeFunction)
-                .filter_by(function_name=function_name)
-                .first()
-            )
-            if function is not None:
-                logger.debug("Found function %s", function.function_name)
-                test.function_id = function.id
-                session.commit()
-        if test.class_test and (not test.class_id or not test.function_id):
-            class_name = test.test_name.replace("test_", "").split("_")[0]
-            logger.debug("Looking for class %s", class_name)
-            class_obj = (
-                session.query(CodeClass).filter_by(class_name=class_name).first()
-            )
-            if class_obj is not None:
-                logger.debug("Found class %s", class_obj.class_name)
-                test.class_id = class_obj.id
-                session.commit()
-            function_name = "_".join(test.test_name.replace("test_", "").split("_")[1:])
-            logger.debug("Looking for function %s", function_name)
-            function = (
-                session.query(CodeFunction)
-                .filter_by(function_name=function_name)
-                .filter_by(class_id=class_obj.id)
-                .first()
-            )
-            if function is not None:
-                logger.debug("Found function %s", function.function_name)
-                test.function_id = function.id
-                session.commit()
-
-
-def reset_db(db_path: str = "sqlite:///code.db"):
+def link_tests(session: Session) -> int:
+    """
+    Link tests to the classes and functions they test.
+
+    Test names are resolved in memory: "test_<function>" links to a function, and
+    "test_<Class>_<method>" to a method, taking the longest class name that matches.
+    All links are written with one bulk update, so run this once per ingestion.
+
+    Args:
+        session (Session): The database session.
+
+    Returns:
+        int: The number of tests whose links changed.
+    """
+    class_ids = {}
+    for class_id, class_name in session.execute(
+        select(CodeClass.id, CodeClass.class_name).order_by(CodeClass.id)
+    ):
+        class_ids.setdefault(class_name, []).append(class_id)
+    class_trie = build_name_trie(class_ids)
+
+    function_ids = {}
+    methods = {}
+    for function_id, function_name, class_id in session.execute(
+        select(CodeFunction.id, CodeFunction.function_name, CodeFunction.class_id)
+        .where(CodeFunction.is_test.isnot(True))
+        .order_by(CodeFunction.class_id.isnot(None), CodeFunction.id)
+    ):
+        function_ids.setdefault(function_name, function_id)
+        if class_id is not None:
+            methods.setdefault((class_id, function_name), function_id)
+
+    updates = []
+    for test_id, test_name, class_test, function_id, class_id in session.execute(
+        select(
+            CodeTest.id,
+            CodeTest.test_name,
+            CodeTest.class_test,
+            CodeTest.function_id,
+            CodeTest.class_id,
+        )
+    ):
+        name = test_name.removeprefix("test_")
+        class_matches = match_name_prefixes(class_trie, name)
+        values = {}
+        if class_test is None:
+            class_test = bool(class_matches)
+            values["class_test"] = class_test
+        if not class_test and not function_id and name in function_ids:
+            values["function_id"] = function_ids[name]
+        elif class_test and (not class_id or not function_id):
+            # Prefer the longest class name, and a class that has the method
+            candidates = [
+                (candidate_id, name[len(class_name) + 1 :])
+                for class_name in class_matches
+                for candidate_id in class_ids[class_name]
+            ]
+            linked = [
+                (candidate_id, methods[(candidate_id, method_name)])
+                for candidate_id, method_name in candidates
+                if (candidate_id, method_name) in methods
+            ]
+            if linked:
+                values["class_id"], values["function_id"] = linked[0]
+            elif candidates and not class_id:
+                values["class_id"] = candidates[0][0]
+        if values:
+            updates.append({"id": test_id, **values})
+
+    if updates:
+        session.execute(update(CodeTest), updates)
+        session.commit()
+    logger.info("Updated the links of %s tests", len(updates))
+    return len(updates)
+
+
+def reset_db(db_path: str = DEFAULT_DB_PATH):
     """Reset the database."""
-    engine = create_engine(db_path, echo=True)
+    engine = get_engine(db_path)
     Base.metadata.drop_all(engine)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as connection:
+            drop_unmanaged_schema(connection)
     Base.metadata.create_all(engine)
+    migrate(engine)
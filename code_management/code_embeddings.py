@@ -0,0 +1,167 @@
+"""Embed the functions stored in the code DB and query them by similarity."""
+
+from typing import Callable
+
+import numpy as np
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+import llm.llm_interface as llm
+from code_management.code_database import CodeFunction
+from functions import logger
+from utils import compute_source_hash
+
+VECTOR_DTYPE = np.float32
+# Rough character cap so a single huge function cannot exceed the model's input limit
+MAX_EMBED_CHARS = 24000
+
+
+def vector_to_blob(vector) -> bytes:
+    """Pack an embedding into compact float32 bytes.
+
+    Args:
+        vector: A sequence of floats.
+
+    Returns:
+        bytes: The packed vector.
+    """
+    return np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+
+
+def blob_to_vector(blob: bytes) -> np.ndarray:
+    """Unpack float32 bytes into a NumPy vector without copying.
+
+    Args:
+        blob (bytes): The packed vector.
+
+    Returns:
+        np.ndarray: The (read-only) vector.
+    """
+    return np.frombuffer(blob, dtype=VECTOR_DTYPE)
+
+
+def embed_functions(
+    session: Session,
+    batch_size: int = 100,
+    embed_func: Callable[[list[str]], list[list[float]]] = None,
+) -> list[int]:
+    """Embed every function whose source changed since it was last embedded.
+
+    Args:
+        session (Session): The database session.
+        batch_size (int, optional): Number of functions sent per embedding request.
+        embed_func (Callable, optional): Function mapping a list of texts to a list of
+            vectors. Defaults to llm.generate_embeddings.
+
+    Returns:
+        list[int]: The IDs of the functions that were (re-)embedded.
+    """
+    if embed_func is None:
+        embed_func = llm.generate_embeddings
+    # Rows read from files keep the hash of their source, so only the stale rows,
+    # and those whose source was set directly without a hash, are loaded
+    rows = session.execute(
+        select(
+            CodeFunction.id,
+            CodeFunction.function_string,
+            CodeFunction.content_hash,
+            CodeFunction.vector_hash,
+        ).where(
+            or_(
+                CodeFunction.vector.is_(None),
+                CodeFunction.content_hash.is_(None),
+                CodeFunction.vector_hash.is_distinct_from(CodeFunction.content_hash),
+            )
+        )
+    ).all()
+    stale = []
+    skipped = 0
+    for function_id, function_string, content_hash, vector_hash in rows:
+        source_hash = content_hash or compute_source_hash(function_string)
+        if source_hash == vector_hash:
+            continue
+        if not (function_string or "").strip():
+            skipped += 1
+            continue
+        stale.append((function_id, function_string, source_hash))
+    logger.info(
+        "%s functions need embedding, %s with no source skipped.", len(stale), skipped
+    )
+
+    embedded_ids = []
+    for start in range(0, len(stale), batch_size):
+        batch = stale[start : start + batch_size]
+        vectors = embed_func([text[:MAX_EMBED_CHARS] for _, text, _ in batch])
+        session.execute(
+            update(CodeFunction),
+            [
+                {"id": function_id, "vector": vector_to_blob(vector), "vector_hash": h}
+                for (function_id, _, h), vector in zip(batch, vectors)
+            ],
+        )
+        session.commit()
+        embedded_ids.extend(function_id for function_id, _, _ in batch)
+        logger.info("Embedded %s/%s functions.", len(embedded_ids), len(stale))
+    return embedded_ids
+
+
+def load_vector_matrix(session: Session) -> tuple[np.ndarray, np.ndarray]:
+    """Load all function vectors into one contiguous, L2-normalised matrix.
+
+    Args:
+        session (Session): The database session.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The function IDs and the (n, dim) float32 matrix,
+            where row i holds the vector of function ids[i].
+    """
+    rows = session.execute(
+        select(CodeFunction.id, CodeFunction.vector).where(
+            CodeFunction.vector.is_not(None)
+        )
+    ).all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=VECTOR_DTYPE)
+    dim = len(rows[0][1]) // np.dtype(VECTOR_DTYPE).itemsize
+    rows = [row for row in rows if len(row[1]) == dim * np.dtype(VECTOR_DTYPE).itemsize]
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=VECTOR_DTYPE)
+    matrix = matrix.reshape(len(rows), dim).copy()
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return ids, matrix
+
+
+def top_k_similar(
+    session: Session,
+    function_id: int,
+    k: int = 5,
+    vectors: tuple[np.ndarray, np.ndarray] = None,
+) -> list[tuple[int, float]]:
+    """Find the functions whose embeddings are most similar to a given function.
+
+    Args:
+        session (Session): The database session.
+        function_id (int): The ID of the function to compare against.
+        k (int, optional): The number of results to return. Defaults to 5.
+        vectors (tuple[np.ndarray, np.ndarray], optional): A result of
+            load_vector_matrix to reuse across queries. Loaded if not given.
+
+    Returns:
+        list[tuple[int, float]]: (function ID, cosine similarity) pairs, most similar
+            first, excluding the query function itself.
+    """
+    ids, matrix = vectors if vectors is not None else load_vector_matrix(session)
+    positions = np.flatnonzero(ids == function_id)
+    if not len(positions):
+        logger.info("Function %s has no embedding.", function_id)
+        return []
+    scores = matrix @ matrix[positions[0]]
+    scores[positions[0]] = -np.inf
+    k = min(k, len(ids) - 1)
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(ids[i]), float(scores[i])) for i in top]
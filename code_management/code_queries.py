@@ -0,0 +1,37 @@
+"""Queries over the code DB that load related rows up front and stream results."""
+
+from typing import Iterator
+
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session, joinedload
+
+from code_management.code_database import CodeFunction, CodeTest
+
+# Number of rows fetched from the cursor at a time when streaming results
+QUERY_CHUNK_SIZE = 500
+
+
+def functions_without_tests(
+    session: Session, chunk_size: int = QUERY_CHUNK_SIZE
+) -> Iterator[CodeFunction]:
+    """
+    Stream the functions that no test is linked to, with their classes loaded.
+
+    The selection runs as one query, and reading function.code_class (as
+    compute_test_name does) issues no further queries.
+
+    Args:
+        session (Session): The database session.
+        chunk_size (int): The number of rows held in memory at a time.
+
+    Yields:
+        CodeFunction: The untested functions, in ID order.
+    """
+    stmt = (
+        select(CodeFunction)
+        .where(~exists().where(CodeTest.function_id == CodeFunction.id))
+        .options(joinedload(CodeFunction.code_class))
+        .order_by(CodeFunction.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    yield from session.scalars(stmt)
@@ -2,14 +2,43 @@
 Module to read information from the code files.
 """
 import ast
+import time
+import zlib
 
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 import llm.llm_interface as llm
 import utils
-from code_management.code_database import CodeClass, CodeFunction, CodeTest, link_tests
+from code_management.code_database import (
+    CODE_CLASS_NATURAL_KEY,
+    CODE_FUNCTION_NATURAL_KEY,
+    CODE_TEST_NATURAL_KEY,
+    SOURCE_COMPRESSION_LEVEL,
+    CodeClass,
+    CodeFileBlob,
+    CodeFunction,
+    CodeTest,
+    CodeTestDependency,
+    CodeTestRun,
+)
 from functions import logger
 
+# Number of files written per transaction by bulk_create_code_objects
+INGEST_BATCH_SIZE = 200
+# Maximum number of IDs per DELETE, to stay under SQLite's variable limit
+DELETE_CHUNK_SIZE = 10000
+# Columns locating a row's source, compared to decide whether to rewrite it
+SPAN_COLUMNS = [
+    "content_hash",
+    "start_line",
+    "end_line",
+    "blob_id",
+    "start_byte",
+    "end_byte",
+]
+
 
 def read_code_file_descriptions(start_dir: str) -> dict:
     """
@@ -128,140 +157,393 @@ def extract_classes_and_functions(
     return classes, functions
 
 
-def create_code_objects(session: Session, file_path: str):
-    logger.info("Extracting classes and functions from %s", file_path)
-    with open(file_path, "r", encoding="utf-8") as file:
-        contents = file.read()
-    classes, functions = extract_classes_and_functions(contents)
-    for class_params in classes:
-        handle_class_processing(session, class_params, file_path, contents)
-    for function_params in functions:
-        handle_function_processing(session, function_params, file_path)
-    session.commit()
-    # Link tests to the functions they test
-    link_tests(session)
+def _line_offsets(data: bytes) -> list[int]:
+    """Get the byte offset at which each line of a file starts."""
+    offsets = [0]
+    for line in data.splitlines(keepends=True):
+        offsets.append(offsets[-1] + len(line))
+    return offsets
 
 
-def handle_class_processing(
-    session: Session, class_params: tuple, file_path: str, contents: str
-):
-    class_name, class_string, class_doc_string, class_body = class_params
-    existing_class = (
-        session.query(CodeClass)
-        .filter_by(class_name=class_name, file_path=file_path)
-        .first()
+def _span_columns(data: bytes, line_offsets: list[int], node: ast.AST) -> dict:
+    """Get the byte and line span and the content hash of a class or function node."""
+    # ast column offsets are in UTF-8 bytes
+    start_byte = line_offsets[node.lineno - 1] + node.col_offset
+    end_byte = line_offsets[node.end_lineno - 1] + node.end_col_offset
+    source = data[start_byte:end_byte].decode("utf-8")
+    return {
+        "content_hash": utils.compute_source_hash(source),
+        "start_line": node.lineno,
+        "end_line": node.end_lineno,
+        "start_byte": start_byte,
+        "end_byte": end_byte,
+    }
+
+
+def collect_code_rows(file_path: str) -> dict:
+    """Extract the file blob and the class, method, function and test rows of a file.
+
+    The rows hold no copy of their source, only its span in the file blob.
+
+    Args:
+        file_path (str): The path to the Python file.
+
+    Returns:
+        dict: The compressed file under "blob", and lists of column values keyed
+            by "classes", "methods", "functions" and "tests". Method rows carry
+            their "class_name" in place of a class ID.
+    """
+    with open(file_path, "rb") as file:
+        data = file.read()
+    contents = data.decode("utf-8")
+    line_offsets = _line_offsets(data)
+    rows = {
+        "blob": {
+            "content_hash": utils.compute_source_hash(contents),
+            "data": zlib.compress(data, SOURCE_COMPRESSION_LEVEL),
+            "size": len(data),
+        },
+        "classes": [],
+        "methods": [],
+        "functions": [],
+        "tests": [],
+    }
+    for node in ast.parse(contents).body:
+        if isinstance(node, ast.ClassDef):
+            rows["classes"].append(
+                {
+                    "class_name": node.name,
+                    "class_string": "",
+                    "file_path": file_path,
+                    "doc_string": ast.get_docstring(node) or "",
+                    **_span_columns(data, line_offsets, node),
+                }
+            )
+            for child in node.body:
+                if isinstance(child, ast.FunctionDef):
+                    rows["methods"].append(
+                        {
+                            "class_name": node.name,
+                            "function_name": child.name,
+                            "function_string": "",
+                            "file_path": file_path,
+                            "doc_string": ast.get_docstring(child) or "",
+                            "is_function": True,
+                            **_span_columns(data, line_offsets, child),
+                        }
+                    )
+        elif isinstance(node, ast.FunctionDef):
+            columns = _span_columns(data, line_offsets, node)
+            doc_string = ast.get_docstring(node) or ""
+            if _is_test(node.name, file_path):
+                rows["tests"].append(
+                    {
+                        "test_name": node.name,
+                        "test_string": "",
+                        "file_path": file_path,
+                        "doc_string": doc_string,
+                        **columns,
+                    }
+                )
+            else:
+                rows["functions"].append(
+                    {
+                        "function_name": node.name,
+                        "function_string": "",
+                        "file_path": file_path,
+                        "doc_string": doc_string,
+                        "class_id": None,
+                        "is_function": True,
+                        **columns,
+                    }
+                )
+    return rows
+
+
+def _upsert(session: Session, model, rows: list[dict], natural_key: list, columns):
+    """Insert rows, updating the given columns of rows whose natural key exists."""
+    if not rows:
+        return
+    # Insert into the table, as the rows are keyed by column name
+    stmt = sqlite_insert(model.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=natural_key,
+        set_={column: stmt.excluded[column] for column in columns},
     )
-    if existing_class is None:
-        logger.debug("Creating CodeClass object for %s", class_name)
-        class_obj = CodeClass(
-            class_string=class_string,
-            class_name=class_name,
-            file_path=file_path,
-            doc_string=class_doc_string,
-        )
-        session.add(class_obj)
-        session.commit()
-        session.refresh(class_obj)
-    else:
-        class_obj = existing_class
-    for node in class_body:
-        if isinstance(node, ast.FunctionDef):
-            handle_function_in_class_processing(
-                session, node, file_path, contents, class_obj
+    session.execute(stmt, rows)
+
+
+def _changed_rows(rows: list[dict], key, existing: dict, stats: dict) -> list[dict]:
+    """Select the rows that are new, or whose source or its location changed.
+
+    Matched entries are removed from existing, leaving the rows that vanished.
+    A row whose source is unchanged but which moved, or whose file changed
+    elsewhere, is written but counted as unchanged.
+
+    Args:
+        rows (list[dict]): The rows read from the files.
+        key (Callable): Maps a row to its natural key.
+        existing (dict): Maps the natural keys of stored rows to their (id,
+            content_hash, start_line, end_line, blob_id, start_byte, end_byte).
+        stats (dict): The counts to update.
+
+    Returns:
+        list[dict]: The rows to write.
+    """
+    # Where a name is defined twice, the last definition wins, as it does in Python
+    rows = {key(row): row for row in rows}
+    changed = []
+    for row_key, row in rows.items():
+        stored = existing.pop(row_key, None)
+        if stored is None:
+            stats["inserted"] += 1
+            changed.append(row)
+            continue
+        if stored[1] != row["content_hash"]:
+            stats["updated"] += 1
+        else:
+            stats["unchanged"] += 1
+        if tuple(stored[1:]) != tuple(row[column] for column in SPAN_COLUMNS):
+            changed.append(row)
+    return changed
+
+
+def _delete_rows(session: Session, model, ids: list[int]):
+    """Delete rows by ID, clearing the test links and dependencies pointing at them."""
+    for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+        chunk = ids[start : start + DELETE_CHUNK_SIZE]
+        if model is CodeFunction:
+            session.execute(
+                update(CodeTest)
+                .where(CodeTest.function_id.in_(chunk))
+                .values(function_id=None)
+            )
+            session.execute(
+                update(CodeTestDependency)
+                .where(CodeTestDependency.function_id.in_(chunk))
+                .values(function_id=None)
+            )
+        elif model is CodeClass:
+            session.execute(
+                update(CodeTest)
+                .where(CodeTest.class_id.in_(chunk))
+                .values(class_id=None)
+            )
+        elif model is CodeTest:
+            session.execute(
+                delete(CodeTestDependency).where(CodeTestDependency.test_id.in_(chunk))
             )
+            session.execute(delete(CodeTestRun).where(CodeTestRun.test_id.in_(chunk)))
+        session.execute(delete(model).where(model.id.in_(chunk)))
 
 
-def handle_function_in_class_processing(
-    session: Session,
-    node: ast.FunctionDef,
-    file_path: str,
-    contents: str,
-    class_obj: CodeClass,
-):
-    existing_function = (
-        session.query(CodeFunction)
-        .filter_by(
-            function_name=node.name,
-            file_path=file_path,
-            code_class=class_obj,
-        )
-        .first()
+def _stored_rows(session: Session, model, key_columns: list, file_paths: list[str]):
+    """Map the natural keys of the stored rows of some files to their spans."""
+    span_columns = [getattr(model, column) for column in SPAN_COLUMNS]
+    stmt = select(*key_columns, model.id, *span_columns).where(
+        model.file_path.in_(file_paths)
+    )
+    if model is CodeFunction:
+        stmt = stmt.outerjoin(CodeClass, CodeFunction.class_id == CodeClass.id)
+    n_keys = len(key_columns)
+    return {tuple(row[:n_keys]): tuple(row[n_keys:]) for row in session.execute(stmt)}
+
+
+def _write_blobs(session: Session, batch: list[dict]):
+    """Store each file once by content hash, and point its rows at the blob."""
+    blobs = {rows["blob"]["content_hash"]: rows["blob"] for rows in batch}
+    if not blobs:
+        return
+    stmt = sqlite_insert(CodeFileBlob.__table__).on_conflict_do_nothing(
+        index_elements=["content_hash"]
+    )
+    session.execute(stmt, list(blobs.values()))
+    blob_ids = dict(
+        session.execute(
+            select(CodeFileBlob.content_hash, CodeFileBlob.id).where(
+                CodeFileBlob.content_hash.in_(blobs)
+            )
+        ).all()
     )
-    if existing_function is None:
-        logger.debug("Creating CodeFunction object for %s", node.name)
-        function_string = ast.get_source_segment(contents, node)
-        function_doc_string = ast.get_docstring(node) or ""
-        function_obj = CodeFunction(
-            function_string=function_string,
-            function_name=node.name,
-            file_path=file_path,
-            doc_string=function_doc_string,
-            code_class=class_obj,
-            is_function=True,
+    for rows in batch:
+        blob_id = blob_ids[rows["blob"]["content_hash"]]
+        for kind in ("classes", "methods", "functions", "tests"):
+            for row in rows[kind]:
+                row["blob_id"] = blob_id
+
+
+def _delete_unused_blobs(session: Session) -> int:
+    """Delete the file blobs that no row references any more."""
+    used = (
+        select(CodeClass.blob_id)
+        .union(select(CodeFunction.blob_id), select(CodeTest.blob_id))
+        .subquery()
+    )
+    return session.execute(
+        delete(CodeFileBlob).where(
+            CodeFileBlob.id.not_in(
+                select(used.c.blob_id).where(used.c.blob_id.isnot(None))
+            )
         )
-        session.add(function_obj)
+    ).rowcount
 
 
-def handle_function_processing(
-    session: Session, function_params: tuple, file_path: str
+def _write_rows(
+    session: Session, batch: list[dict], file_paths: list[str], stats: dict
 ):
-    function_name, function_string, function_doc_string = function_params
-
-    if _is_test(function_name, file_path):
-        handle_test_function_processing(
-            session, function_name, function_string, file_path, function_doc_string
-        )
-    else:
-        handle_non_test_function_processing(
-            session, function_name, function_string, file_path, function_doc_string
-        )
+    """Write the new and changed rows of a batch of files and prune vanished ones.
 
+    Args:
+        session (Session): The database session.
+        batch (list[dict]): The rows collected from each file.
+        file_paths (list[str]): The files the rows were collected from.
+        stats (dict): The inserted, updated, deleted and unchanged counts to update.
+    """
+    _write_blobs(session, batch)
+    tracked = ["doc_string", *SPAN_COLUMNS]
+    stored_classes = _stored_rows(
+        session, CodeClass, [CodeClass.file_path, CodeClass.class_name], file_paths
+    )
+    stored_functions = _stored_rows(
+        session,
+        CodeFunction,
+        [CodeFunction.file_path, CodeClass.class_name, CodeFunction.function_name],
+        file_paths,
+    )
+    stored_tests = _stored_rows(
+        session, CodeTest, [CodeTest.file_path, CodeTest.test_name], file_paths
+    )
 
-def handle_test_function_processing(
-    session: Session,
-    function_name: str,
-    function_string: str,
-    file_path: str,
-    function_doc_string: str,
-):
-    existing_test = (
-        session.query(CodeTest)
-        .filter_by(test_name=function_name, file_path=file_path)
-        .first()
+    classes = _changed_rows(
+        [row for rows in batch for row in rows["classes"]],
+        lambda row: (row["file_path"], row["class_name"]),
+        stored_classes,
+        stats,
     )
-    if existing_test is None:
-        logger.debug("Creating CodeTest object for %s", function_name)
-        test_obj = CodeTest(
-            test_string=function_string,
-            test_name=function_name,
-            file_path=file_path,
-            doc_string=function_doc_string,
+    _upsert(
+        session, CodeClass, classes, CODE_CLASS_NATURAL_KEY, ["class_string", *tracked]
+    )
+    class_ids = {
+        (file_path, class_name): class_id
+        for class_id, file_path, class_name in session.execute(
+            select(CodeClass.id, CodeClass.file_path, CodeClass.class_name).where(
+                CodeClass.file_path.in_(file_paths)
+            )
         )
-        session.add(test_obj)
+    }
+    functions = _changed_rows(
+        [row for rows in batch for row in rows["functions"] + rows["methods"]],
+        lambda row: (row["file_path"], row.get("class_name"), row["function_name"]),
+        stored_functions,
+        stats,
+    )
+    for index, row in enumerate(functions):
+        if "class_name" in row:
+            row = dict(row)
+            row["class_id"] = class_ids[(row["file_path"], row.pop("class_name"))]
+            functions[index] = row
+    _upsert(
+        session,
+        CodeFunction,
+        functions,
+        CODE_FUNCTION_NATURAL_KEY,
+        ["function_string", *tracked],
+    )
+    tests = _changed_rows(
+        [row for rows in batch for row in rows["tests"]],
+        lambda row: (row["file_path"], row["test_name"]),
+        stored_tests,
+        stats,
+    )
+    _upsert(session, CodeTest, tests, CODE_TEST_NATURAL_KEY, ["test_string", *tracked])
+
+    # Whatever was not matched has been removed from its file
+    for model, vanished in (
+        (CodeTest, stored_tests),
+        (CodeFunction, stored_functions),
+        (CodeClass, stored_classes),
+    ):
+        _delete_rows(session, model, [stored[0] for stored in vanished.values()])
+        stats["deleted"] += len(vanished)
+
+
+def _prune_missing_files(session: Session, file_paths: list[str]) -> int:
+    """Delete the rows of files that are not among the given paths."""
+    present = set(file_paths)
+    deleted = 0
+    for model in (CodeTest, CodeFunction, CodeClass):
+        ids = [
+            row_id
+            for row_id, file_path in session.execute(
+                select(model.id, model.file_path).where(model.file_path.isnot(None))
+            )
+            if file_path not in present
+        ]
+        _delete_rows(session, model, ids)
+        deleted += len(ids)
+    return deleted
 
 
-def handle_non_test_function_processing(
+def bulk_create_code_objects(
     session: Session,
-    function_name: str,
-    function_string: str,
-    file_path: str,
-    function_doc_string: str,
-):
-    existing_function = (
-        session.query(CodeFunction)
-        .filter_by(function_name=function_name, file_path=file_path)
-        .first()
+    file_paths: list[str],
+    batch_size: int = INGEST_BATCH_SIZE,
+    prune: bool = False,
+) -> dict:
+    """Ingest many Python files with bulk upserts keyed on natural keys.
+
+    Each batch of files is written in a single transaction, with one statement per
+    table, instead of a query and commit per class, function and test. Each file
+    is stored once, compressed, and rows reference their source as a byte span of
+    it. Only rows whose source or its location changed are written, and classes,
+    functions and tests that no longer exist in their file are deleted.
+
+    Args:
+        session (Session): The database session.
+        file_paths (list[str]): The paths to the Python files.
+        batch_size (int, optional): The number of files per transaction.
+        prune (bool, optional): Whether file_paths is the whole project, so rows
+            from any other file should be deleted. Defaults to False.
+
+    Returns:
+        dict: Ingestion statistics: "files", "rows", "inserted", "updated",
+            "deleted", "unchanged", "seconds" and "rows_per_second".
+    """
+    start = time.perf_counter()
+    stats = {"files": 0, "inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    for batch_start in range(0, len(file_paths), batch_size):
+        batch, batch_files = [], []
+        for file_path in file_paths[batch_start : batch_start + batch_size]:
+            try:
+                batch.append(collect_code_rows(file_path))
+            except (SyntaxError, UnicodeDecodeError) as err:
+                logger.error("Could not read %s: %s", file_path, err)
+                continue
+            batch_files.append(file_path)
+        _write_rows(session, batch, batch_files, stats)
+        stats["files"] += len(batch_files)
+        session.commit()
+    if prune:
+        stats["deleted"] += _prune_missing_files(session, file_paths)
+    _delete_unused_blobs(session)
+    session.commit()
+    seconds = time.perf_counter() - start
+    stats["rows"] = stats["inserted"] + stats["updated"] + stats["unchanged"]
+    stats["seconds"] = seconds
+    stats["rows_per_second"] = stats["rows"] / seconds if seconds else 0.0
+    logger.info(
+        "Ingested %s rows from %s files in %.2fs (%.0f rows/s): "
+        "%s inserted, %s updated, %s deleted, %s unchanged.",
+        stats["rows"],
+        stats["files"],
+        seconds,
+        stats["rows_per_second"],
+        stats["inserted"],
+        stats["updated"],
+        stats["deleted"],
+        stats["unchanged"],
     )
-    if existing_function is None:
-        logger.debug("Creating CodeFunction object for %s", function_name)
-        function_obj = CodeFunction(
-            function_string=function_string,
-            function_name=function_name,
-            file_path=file_path,
-            doc_string=function_doc_string,
-            is_function=True,
-        )
-        session.add(function_obj)
+    return stats
 
 
 def _is_test(function_name: str, file_path: str) -> bool:
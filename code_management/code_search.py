@@ -0,0 +1,90 @@
+"""Full-text search over the classes, functions and tests stored in the code DB."""
+
+import re
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from code_management.migrations import (
+    SEARCH_KINDS,
+    SEARCH_ROWID_FACTOR,
+    SEARCH_TABLE,
+)
+
+# BM25 column weights for name, source and doc_string: a match in a name counts most
+SEARCH_WEIGHTS = (10.0, 1.0, 4.0)
+SEARCH_LIMIT = 20
+_KIND_NAMES = {code: kind for kind, code in SEARCH_KINDS.items()}
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 query that matches all of its terms.
+
+    Each term is quoted, so symbols like "get_engine" or "a.b" are searched as
+    phrases rather than parsed as query syntax.
+
+    Args:
+        query (str): The free text to search for.
+
+    Returns:
+        str: The FTS5 MATCH expression.
+    """
+    terms = re.findall(r"\S+", query)
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_code(
+    session: Session,
+    query: str,
+    limit: int = SEARCH_LIMIT,
+    kind: str = None,
+    raw: bool = False,
+) -> list[dict]:
+    """
+    Search the names, source and docstrings of the stored code, best match first.
+
+    Args:
+        session (Session): The database session.
+        query (str): The text to search for.
+        limit (int): The maximum number of results. Defaults to 20.
+        kind (str, optional): Only return "class", "function" or "test" results.
+        raw (bool): Whether query is already an FTS5 expression, e.g. with OR,
+            NEAR or prefix* terms. Defaults to False.
+
+    Returns:
+        list[dict]: The matches, each with "kind", "id", "name", "file_path",
+            "score" (lower is better) and "snippet".
+    """
+    match = query if raw else build_match_query(query)
+    if not match:
+        return []
+    where = f"{SEARCH_TABLE} MATCH :match"
+    params = {"match": match, "limit": limit}
+    if kind is not None:
+        where += f" AND rowid % {SEARCH_ROWID_FACTOR} = :kind"
+        params["kind"] = SEARCH_KINDS[kind]
+    # Ordering by rank lets FTS5 sort the matches itself, so the columns, read from
+    # the code tables, are only looked up for the rows returned
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    params["rank"] = f"bm25({weights})"
+    rows = session.execute(
+        text(
+            f"SELECT rowid, name, file_path, rank, "
+            f"snippet({SEARCH_TABLE}, 1, '[', ']', '...', 12) "
+            f"FROM {SEARCH_TABLE} WHERE {where} AND rank MATCH :rank "
+            "ORDER BY rank LIMIT :limit"
+        ),
+        params,
+    )
+    return [
+        {
+            "kind": _KIND_NAMES[rowid % SEARCH_ROWID_FACTOR],
+            "id": rowid // SEARCH_ROWID_FACTOR,
+            "name": name,
+            "file_path": file_path,
+            "score": score,
+            "snippet": snippet,
+        }
+        for rowid, name, file_path, score, snippet in rows
+    ]
@@ -0,0 +1,179 @@
+"""Check generated code before it is written to disk or run.
+
+A generation is rejected if it does not compile, if one of its imports cannot
+be resolved, or if it does not define the function that was asked for. Project
+imports are checked against the top-level names of the project module, parsed
+once per file version; other imports against the installed packages. This costs
+milliseconds, against a pytest subprocess and a revise cycle for a bad
+generation found by running it.
+"""
+
+import ast
+import functools
+import importlib.util
+import os
+
+from functions import logger
+
+# Running totals of the generations checked and rejected
+validation_stats = {"checked": 0, "rejected": 0}
+
+
+def _scope_names(statements: list[ast.stmt]) -> set[str]:
+    """Get the names bound at the top level of a module, including in if/try blocks."""
+    names = set()
+    for node in statements:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                names.update(
+                    name.id for name in ast.walk(target) if isinstance(name, ast.Name)
+                )
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, (ast.If, ast.Try, ast.With)):
+            names.update(_scope_names(node.body))
+            names.update(_scope_names(getattr(node, "orelse", [])))
+            names.update(_scope_names(getattr(node, "finalbody", [])))
+            for handler in getattr(node, "handlers", []):
+                names.update(_scope_names(handler.body))
+    return names
+
+
+@functools.lru_cache(maxsize=256)
+def _module_names(path: str, mtime: float) -> frozenset:
+    """
+    Get the top-level names of a project module, or None if any name may exist.
+
+    The modification time is part of the cache key, so an edited module is parsed
+    again.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            module = ast.parse(file.read())
+    except (OSError, SyntaxError, ValueError):
+        return None
+    names = _scope_names(module.body)
+    star_import = any(
+        isinstance(node, ast.ImportFrom) and node.names[0].name == "*"
+        for node in module.body
+    )
+    if star_import or "__getattr__" in names:
+        return None
+    return frozenset(names)
+
+
+def _project_module(module: str, directory: str) -> str:
+    """Get the path to a project module or package, or None if there is none."""
+    base = os.path.join(directory, *module.split("."))
+    for path in (f"{base}.py", os.path.join(base, "__init__.py"), base):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _is_installed(module: str) -> bool:
+    """Check whether the top-level package of a module is installed."""
+    try:
+        return importlib.util.find_spec(module.split(".")[0]) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _check_import(node: ast.stmt, directory: str) -> list[str]:
+    """Get the problems resolving an import statement."""
+    if isinstance(node, ast.Import):
+        return [
+            f"No module named {alias.name!r}."
+            for alias in node.names
+            if not _project_module(alias.name, directory)
+            and not _is_installed(alias.name)
+        ]
+    if node.level or not node.module:
+        # Relative imports depend on where the code is written
+        return []
+    path = _project_module(node.module, directory)
+    if path is None:
+        if _is_installed(node.module):
+            return []
+        return [f"No module named {node.module!r}."]
+    names = (
+        _module_names(path, os.path.getmtime(path)) if path.endswith(".py") else set()
+    )
+    if names is None:
+        return []
+    package = os.path.dirname(path) if path.endswith("__init__.py") else path
+    return [
+        f"Cannot import {alias.name!r} from {node.module!r}."
+        for alias in node.names
+        if alias.name != "*"
+        and alias.name not in names
+        and not (os.path.isdir(package) and _project_module(alias.name, package))
+    ]
+
+
+def validate_generated_code(
+    code: str,
+    imports: list[str] = None,
+    expected_name: str = None,
+    directory: str = ".",
+) -> list[str]:
+    """
+    Check generated code and its import statements before they are used.
+
+    Args:
+        code (str): The generated code.
+        imports (list[str]): The generated import statements.
+        expected_name (str): The name of the function the code must define, if any.
+        directory (str): The project root, which project imports are resolved from.
+
+    Returns:
+        list[str]: A description of each problem, empty if the code is valid.
+    """
+    validation_stats["checked"] += 1
+    problems = []
+    import_nodes = []
+    if not code:
+        problems.append("No code was generated.")
+    else:
+        try:
+            compile(code, "<generated>", "exec", dont_inherit=True)
+            module = ast.parse(code)
+        except (SyntaxError, ValueError) as error:
+            problems.append(f"The code does not compile: {error}")
+        else:
+            import_nodes.extend(
+                node
+                for node in ast.walk(module)
+                if isinstance(node, (ast.Import, ast.ImportFrom))
+            )
+            defined = {
+                node.name
+                for node in module.body
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            }
+            if expected_name and expected_name not in defined:
+                problems.append(f"The code does not define a function {expected_name}.")
+    for statement in imports or []:
+        if not statement.strip():
+            continue
+        try:
+            statement_nodes = ast.parse(statement).body
+        except SyntaxError:
+            problems.append(f"The import statement {statement!r} does not compile.")
+            continue
+        if not all(
+            isinstance(node, (ast.Import, ast.ImportFrom)) for node in statement_nodes
+        ):
+            problems.append(f"{statement!r} is not an import statement.")
+            continue
+        import_nodes.extend(statement_nodes)
+    for node in import_nodes:
+        problems.extend(_check_import(node, directory))
+    if problems:
+        validation_stats["rejected"] += 1
+        logger.info("Generated code rejected: %s", " ".join(problems))
+    return problems
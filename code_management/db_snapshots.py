@@ -0,0 +1,279 @@
+"""Snapshots of the code DB keyed by the git tree they were built from.
+
+Switching branches leaves code.db describing a different tree. Rather than
+re-parse the project after every checkout, a copy of the DB is saved for each
+clean tree it is synced to, and restored when that tree is checked out again.
+Copies are made with SQLite's online backup API, so they are consistent even
+while other connections are open.
+
+Only the code index in a snapshot is tied to its tree. What was recorded by
+embedding and running the code since, such as embeddings, test statuses and
+durations and the test run history, is carried over from the live DB when a
+snapshot is restored.
+"""
+
+import os
+import sqlite3
+import tempfile
+
+import utils
+from code_management.code_database import (
+    DEFAULT_DB_PATH,
+    dispose_engines,
+    get_engine,
+    link_tests,
+    session_scope,
+)
+from code_management.code_reader import bulk_create_code_objects
+from code_management.vector_index import index_path_for_db
+from functions import logger
+from git_management.git_handler import GitHandler, get_git_handler
+
+# Directory holding the snapshots, relative to the working directory
+SNAPSHOT_DIR = ".code_db_snapshots"
+# Number of snapshots kept; the least recently used are removed first
+SNAPSHOT_LIMIT = 20
+SNAPSHOT_SUFFIX = ".db"
+
+
+def _db_file(db_path: str) -> str:
+    """Get the file of an SQLite DB from its SQLAlchemy URL."""
+    return db_path.split("///", 1)[-1]
+
+
+def snapshot_path(tree_hash: str, snapshot_dir: str = SNAPSHOT_DIR) -> str:
+    """
+    Get the path of the snapshot for a git tree.
+
+    Args:
+        tree_hash (str): The hash of the git tree.
+        snapshot_dir (str): The directory holding the snapshots.
+
+    Returns:
+        str: The snapshot file path.
+    """
+    return os.path.join(snapshot_dir, tree_hash + SNAPSHOT_SUFFIX)
+
+
+def _copy_db(source_file: str, target_file: str):
+    """Copy an SQLite DB with the online backup API."""
+    source = sqlite3.connect(source_file)
+    target = sqlite3.connect(target_file)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def _copy_file(source_file: str, target_file: str):
+    """Copy a file through a temporary file, so readers never see a partial copy."""
+    with open(source_file, "rb") as source:
+        data = source.read()
+    with open(target_file + ".tmp", "wb") as target:
+        target.write(data)
+    os.replace(target_file + ".tmp", target_file)
+
+
+# Statements carrying recorded data from the live DB, attached as "live", into
+# a snapshot being restored. Rows are matched on their natural keys.
+_CARRY_OVER_STATEMENTS = [
+    "CREATE TEMP TABLE class_map AS SELECT c.id, l.id AS live_id "
+    "FROM main.code_class c JOIN live.code_class l "
+    "ON l.file_path = c.file_path AND l.class_name = c.class_name",
+    "CREATE TEMP TABLE function_map AS SELECT f.id, l.id AS live_id "
+    "FROM main.code_function f JOIN live.code_function l "
+    "ON l.file_path = f.file_path AND l.function_name = f.function_name "
+    "LEFT JOIN main.code_class fc ON fc.id = f.class_id "
+    "LEFT JOIN live.code_class lc ON lc.id = l.class_id "
+    "WHERE fc.class_name IS lc.class_name",
+    "CREATE TEMP TABLE test_map AS SELECT t.id, l.id AS live_id "
+    "FROM main.code_test t JOIN live.code_test l "
+    "ON l.file_path = t.file_path AND l.test_name = t.test_name",
+    # A status is kept where the source it was recorded for is unchanged
+    "UPDATE main.code_class AS c SET test_status = l.test_status "
+    "FROM temp.class_map m JOIN live.code_class l ON l.id = m.live_id "
+    "WHERE m.id = c.id AND l.content_hash IS c.content_hash",
+    "UPDATE main.code_function AS f SET test_status = l.test_status "
+    "FROM temp.function_map m JOIN live.code_function l ON l.id = m.live_id "
+    "WHERE m.id = f.id AND l.content_hash IS f.content_hash",
+    "UPDATE main.code_test AS t SET test_status = l.test_status "
+    "FROM temp.test_map m JOIN live.code_test l ON l.id = m.live_id "
+    "WHERE m.id = t.id AND l.content_hash IS t.content_hash",
+    # An embedding is kept where it was built from the snapshot's source
+    "UPDATE main.code_function AS f SET vector = l.vector, vector_hash = l.vector_hash "
+    "FROM temp.function_map m JOIN live.code_function l ON l.id = m.live_id "
+    "WHERE m.id = f.id AND l.vector IS NOT NULL AND l.vector_hash = f.content_hash",
+    "UPDATE main.code_test AS t SET duration = l.duration "
+    "FROM temp.test_map m JOIN live.code_test l ON l.id = m.live_id "
+    "WHERE m.id = t.id AND l.duration IS NOT NULL",
+    # The live history includes everything recorded up to now
+    "DELETE FROM main.code_test_run",
+    "INSERT INTO main.code_test_run "
+    "(test_id, outcome, duration, failure_signature, test_hash, run_at) "
+    "SELECT m.id, r.outcome, r.duration, r.failure_signature, r.test_hash, r.run_at "
+    "FROM live.code_test_run r JOIN temp.test_map m ON m.live_id = r.test_id",
+]
+
+
+def _carry_over_recorded_data(target_file: str, live_file: str):
+    """
+    Copy embeddings, test statuses, durations and run history into a restored DB.
+
+    Args:
+        target_file (str): The snapshot copy being restored, at the current schema.
+        live_file (str): The live DB it will replace.
+    """
+    connection = sqlite3.connect(target_file)
+    try:
+        connection.execute("ATTACH DATABASE ? AS live", (live_file,))
+        with connection:
+            for statement in _CARRY_OVER_STATEMENTS:
+                connection.execute(statement)
+        connection.execute("DETACH DATABASE live")
+    finally:
+        connection.close()
+
+
+def save_snapshot(
+    tree_hash: str,
+    db_path: str = DEFAULT_DB_PATH,
+    snapshot_dir: str = SNAPSHOT_DIR,
+    limit: int = SNAPSHOT_LIMIT,
+) -> str:
+    """
+    Save a snapshot of the DB, and its vector index if any, for a git tree.
+
+    Args:
+        tree_hash (str): The hash of the git tree the DB describes.
+        db_path (str): The SQLAlchemy URL of the DB.
+        snapshot_dir (str): The directory holding the snapshots.
+        limit (int): The number of snapshots to keep.
+
+    Returns:
+        str: The snapshot file path.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = snapshot_path(tree_hash, snapshot_dir)
+    handle, temp_path = tempfile.mkstemp(suffix=SNAPSHOT_SUFFIX, dir=snapshot_dir)
+    os.close(handle)
+    try:
+        _copy_db(_db_file(db_path), temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    index_path = index_path_for_db(db_path)
+    if os.path.exists(index_path):
+        _copy_file(index_path, index_path_for_db(path))
+    logger.info("Saved code DB snapshot for tree %s", tree_hash)
+    prune_snapshots(snapshot_dir, limit)
+    return path
+
+
+def restore_snapshot(
+    tree_hash: str, db_path: str = DEFAULT_DB_PATH, snapshot_dir: str = SNAPSHOT_DIR
+) -> bool:
+    """
+    Restore the DB, and its vector index if any, from the snapshot for a git tree.
+
+    Open engines are disposed of first; the next session reconnects to the restored
+    DB. Embeddings, test statuses and durations, and the test run history are
+    carried over from the live DB, so only the code index is rolled back.
+
+    Args:
+        tree_hash (str): The hash of the git tree.
+        db_path (str): The SQLAlchemy URL of the DB.
+        snapshot_dir (str): The directory holding the snapshots.
+
+    Returns:
+        bool: True if a snapshot was restored, False if there is none for the tree.
+    """
+    path = snapshot_path(tree_hash, snapshot_dir)
+    if not os.path.exists(path):
+        return False
+    dispose_engines()
+    db_file = _db_file(db_path)
+    handle, temp_path = tempfile.mkstemp(
+        suffix=SNAPSHOT_SUFFIX, dir=os.path.dirname(os.path.abspath(db_file))
+    )
+    os.close(handle)
+    try:
+        _copy_db(path, temp_path)
+        # Bring the copy up to the current schema before writing to it
+        get_engine(f"sqlite:///{temp_path}")
+        dispose_engines()
+        if os.path.exists(db_file):
+            _carry_over_recorded_data(temp_path, db_file)
+        _copy_db(temp_path, db_file)
+    finally:
+        for temp_file in (temp_path, temp_path + "-wal", temp_path + "-shm"):
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+    index_path = index_path_for_db(db_path)
+    snapshot_index_path = index_path_for_db(path)
+    if os.path.exists(snapshot_index_path):
+        _copy_file(snapshot_index_path, index_path)
+    elif os.path.exists(index_path):
+        os.remove(index_path)
+    # Mark the snapshot as recently used, so pruning keeps it
+    os.utime(path)
+    logger.info("Restored code DB snapshot for tree %s", tree_hash)
+    return True
+
+
+def prune_snapshots(snapshot_dir: str = SNAPSHOT_DIR, limit: int = SNAPSHOT_LIMIT):
+    """
+    Remove the least recently used snapshots beyond the limit.
+
+    Args:
+        snapshot_dir (str): The directory holding the snapshots.
+        limit (int): The number of snapshots to keep.
+    """
+    paths = [
+        os.path.join(snapshot_dir, name)
+        for name in os.listdir(snapshot_dir)
+        if name.endswith(SNAPSHOT_SUFFIX)
+    ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[limit:]:
+        os.remove(path)
+        if os.path.exists(index_path_for_db(path)):
+            os.remove(index_path_for_db(path))
+
+
+def sync_db(
+    start_dir: str = ".",
+    db_path: str = DEFAULT_DB_PATH,
+    snapshot_dir: str = SNAPSHOT_DIR,
+    git_handler: GitHandler = None,
+) -> bool:
+    """
+    Bring the DB in line with the checked-out git tree.
+
+    The snapshot for the tree is restored if there is one. Uncommitted changes to
+    Python files are then ingested incrementally on top of it. With no snapshot,
+    the project is ingested, and the result saved if the working tree is clean.
+
+    Args:
+        start_dir (str): The path to the directory to read.
+        db_path (str): The SQLAlchemy URL of the DB.
+        snapshot_dir (str): The directory holding the snapshots.
+        git_handler (GitHandler): The handler used to query git.
+
+    Returns:
+        bool: True if the DB was restored from a snapshot.
+    """
+    git_handler = git_handler or get_git_handler()
+    tree_hash = git_handler.get_tree_hash()
+    clean = git_handler.is_working_tree_clean("*.py")
+    restored = restore_snapshot(tree_hash, db_path, snapshot_dir)
+    if restored and clean:
+        return True
+    with session_scope(db_path) as db_session:
+        file_paths = utils.get_python_files(start_dir, skip_tests=False)
+        bulk_create_code_objects(db_session, file_paths, prune=True)
+        link_tests(db_session)
+    if clean:
+        save_snapshot(tree_hash, db_path, snapshot_dir)
+    return restored
@@ -0,0 +1,176 @@
+"""A single writer thread that serialises writes to the code DB.
+
+SQLite allows one writer at a time. Rather than have every worker open its own
+session and contend for the lock, workers submit write jobs to a DatabaseWriter,
+which applies them in order on one thread and commits them in groups. Reads can
+still use session_scope from any thread, as WAL mode lets them run alongside
+the writer.
+"""
+
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from code_management.code_database import (
+    DEFAULT_DB_PATH,
+    CodeFunction,
+    CodeTest,
+    add_test_to_db,
+    session_scope,
+)
+from functions import logger
+import utils
+
+# Maximum number of queued jobs committed in one transaction
+WRITE_BATCH_SIZE = 100
+# Marks the end of the queue when the writer is stopped
+_STOP = object()
+
+
+class DatabaseWriter:
+    """
+    Apply write jobs to the code DB on a dedicated thread.
+
+    A job is a callable taking a session as its first argument. Jobs queued while
+    the writer is busy are committed together; if one fails, the others in its
+    group are retried one by one so that only the failing job's future raises.
+
+    Usage:
+        with DatabaseWriter() as writer:
+            future = writer.submit(set_test_status, test_id, "pass")
+            await writer.run(set_test_status, test_id, "pass")  # from asyncio
+    """
+
+    def __init__(
+        self, db_path: str = DEFAULT_DB_PATH, batch_size: int = WRITE_BATCH_SIZE
+    ):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.stats = {"jobs": 0, "failed": 0, "commits": 0}
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self) -> "DatabaseWriter":
+        """Start the writer thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="db-writer", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Apply the jobs already queued, then stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "DatabaseWriter":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def submit(self, job, *args, **kwargs) -> Future:
+        """
+        Queue a write job.
+
+        Args:
+            job (Callable): Called as job(session, *args, **kwargs) on the writer
+                thread.
+
+        Returns:
+            Future: Resolves to the job's return value once it is committed.
+        """
+        if self._thread is None:
+            raise RuntimeError("The database writer is not running.")
+        future = Future()
+        self._queue.put((future, job, args, kwargs))
+        return future
+
+    async def run(self, job, *args, **kwargs):
+        """Queue a write job and wait for it to be committed without blocking."""
+        return await asyncio.wrap_future(self.submit(job, *args, **kwargs))
+
+    def _next_batch(self) -> tuple[list, bool]:
+        """Wait for a job, then take any others already queued."""
+        batch = []
+        item = self._queue.get()
+        while item is not _STOP:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _run(self):
+        """Apply queued jobs until stopped."""
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self._apply(batch)
+            except Exception:  # pylint: disable=broad-except
+                logger.warning("Write batch failed; retrying its jobs one by one")
+                for item in batch:
+                    self._apply_one(item)
+            else:
+                for (future, _, _, _), result in zip(batch, results):
+                    future.set_result(result)
+
+    def _apply(self, batch: list) -> list:
+        """Apply a batch of jobs in one transaction."""
+        with session_scope(self.db_path) as session:
+            results = [job(session, *args, **kwargs) for _, job, args, kwargs in batch]
+        self.stats["jobs"] += len(batch)
+        self.stats["commits"] += 1
+        return results
+
+    def _apply_one(self, item):
+        """Apply a single job in its own transaction, reporting any error."""
+        future = item[0]
+        try:
+            result = self._apply([item])
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Write job %r failed: %s", item[1], error)
+            self.stats["failed"] += 1
+            future.set_exception(error)
+        else:
+            future.set_result(result[0])
+
+
+def set_test_status(session: Session, test_id: int, status: str):
+    """Write job: set the status of a test."""
+    session.execute(
+        update(CodeTest).where(CodeTest.id == test_id).values(test_status=status)
+    )
+
+
+def record_test(
+    session: Session, function_id: int, test_code: str, test_file_name: str
+):
+    """Write job: record a generated test for a function, returning the test's ID."""
+    function = session.get(CodeFunction, function_id)
+    test = add_test_to_db(session, function, test_code, test_file_name)
+    session.flush()
+    return test.id
+
+
+def save_revised_test(session: Session, test_id: int, test_code: str, status: str):
+    """Write job: store a revised test's code, unless None, and status."""
+    test = session.get(CodeTest, test_id)
+    if test_code is not None:
+        test.test_string = test_code
+        test.content_hash = utils.compute_source_hash(test_code)
+    test.test_status = status
@@ -0,0 +1,351 @@
+"""Versioned schema migrations for the code DB.
+
+create_all only creates missing tables and never alters an existing code.db, so
+schema changes to existing tables are made here. Each migration brings the DB from
+version N - 1 to N, and the version is stored in SQLite's user_version pragma.
+Migrations must be idempotent: a DB created by create_all already has the current
+schema but starts at version 0.
+"""
+
+from sqlalchemy import Connection, Engine
+
+from functions import logger
+
+
+def _column_names(connection: Connection, table: str) -> set[str]:
+    """Get the names of the columns of a table."""
+    rows = connection.exec_driver_sql(f"PRAGMA table_info({table})").all()
+    return {row[1] for row in rows}
+
+
+def _add_column(connection: Connection, table: str, column: str, column_type: str):
+    """Add a nullable column to a table if it does not exist yet."""
+    if column not in _column_names(connection, table):
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+        )
+
+
+def _deduplicate(
+    connection: Connection,
+    table: str,
+    key_columns: str,
+    references: list[tuple[str, str]],
+):
+    """Delete rows that repeat the natural key of an older row.
+
+    References to a deleted row are repointed to the row that is kept. Rows with
+    a NULL file path are left alone, as NULLs never conflict in a unique index.
+
+    Args:
+        connection (Connection): The connection to the DB.
+        table (str): The table to deduplicate.
+        key_columns (str): The SQL expressions making up the natural key.
+        references (list[tuple[str, str]]): (table, column) pairs referencing the
+            table's ID.
+    """
+    connection.exec_driver_sql("DROP TABLE IF EXISTS temp.duplicates")
+    connection.exec_driver_sql(
+        f"CREATE TEMP TABLE duplicates AS SELECT id, keep_id FROM ("
+        f"SELECT id, MIN(id) OVER (PARTITION BY {key_columns}) AS keep_id "
+        f"FROM {table} WHERE file_path IS NOT NULL) WHERE id != keep_id"
+    )
+    for ref_table, ref_column in references:
+        connection.exec_driver_sql(
+            f"UPDATE {ref_table} SET {ref_column} = (SELECT keep_id FROM duplicates "
+            f"WHERE duplicates.id = {ref_table}.{ref_column}) "
+            f"WHERE {ref_column} IN (SELECT id FROM duplicates)"
+        )
+    deleted = connection.exec_driver_sql(
+        f"DELETE FROM {table} WHERE id IN (SELECT id FROM duplicates)"
+    ).rowcount
+    connection.exec_driver_sql("DROP TABLE temp.duplicates")
+    if deleted:
+        logger.info("Removed %s duplicate rows from %s", deleted, table)
+
+
+def _add_embedding_columns(connection: Connection):
+    """Add the hash of the source each embedding was built from."""
+    _add_column(connection, "code_function", "vector_hash", "VARCHAR")
+
+
+def _add_natural_keys(connection: Connection):
+    """Remove duplicate rows, then enforce the natural keys with unique indexes."""
+    _deduplicate(
+        connection,
+        "code_class",
+        "file_path, class_name",
+        [("code_function", "class_id"), ("code_test", "class_id")],
+    )
+    _deduplicate(
+        connection,
+        "code_function",
+        "file_path, coalesce(class_id, 0), function_name",
+        [("code_test", "function_id")],
+    )
+    _deduplicate(connection, "code_test", "file_path, test_name", [])
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_code_class_natural_key "
+        "ON code_class (file_path, class_name)"
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_code_function_natural_key "
+        "ON code_function (file_path, coalesce(class_id, 0), function_name)"
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_code_test_natural_key "
+        "ON code_test (file_path, test_name)"
+    )
+
+
+def _add_lookup_indexes(connection: Connection):
+    """Index the name, status and foreign key columns used to look rows up."""
+    indexes = {
+        "code_class": ["class_name", "test_status"],
+        "code_function": ["function_name", "test_status", "class_id"],
+        "code_test": ["test_status", "function_id", "class_id"],
+    }
+    for table, columns in indexes.items():
+        for column in columns:
+            connection.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"
+            )
+
+
+def _add_change_detection_columns(connection: Connection):
+    """Add the content hash and line span used to detect changed code."""
+    for table in ("code_class", "code_function", "code_test"):
+        _add_column(connection, table, "content_hash", "VARCHAR")
+        _add_column(connection, table, "start_line", "INTEGER")
+        _add_column(connection, table, "end_line", "INTEGER")
+
+
+# Full-text index over the code. Its rowid encodes the source row as
+# id * SEARCH_ROWID_FACTOR + kind, so triggers can find a row's entry directly.
+SEARCH_TABLE = "code_search"
+SEARCH_ROWID_FACTOR = 4
+SEARCH_KINDS = {"class": 1, "function": 2, "test": 3}
+# (table, name column, source column) indexed for each kind
+SEARCH_SOURCES = {
+    "class": ("code_class", "class_name", "class_string"),
+    "function": ("code_function", "function_name", "function_string"),
+    "test": ("code_test", "test_name", "test_string"),
+}
+
+
+# SQL for the source of a row ("NEW", "OLD" or a table) that may be a file span
+SPAN_SOURCE_EXPRESSION = (
+    "CASE WHEN {row}.blob_id IS NULL THEN {row}.{column} ELSE code_span("
+    "(SELECT data FROM code_file_blob WHERE id = {row}.blob_id), "
+    "{row}.start_byte, {row}.end_byte) END"
+)
+# View the external-content search index reads its rows from
+SEARCH_CONTENT_VIEW = "code_search_content_view"
+
+
+def _create_search_triggers(
+    connection: Connection,
+    source_expression: str = "{row}.{column}",
+    source_columns: tuple[str, ...] = (),
+    external_content: bool = False,
+):
+    """Create the triggers that keep the full-text index in sync with the code.
+
+    Args:
+        connection (Connection): The connection to the DB.
+        source_expression (str): SQL for a row's source, formatted with the row
+            ("NEW" or "OLD") and the source column.
+        source_columns (tuple[str, ...]): Further columns the source depends on.
+        external_content (bool): Whether the index stores no copy of the rows, so
+            an entry is removed by passing the old values to its delete command.
+    """
+    for kind, (table, name_column, source_column) in SEARCH_SOURCES.items():
+        rowid = f"{{row}}.id * {SEARCH_ROWID_FACTOR} + {SEARCH_KINDS[kind]}"
+        source = source_expression.format(row="NEW", column=source_column)
+        insert = (
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, source, doc_string, file_path) "
+            f"VALUES ({rowid.format(row='NEW')}, NEW.{name_column}, "
+            f"{source}, NEW.doc_string, NEW.file_path);"
+        )
+        if external_content:
+            old_source = source_expression.format(row="OLD", column=source_column)
+            delete = (
+                f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, name, source, "
+                f"doc_string, file_path) VALUES ('delete', {rowid.format(row='OLD')}, "
+                f"OLD.{name_column}, {old_source}, OLD.doc_string, OLD.file_path);"
+            )
+        else:
+            delete = (
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid = {rowid.format(row='OLD')};"
+            )
+        update_columns = ", ".join(
+            (name_column, source_column, "doc_string", "file_path", *source_columns)
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT "
+            f"ON {table} BEGIN {insert} END"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE "
+            f"ON {table} BEGIN {delete} END"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF "
+            f"{update_columns} ON {table} BEGIN {delete} {insert} END"
+        )
+
+
+def _add_full_text_search(connection: Connection):
+    """Create the FTS5 index over names, source and docstrings, and fill it."""
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, source, doc_string, file_path UNINDEXED)"
+    )
+    _create_search_triggers(connection)
+    connection.exec_driver_sql(f"DELETE FROM {SEARCH_TABLE}")
+    for kind, (table, name_column, source_column) in SEARCH_SOURCES.items():
+        connection.exec_driver_sql(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, source, doc_string, file_path) "
+            f"SELECT id * {SEARCH_ROWID_FACTOR} + {SEARCH_KINDS[kind]}, "
+            f"{name_column}, {source_column}, doc_string, file_path FROM {table}"
+        )
+
+
+def _add_source_spans(connection: Connection):
+    """Let rows reference their source as a byte span of a compressed file blob.
+
+    The code_file_blob table itself is created by create_all. The search triggers
+    are recreated to read spans through the code_span SQL function.
+    """
+    for table, _, _ in SEARCH_SOURCES.values():
+        _add_column(
+            connection, table, "blob_id", "INTEGER REFERENCES code_file_blob(id)"
+        )
+        _add_column(connection, table, "start_byte", "INTEGER")
+        _add_column(connection, table, "end_byte", "INTEGER")
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_blob_id ON {table} (blob_id)"
+        )
+    _drop_search_triggers(connection)
+    _create_search_triggers(
+        connection, SPAN_SOURCE_EXPRESSION, ("blob_id", "start_byte", "end_byte")
+    )
+
+
+def _drop_search_triggers(connection: Connection):
+    """Drop the triggers that keep the full-text index in sync with the code."""
+    for table, _, _ in SEARCH_SOURCES.values():
+        for trigger in ("insert", "delete", "update"):
+            connection.exec_driver_sql(
+                f"DROP TRIGGER IF EXISTS {table}_search_{trigger}"
+            )
+
+
+def _search_external_content(connection: Connection):
+    """Rebuild the full-text index so it stores no copy of the source.
+
+    The index reads its rows from a view over the code tables, which slices the
+    source of rows read from files out of their compressed file blobs. The view
+    finds a row by its search rowid through an index on that expression.
+    """
+    _drop_search_triggers(connection)
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    connection.exec_driver_sql(f"DROP VIEW IF EXISTS {SEARCH_CONTENT_VIEW}")
+    selects = []
+    for kind, (table, name_column, source_column) in SEARCH_SOURCES.items():
+        rowid = f"id * {SEARCH_ROWID_FACTOR} + {SEARCH_KINDS[kind]}"
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_search_rowid ON {table} ({rowid})"
+        )
+        source = SPAN_SOURCE_EXPRESSION.format(row=table, column=source_column)
+        selects.append(
+            f"SELECT {rowid} AS search_rowid, {name_column} AS name, "
+            f"{source} AS source, doc_string, file_path FROM {table}"
+        )
+    connection.exec_driver_sql(
+        f"CREATE VIEW {SEARCH_CONTENT_VIEW} AS " + " UNION ALL ".join(selects)
+    )
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        "name, source, doc_string, file_path UNINDEXED, "
+        f"content='{SEARCH_CONTENT_VIEW}', content_rowid='search_rowid')"
+    )
+    _create_search_triggers(
+        connection,
+        SPAN_SOURCE_EXPRESSION,
+        ("blob_id", "start_byte", "end_byte"),
+        external_content=True,
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"
+    )
+
+
+def _add_test_durations(connection: Connection):
+    """Add the duration of each test's last run."""
+    _add_column(connection, "code_test", "duration", "FLOAT")
+
+
+def _add_test_dependency_columns(connection: Connection):
+    """Add the test hash that dependencies were recorded for.
+
+    The code_test_dependency table itself is created by create_all.
+    """
+    _add_column(connection, "code_test", "dependencies_hash", "VARCHAR")
+
+
+# Append new migrations at the end; never reorder or remove them
+MIGRATIONS = [
+    _add_embedding_columns,
+    _add_natural_keys,
+    _add_lookup_indexes,
+    _add_change_detection_columns,
+    _add_full_text_search,
+    _add_source_spans,
+    _add_test_durations,
+    _add_test_dependency_columns,
+    _search_external_content,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(connection: Connection) -> int:
+    """Get the schema version of the DB."""
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def drop_unmanaged_schema(connection: Connection):
+    """Drop the tables create_all does not manage and reset the schema version.
+
+    Used when the DB is reset, so the migrations recreate them.
+    """
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    connection.exec_driver_sql(f"DROP VIEW IF EXISTS {SEARCH_CONTENT_VIEW}")
+    connection.exec_driver_sql("PRAGMA user_version=0")
+
+
+def migrate(engine: Engine) -> int:
+    """Apply the pending migrations to an SQLite DB, one transaction each.
+
+    Args:
+        engine (Engine): The engine for the DB, whose tables must already exist.
+
+    Returns:
+        int: The number of migrations applied.
+    """
+    if engine.dialect.name != "sqlite":
+        return 0
+    with engine.connect() as connection:
+        version = get_schema_version(connection)
+    if version > SCHEMA_VERSION:
+        logger.warning(
+            "Database schema version %s is newer than this code (%s)",
+            version,
+            SCHEMA_VERSION,
+        )
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("Migrating database to version %s: %s", number, migration.__name__)
+        with engine.begin() as connection:
+            migration(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version={number}")
+    return max(SCHEMA_VERSION - version, 0)
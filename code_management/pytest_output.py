@@ -0,0 +1,194 @@
+"""Distil verbose pytest output down to what is needed to revise a failing test."""
+
+import re
+
+from functions import logger, num_tokens_from_string
+
+# Token limit for the distilled output sent to the LLM
+DISTILLED_TOKEN_LIMIT = 1500
+# Appended to output cut short to fit the token limit
+TRUNCATION_MARKER = "\n[... truncated ...]"
+# Running totals of the tokens before and after distillation
+distil_stats = {"calls": 0, "tokens_before": 0, "tokens_after": 0}
+
+SECTION_PATTERN = re.compile(r"^={3,} (.+?) ={3,}$")
+TEST_HEADER_PATTERN = re.compile(r"^_{3,} (.+?) _{3,}$")
+CAPTURED_PATTERN = re.compile(r"^-{3,} (Captured .+?) -{3,}$")
+FRAME_SEPARATOR_PATTERN = re.compile(r"^(_ ){3,}_?\s*$")
+LOCATION_PATTERN = re.compile(r"^(\S+?):(\d+):")
+# Short (--tb=short, or the middle of --tb=auto) frames start with "path:line: in name"
+SHORT_FRAME_PATTERN = re.compile(r"^\S+?:\d+: in \S")
+LIBRARY_PATH_MARKERS = ("site-packages", "/lib/python", "<frozen")
+
+
+def _split_failures(lines: list[str]) -> tuple[list[list[str]], list[str]]:
+    """Split pytest output into per-test failure blocks and the short summary."""
+    blocks, summary = [], []
+    section = None
+    for line in lines:
+        section_match = SECTION_PATTERN.match(line)
+        if section_match:
+            section = section_match.group(1)
+            continue
+        if section in ("FAILURES", "ERRORS"):
+            if TEST_HEADER_PATTERN.match(line):
+                blocks.append([line])
+            elif blocks:
+                blocks[-1].append(line)
+        elif section == "short test summary info":
+            summary.append(line)
+    return blocks, summary
+
+
+def _is_relevant_frame(frame: list[str]) -> bool:
+    """Whether a traceback frame is in project code rather than a library."""
+    for line in reversed(frame):
+        match = LOCATION_PATTERN.match(line)
+        if match:
+            return not any(marker in match.group(1) for marker in LIBRARY_PATH_MARKERS)
+    return True
+
+
+def _trim_frame(
+    frame: list[str], context_lines: int, max_error_lines: int
+) -> list[str]:
+    """Keep the lines around the failing line, the E lines and the location."""
+    marker = next((i for i, line in enumerate(frame) if line.startswith(">")), None)
+    start = max(0, marker - context_lines) if marker is not None else 0
+    kept = []
+    error_lines = 0
+    for line in frame[start:]:
+        if line.startswith("E "):
+            error_lines += 1
+            if error_lines > max_error_lines:
+                continue
+        kept.append(line)
+    if error_lines > max_error_lines:
+        kept.append(f"E   [... {error_lines - max_error_lines} more lines ...]")
+    return kept
+
+
+def _distil_block(
+    block: list[str], max_frames: int, max_captured_lines: int, context_lines: int
+) -> list[str]:
+    """Distil one failure block: header, key frames and capped captured output."""
+    header, body = block[0], block[1:]
+    traceback, captured = [], []
+    for line in body:
+        match = CAPTURED_PATTERN.match(line)
+        if match:
+            captured.append([line])
+        elif captured:
+            captured[-1].append(line)
+        else:
+            traceback.append(line)
+
+    frames = [[]]
+    in_short_frame = False
+    for line in traceback:
+        if FRAME_SEPARATOR_PATTERN.match(line):
+            frames.append([])
+            in_short_frame = False
+        elif SHORT_FRAME_PATTERN.match(line):
+            frames.append([line])
+            in_short_frame = True
+        elif in_short_frame and not line.strip():
+            # Short frames end at the first blank line
+            frames.append([])
+            in_short_frame = False
+        else:
+            frames[-1].append(line)
+            # Long frames end with their location line
+            if not in_short_frame and LOCATION_PATTERN.match(line):
+                frames.append([])
+    frames = [frame for frame in frames if any(line.strip() for line in frame)]
+
+    # Always keep the test's own frame and the frame that raised, plus the innermost
+    # frames that are in project code
+    keep = {0, len(frames) - 1}
+    relevant = [i for i, frame in enumerate(frames) if _is_relevant_frame(frame)]
+    keep.update(relevant[-max_frames:] if max_frames else [])
+    distilled = [header]
+    previous = -1
+    for i in sorted(keep):
+        if i - previous > 1:
+            distilled.append(f"[... {i - previous - 1} traceback frames omitted ...]")
+        distilled.extend(_trim_frame(frames[i], context_lines, max_error_lines=40))
+        previous = i
+
+    for section in captured:
+        content = [line for line in section[1:] if line.strip()]
+        if not max_captured_lines or not content:
+            continue
+        distilled.append(section[0])
+        if len(content) > max_captured_lines:
+            distilled.append(
+                f"[... {len(content) - max_captured_lines} lines omitted ...]"
+            )
+        distilled.extend(content[-max_captured_lines:])
+    return distilled
+
+
+def _truncate(text: str, token_limit: int) -> str:
+    """Cut text to a token limit, ending it with a marker if there is room for one."""
+    tokens = num_tokens_from_string(text)
+    if tokens <= token_limit:
+        return text
+    kept, marker = text, TRUNCATION_MARKER
+    while tokens > token_limit:
+        keep_chars = int(len(kept) * token_limit / tokens * 0.9)
+        if keep_chars <= 0 and marker:
+            # Not even the marker fits, so cut the text on its own
+            kept, marker = text, ""
+            tokens = num_tokens_from_string(text)
+            continue
+        kept = kept[:keep_chars]
+        tokens = num_tokens_from_string(kept + marker)
+    return kept + marker
+
+
+def distil_pytest_output(output: str, token_limit: int = DISTILLED_TOKEN_LIMIT) -> str:
+    """
+    Distil pytest output to the test header, the assertion diff, the innermost
+    relevant traceback frames and a capped tail of captured output.
+
+    Progressively tighter settings are tried until the result fits the token limit;
+    as a last resort the text is truncated.
+
+    Args:
+        output (str): The stdout of a pytest run.
+        token_limit (int): The maximum number of tokens to return.
+
+    Returns:
+        str: The distilled output.
+    """
+    tokens_before = num_tokens_from_string(output)
+    blocks, summary = _split_failures(output.splitlines())
+    if not blocks:
+        # Not a failure report (e.g. a collection error): only the limit applies
+        distilled = output
+    else:
+        for max_frames, max_captured_lines, context_lines in (
+            (2, 20, 5),
+            (1, 5, 3),
+            (0, 0, 1),
+        ):
+            lines = []
+            for block in blocks:
+                lines.extend(
+                    _distil_block(block, max_frames, max_captured_lines, context_lines)
+                )
+                lines.append("")
+            distilled = "\n".join(lines + summary).strip()
+            if num_tokens_from_string(distilled) <= token_limit:
+                break
+    distilled = _truncate(distilled, token_limit)
+    tokens_after = num_tokens_from_string(distilled)
+
+    distil_stats["calls"] += 1
+    distil_stats["tokens_before"] += tokens_before
+    distil_stats["tokens_after"] += tokens_after
+    logger.info(
+        "Distilled pytest output from %s to %s tokens.", tokens_before, tokens_after
+    )
+    return distilled
@@ -0,0 +1,151 @@
+"""Run a test command under wall-clock, CPU and memory limits.
+
+A generated test can loop forever or allocate without bound, and one such test
+would otherwise stall the whole revise loop. The command runs in a new session,
+so on expiry its whole process group is killed, including any processes the
+test started. The rlimits are set by running this file as a small launcher that
+then execs the command, rather than by preexec_fn, which is not safe to use
+while other threads are running.
+
+This file is run as a script, so it imports nothing from the project.
+"""
+
+import os
+import signal
+import subprocess  # nosec
+import sys
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Wall-clock seconds a single test run may take
+TEST_TIMEOUT = 120
+# CPU seconds a single test run may use
+TEST_CPU_LIMIT = 60
+# Bytes of address space a single test run may map
+TEST_MEMORY_LIMIT = 4 * 1024**3
+# The test_status of a test whose run was stopped at a time or CPU limit
+TIMEOUT_STATUS = "timeout"
+
+
+def set_limits(cpu_seconds: int = None, memory_bytes: int = None):
+    """
+    Limit the CPU time and address space of this process and its children.
+
+    Args:
+        cpu_seconds (int): The CPU seconds allowed, or None for no limit.
+        memory_bytes (int): The bytes of address space allowed, or None for no limit.
+    """
+    if resource is None:
+        return
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+
+def limited_command(command: list[str], cpu_seconds: int, memory_bytes: int):
+    """Wrap a command in the launcher that sets its limits before it starts."""
+    return [
+        sys.executable,
+        os.path.abspath(__file__),
+        str(cpu_seconds or 0),
+        str(memory_bytes or 0),
+        *command,
+    ]
+
+
+def _children_cpu_seconds() -> float:
+    """Get the CPU seconds used by the child processes that have been waited for."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _hit_cpu_limit(returncode: int, cpu_used: float, cpu_seconds: int) -> bool:
+    """
+    Check whether a process was stopped at its CPU limit.
+
+    SIGXCPU is only sent at the soft limit. SIGKILL is also sent at the hard limit,
+    but may come from elsewhere, such as the OOM killer, so it only counts if the
+    process used up its CPU seconds.
+
+    Args:
+        returncode (int): The return code of the process.
+        cpu_used (float): The CPU seconds the process used.
+        cpu_seconds (int): The CPU seconds it was allowed.
+
+    Returns:
+        bool: True if the process was stopped at its CPU limit.
+    """
+    if resource is None:
+        return False
+    if returncode == -signal.SIGXCPU:
+        return True
+    return returncode == -signal.SIGKILL and cpu_used >= cpu_seconds
+
+
+def kill_group(process: subprocess.Popen):
+    """Kill a process started in its own session, with everything it started."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        process.kill()
+
+
+def run_limited(
+    command: list[str],
+    timeout: float = TEST_TIMEOUT,
+    cpu_seconds: int = TEST_CPU_LIMIT,
+    memory_bytes: int = TEST_MEMORY_LIMIT,
+    env: dict = None,
+) -> tuple[subprocess.CompletedProcess, bool]:
+    """
+    Run a command under wall-clock, CPU and memory limits.
+
+    Args:
+        command (list[str]): The command to run.
+        timeout (float): The wall-clock seconds allowed.
+        cpu_seconds (int): The CPU seconds allowed, or None for no limit.
+        memory_bytes (int): The bytes of address space allowed, or None for no limit.
+        env (dict): The environment for the command, if not this process's.
+
+    Returns:
+        tuple[subprocess.CompletedProcess, bool]: The result, with the output seen
+            before any kill, and whether the command was stopped at the time or CPU
+            limit.
+    """
+    if resource is not None and (cpu_seconds or memory_bytes):
+        command = limited_command(command, cpu_seconds, memory_bytes)
+    # Other children may be reaped meanwhile, so this can overstate the CPU used,
+    # but only ever for a process that was killed
+    cpu_before = _children_cpu_seconds()
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+        env=env,
+    )  # nosec B603
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+        cpu_used = _children_cpu_seconds() - cpu_before
+        timed_out = bool(cpu_seconds) and _hit_cpu_limit(
+            process.returncode, cpu_used, cpu_seconds
+        )
+    except subprocess.TimeoutExpired:
+        kill_group(process)
+        stdout, stderr = process.communicate()
+        timed_out = True
+    result = subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+    return result, timed_out
+
+
+if __name__ == "__main__":
+    CPU_SECONDS, MEMORY_BYTES, *COMMAND = sys.argv[1:]
+    set_limits(int(CPU_SECONDS), int(MEMORY_BYTES))
+    os.execvp(COMMAND[0], COMMAND)  # nosec B606
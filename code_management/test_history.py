@@ -0,0 +1,258 @@
+"""The history of test runs, and the flakiness and timing reports built from it.
+
+Each batched run appends a code_test_run row per test, with its outcome,
+duration and a failure signature. A test's flakiness score is the share of
+consecutive runs of the same test code whose outcome flipped, so a test fixed
+by a revision does not count as flaky but one that fails and passes unchanged
+does. The revise loop reruns flaky tests once before asking the LLM to revise
+them.
+"""
+
+import os
+import re
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from code_management.code_database import CodeTest, CodeTestRun
+from code_management.test_runner import FAILED_OUTCOMES, TEST_PHASES, node_key
+
+# Number of most recent runs of a test used to score its flakiness
+FLAKINESS_WINDOW = 20
+# Number of runs kept per test; older runs are deleted
+HISTORY_LIMIT = 50
+# Tests scoring at least this are rerun once before being revised
+FLAKY_THRESHOLD = 0.1
+# Maximum length of a stored failure signature
+SIGNATURE_LENGTH = 500
+# Parts of an error message that vary between runs of the same failure
+SIGNATURE_NOISE = re.compile(r"0x[0-9a-fA-F]+|\d+(\.\d+)?")
+
+
+def failure_signature(longrepr: str) -> str:
+    """
+    Reduce a failure report to its error lines, with addresses and numbers masked.
+
+    Args:
+        longrepr (str): The failure report of a test phase.
+
+    Returns:
+        str: The signature, the same for repeats of the same failure.
+    """
+    lines = [
+        line[1:].strip() for line in longrepr.splitlines() if line.startswith("E ")
+    ]
+    if not lines:
+        lines = longrepr.strip().splitlines()[-1:]
+    return SIGNATURE_NOISE.sub("N", "\n".join(lines))[:SIGNATURE_LENGTH]
+
+
+def record_report(session: Session, report: dict, test_ids: dict[str, int]) -> int:
+    """
+    Add a run to the history of each stored test in a report.
+
+    The cases of a parametrized test make up a single run, which fails if any case
+    fails.
+
+    Args:
+        session (Session): The session to use.
+        report (dict): The report of the run.
+        test_ids (dict[str, int]): The ID of each test that was run, by identifier.
+
+    Returns:
+        int: The number of runs recorded.
+    """
+    keys = {}
+    for identifier, test_id in test_ids.items():
+        file_path, _, test_name = identifier.partition("::")
+        keys[node_key(file_path, test_name)] = test_id
+    stmt = select(CodeTest.id, CodeTest.content_hash).where(
+        CodeTest.id.in_(list(test_ids.values()))
+    )
+    hashes = dict(session.execute(stmt).all())
+    root = report.get("root", os.getcwd())
+    runs = {}
+    for test in report.get("tests", []):
+        path, _, name = test["nodeid"].partition("::")
+        test_id = keys.get(node_key(os.path.join(root, path), name))
+        if test_id is None:
+            continue
+        run = runs.setdefault(
+            test_id,
+            {
+                "test_id": test_id,
+                "outcome": "pass",
+                "duration": 0.0,
+                "failure_signature": None,
+                "test_hash": hashes.get(test_id),
+            },
+        )
+        for phase in TEST_PHASES:
+            run["duration"] += test.get(phase, {}).get("duration", 0)
+        if test["outcome"] in FAILED_OUTCOMES and run["outcome"] == "pass":
+            run["outcome"] = "fail"
+            longrepr = next(
+                (
+                    test[phase]["longrepr"]
+                    for phase in TEST_PHASES
+                    if test.get(phase, {}).get("longrepr")
+                ),
+                "",
+            )
+            run["failure_signature"] = failure_signature(longrepr)
+    if runs:
+        session.execute(insert(CodeTestRun), list(runs.values()))
+        prune_history(session, list(runs))
+    return len(runs)
+
+
+def _recent_runs(test_ids: list[int] = None, column=CodeTestRun.id):
+    """Select the runs of some tests, ranked from the most recent (1) backwards."""
+    stmt = select(
+        column,
+        func.row_number()
+        .over(partition_by=CodeTestRun.test_id, order_by=CodeTestRun.id.desc())
+        .label("recency"),
+    )
+    if test_ids is not None:
+        stmt = stmt.where(CodeTestRun.test_id.in_(test_ids))
+    return stmt
+
+
+def prune_history(session: Session, test_ids: list[int], keep: int = HISTORY_LIMIT):
+    """
+    Delete all but the most recent runs of some tests.
+
+    Args:
+        session (Session): The session to use.
+        test_ids (list[int]): The IDs of the tests.
+        keep (int): The number of runs to keep per test.
+    """
+    ranked = _recent_runs(test_ids).subquery()
+    session.execute(
+        delete(CodeTestRun).where(
+            CodeTestRun.id.in_(select(ranked.c.id).where(ranked.c.recency > keep))
+        )
+    )
+
+
+def flakiness_scores(
+    session: Session, test_ids: list[int] = None, window: int = FLAKINESS_WINDOW
+) -> dict[int, tuple[float, int]]:
+    """
+    Score how flaky tests are from their recent runs.
+
+    The score is the share of consecutive pairs of runs of the same test code whose
+    outcomes differ: 0 for a test that always passes or always fails, up to 1 for
+    one that alternates.
+
+    Args:
+        session (Session): The session to use.
+        test_ids (list[int]): The IDs of the tests to score, or None for all tests.
+        window (int): The number of most recent runs to consider per test.
+
+    Returns:
+        dict[int, tuple[float, int]]: The score and the number of runs considered,
+            for each test with any runs.
+    """
+    ranked = (
+        _recent_runs(test_ids, CodeTestRun.test_id)
+        .add_columns(CodeTestRun.outcome, CodeTestRun.test_hash)
+        .subquery()
+    )
+    stmt = (
+        select(ranked.c.test_id, ranked.c.outcome, ranked.c.test_hash)
+        .where(ranked.c.recency <= window)
+        .order_by(ranked.c.test_id, ranked.c.recency.desc())
+    )
+    runs = {}
+    for test_id, outcome, test_hash in session.execute(stmt):
+        runs.setdefault(test_id, []).append((outcome, test_hash))
+    scores = {}
+    for test_id, test_runs in runs.items():
+        pairs = flips = 0
+        for (previous, previous_hash), (outcome, test_hash) in zip(
+            test_runs, test_runs[1:]
+        ):
+            if previous_hash == test_hash:
+                pairs += 1
+                flips += previous != outcome
+        scores[test_id] = (flips / pairs if pairs else 0.0, len(test_runs))
+    return scores
+
+
+def flaky_test_ids(
+    session: Session, test_ids: list[int], threshold: float = FLAKY_THRESHOLD
+) -> set[int]:
+    """
+    Get the tests whose flakiness score reaches a threshold.
+
+    Args:
+        session (Session): The session to use.
+        test_ids (list[int]): The IDs of the tests to check.
+        threshold (float): The minimum score of a flaky test.
+
+    Returns:
+        set[int]: The IDs of the flaky tests.
+    """
+    scores = flakiness_scores(session, test_ids)
+    return {test_id for test_id, (score, _) in scores.items() if score >= threshold}
+
+
+def history_report(session: Session, limit: int = 10) -> dict[str, list[dict]]:
+    """
+    Report the slowest and the flakiest tests.
+
+    Args:
+        session (Session): The session to use.
+        limit (int): The number of tests in each list.
+
+    Returns:
+        dict[str, list[dict]]: "slowest", with each test's identifier, mean duration
+            and number of runs, and "flakiest", with each test's identifier,
+            flakiness score and number of runs considered.
+    """
+    mean_duration = func.avg(CodeTestRun.duration).label("mean_duration")
+    stmt = (
+        select(
+            CodeTest.file_path,
+            CodeTest.test_name,
+            mean_duration,
+            func.count(CodeTestRun.id),
+        )
+        .join(CodeTestRun, CodeTestRun.test_id == CodeTest.id)
+        .group_by(CodeTest.id)
+        .order_by(mean_duration.desc())
+        .limit(limit)
+    )
+    slowest = [
+        {
+            "identifier": f"{file_path}::{test_name}",
+            "mean_duration": duration,
+            "runs": runs,
+        }
+        for file_path, test_name, duration, runs in session.execute(stmt)
+    ]
+    scores = flakiness_scores(session)
+    flakiest_ids = sorted(
+        (test_id for test_id, (score, _) in scores.items() if score > 0),
+        key=lambda test_id: scores[test_id],
+        reverse=True,
+    )[:limit]
+    names = {
+        test_id: f"{file_path}::{test_name}"
+        for test_id, file_path, test_name in session.execute(
+            select(CodeTest.id, CodeTest.file_path, CodeTest.test_name).where(
+                CodeTest.id.in_(flakiest_ids)
+            )
+        )
+    }
+    flakiest = [
+        {
+            "identifier": names[test_id],
+            "score": scores[test_id][0],
+            "runs": scores[test_id][1],
+        }
+        for test_id in flakiest_ids
+    ]
+    return {"slowest": slowest, "flakiest": flakiest}
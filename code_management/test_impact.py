@@ -0,0 +1,277 @@
+"""Test impact analysis: record what tests run and select those an edit affects.
+
+A pytest plugin traces the project functions each test calls, and the results
+are stored in the code DB as code_test_dependency rows, at file and function
+granularity. After an edit, only the tests that ran the changed files or
+functions need rerunning, along with tests whose recorded dependencies are out
+of date. When the data cannot be trusted, selection returns None so the caller
+falls back to a full run.
+
+Recording is switched on by loading this module as a pytest plugin:
+    pytest -p code_management.test_impact --record-dependencies=DIR
+"""
+
+import json
+import os
+import sys
+import threading
+
+import pytest
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from code_management.code_database import CodeFunction, CodeTest, CodeTestDependency
+from code_management.test_runner import node_key
+
+# Changes to these files can affect any test, so they force a full run
+GLOBAL_FILES = {"conftest.py", "pyproject.toml", "pytest.ini", "setup.cfg", "tox.ini"}
+# Maximum number of IDs per statement, to stay under SQLite's variable limit
+DEPENDENCY_CHUNK_SIZE = 10000
+
+
+class DependencyTracer:
+    """pytest plugin recording the project functions each test calls."""
+
+    def __init__(self, root: str, directory: str):
+        self.root = root
+        self.directory = directory
+        self.dependencies = {}
+        self._codes = set()
+
+    def _profile(self, frame, event, arg):
+        """Profile hook: note the code object of every Python call."""
+        if event == "call":
+            self._codes.add(frame.f_code)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        """Trace a test through its setup, call and teardown."""
+        self._codes = set()
+        threading.setprofile(self._profile)
+        sys.setprofile(self._profile)
+        try:
+            yield
+        finally:
+            sys.setprofile(None)
+            threading.setprofile(None)
+        self.dependencies[item.nodeid] = self._project_functions(self._codes)
+
+    def _project_functions(self, codes: set) -> list[list]:
+        """Get (file, name, first line) of the called code that is in the project."""
+        functions = set()
+        for code in codes:
+            path = os.path.abspath(code.co_filename)
+            if path.startswith(self.root) and "site-packages" not in path:
+                relative_path = os.path.relpath(path, self.root)
+                functions.add((relative_path, code.co_name, code.co_firstlineno))
+        return sorted(functions)
+
+    def pytest_sessionfinish(self, session):
+        """Write the dependencies to a file named after this process."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"root": self.root, "tests": self.dependencies}, file)
+
+
+def pytest_addoption(parser):
+    """Add the option that switches dependency recording on."""
+    parser.addoption(
+        "--record-dependencies",
+        metavar="DIR",
+        help="Record the project functions each test calls as JSON files in DIR.",
+    )
+
+
+def pytest_configure(config):
+    """Register the tracer when dependency recording is on."""
+    directory = config.getoption("record_dependencies")
+    if directory:
+        tracer = DependencyTracer(str(config.rootpath), directory)
+        config.pluginmanager.register(tracer, "dependency_tracer")
+
+
+def recording_args(directory: str) -> list[str]:
+    """
+    Get the pytest arguments that record dependencies into a directory.
+
+    Args:
+        directory (str): The directory to write the JSON files to.
+
+    Returns:
+        list[str]: The arguments.
+    """
+    return ["-p", __name__, f"--record-dependencies={directory}"]
+
+
+def load_recorded_dependencies(directory: str) -> dict[tuple[str, str], set]:
+    """
+    Read the dependencies written by one or more pytest processes.
+
+    The cases of a parametrized test are merged.
+
+    Args:
+        directory (str): The directory the JSON files were written to.
+
+    Returns:
+        dict[tuple[str, str], set]: The (absolute file, name, first line) of the
+            functions each test called, by test key.
+    """
+    dependencies = {}
+    if not os.path.isdir(directory):
+        return dependencies
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as file:
+            record = json.load(file)
+        root = record["root"]
+        for nodeid, functions in record["tests"].items():
+            path, _, test_name = nodeid.partition("::")
+            key = node_key(os.path.join(root, path), test_name)
+            dependencies.setdefault(key, set()).update(
+                (os.path.join(root, file_path), function_name, line)
+                for file_path, function_name, line in functions
+            )
+    return dependencies
+
+
+def _relative_path(path: str, root: str) -> str:
+    """Normalise a file path to be relative to the project root."""
+    return os.path.normpath(os.path.relpath(os.path.abspath(path), root))
+
+
+def _function_index(session: Session, root: str) -> dict[tuple[str, str], list]:
+    """Map (file, name) to the line span and ID of each stored function."""
+    index = {}
+    stmt = select(
+        CodeFunction.id,
+        CodeFunction.file_path,
+        CodeFunction.function_name,
+        CodeFunction.start_line,
+        CodeFunction.end_line,
+    ).where(CodeFunction.file_path.is_not(None))
+    for function_id, file_path, name, start_line, end_line in session.execute(stmt):
+        key = (_relative_path(file_path, root), name)
+        index.setdefault(key, []).append((start_line, end_line, function_id))
+    return index
+
+
+def _find_function(candidates: list, line: int) -> int:
+    """Pick the function whose span contains a line, or the only candidate."""
+    for start_line, end_line, function_id in candidates:
+        if start_line is not None and start_line <= line <= (end_line or start_line):
+            return function_id
+    return candidates[0][2] if len(candidates) == 1 else None
+
+
+def store_dependencies(
+    session: Session, dependencies: dict[tuple[str, str], set], root: str = "."
+) -> int:
+    """
+    Replace the stored dependencies of the tests that were traced.
+
+    Args:
+        session (Session): The session to use.
+        dependencies (dict[tuple[str, str], set]): The functions each test called,
+            by test key, as returned by load_recorded_dependencies.
+        root (str): The project root, which stored paths are relative to.
+
+    Returns:
+        int: The number of tests whose dependencies were stored.
+    """
+    root = os.path.abspath(root)
+    stmt = select(
+        CodeTest.id, CodeTest.file_path, CodeTest.test_name, CodeTest.content_hash
+    ).where(CodeTest.file_path.is_not(None))
+    tests = {
+        node_key(file_path, test_name): (test_id, content_hash)
+        for test_id, file_path, test_name, content_hash in session.execute(stmt)
+    }
+    traced = {key: tests[key] for key in dependencies if key in tests}
+    if not traced:
+        return 0
+    functions = _function_index(session, root)
+    test_ids = [test_id for test_id, _ in traced.values()]
+    for start in range(0, len(test_ids), DEPENDENCY_CHUNK_SIZE):
+        chunk = test_ids[start : start + DEPENDENCY_CHUNK_SIZE]
+        session.execute(
+            delete(CodeTestDependency).where(CodeTestDependency.test_id.in_(chunk))
+        )
+    rows = []
+    for key, (test_id, _) in traced.items():
+        seen = set()
+        for path, name, line in dependencies[key]:
+            file_path = _relative_path(path, root)
+            candidates = functions.get((file_path, name))
+            function_id = _find_function(candidates, line) if candidates else None
+            if (file_path, function_id) not in seen:
+                seen.add((file_path, function_id))
+                rows.append(
+                    {
+                        "test_id": test_id,
+                        "file_path": file_path,
+                        "function_id": function_id,
+                    }
+                )
+    if rows:
+        session.execute(insert(CodeTestDependency), rows)
+    session.execute(
+        update(CodeTest),
+        [
+            {"id": test_id, "dependencies_hash": content_hash}
+            for test_id, content_hash in traced.values()
+        ],
+    )
+    return len(traced)
+
+
+def select_affected_tests(
+    session: Session,
+    changed_files: list[str] = (),
+    changed_function_ids: list[int] = (),
+    root: str = ".",
+) -> list[str]:
+    """
+    Select the tests an edit may affect.
+
+    These are the tests that ran a changed function or any code in a changed file,
+    the tests in a changed file, and the tests with no dependencies recorded for
+    their current code.
+
+    Args:
+        session (Session): The session to use.
+        changed_files (list[str]): The paths of the changed files.
+        changed_function_ids (list[int]): The IDs of the changed functions.
+        root (str): The project root, which stored paths are relative to.
+
+    Returns:
+        list[str]: The identifiers of the affected tests, or None if the recorded
+            dependencies cannot be trusted and every test should run.
+    """
+    root = os.path.abspath(root)
+    files = {_relative_path(path, root) for path in changed_files}
+    if any(os.path.basename(path) in GLOBAL_FILES for path in files):
+        return None
+    has_dependencies = session.execute(
+        select(CodeTest.id).where(CodeTest.dependencies_hash.is_not(None)).limit(1)
+    ).first()
+    if has_dependencies is None:
+        return None
+    dependents = select(CodeTestDependency.test_id).where(
+        or_(
+            CodeTestDependency.file_path.in_(files),
+            CodeTestDependency.function_id.in_(list(changed_function_ids)),
+        )
+    )
+    selected = or_(
+        CodeTest.id.in_(dependents),
+        CodeTest.dependencies_hash.is_(None),
+        CodeTest.dependencies_hash != CodeTest.content_hash,
+    )
+    stmt = select(CodeTest.file_path, CodeTest.test_name, selected).where(
+        CodeTest.file_path.is_not(None)
+    )
+    return [
+        f"{file_path}::{test_name}"
+        for file_path, test_name, is_selected in session.execute(stmt)
+        if is_selected or _relative_path(file_path, root) in files
+    ]
@@ -0,0 +1,569 @@
+"""Run many tests in one pytest process and map the results back to the code DB.
+
+Starting pytest means starting an interpreter, importing the project and
+collecting the tests, which costs far more than most generated tests take to
+run. The functions here run a whole batch of node IDs in a single pytest
+invocation, read the outcomes from its JSON report and write them to the DB in
+one bulk update.
+
+In parallel mode the tests are split across several pytest processes. Each
+test's duration is stored in the DB after a run, and the next run balances the
+shards with longest-processing-time-first scheduling on those durations.
+
+Each batch runs under the sandbox's wall-clock, CPU and memory limits. This
+module is also loaded into the batch as a pytest plugin that writes each test's
+result as soon as it finishes, so when a batch is stopped at its limit the
+tests that never reported can be told apart and marked as timed out:
+    pytest -p code_management.test_runner --record-results=FILE
+"""
+
+import contextlib
+import heapq
+import json
+import os
+import statistics
+import subprocess  # nosec
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+import utils
+from code_management.code_database import DEFAULT_DB_PATH, CodeTest, session_scope
+from code_management.sandbox import TEST_MEMORY_LIMIT, TIMEOUT_STATUS, run_limited
+from functions import logger
+
+# Directory holding the code_management package, added to pytest's import path
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Arguments passed to every batched pytest run
+PYTEST_ARGS = ["-q", "-p", "no:cacheprovider", "--json-report-omit=keywords"]
+# Report outcomes that mark a test as failing
+FAILED_OUTCOMES = {"failed", "error"}
+# Wall-clock seconds, and CPU seconds, a batch of tests may take
+BATCH_TIMEOUT = 30 * 60
+# Seconds assumed for a test when no test has a recorded duration
+DEFAULT_TEST_DURATION = 1.0
+# Report phases whose durations add up to a test's duration
+TEST_PHASES = ("setup", "call", "teardown")
+# pytest options whose value follows as a separate argument that may be a path
+PATH_VALUE_OPTIONS = {
+    "-c",
+    "-k",
+    "-m",
+    "-o",
+    "-p",
+    "--basetemp",
+    "--confcutdir",
+    "--deselect",
+    "--ignore",
+    "--ignore-glob",
+    "--rootdir",
+}
+
+
+def _pytest_env() -> dict:
+    """Get the environment for pytest, able to import this project's plugins."""
+    env = dict(os.environ)
+    paths = [PROJECT_ROOT, *filter(None, env.get("PYTHONPATH", "").split(os.pathsep))]
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
+
+
+class ResultRecorder(utils.ResultCollector):
+    """pytest plugin writing each test's result to a JSON lines file as it finishes.
+
+    The first line holds the root directory the node IDs are relative to.
+    """
+
+    def __init__(self, root: str, file):
+        super().__init__(self._write, keep=False)
+        self.file = file
+        self._write({"root": root})
+
+    def _write(self, record: dict):
+        """Write a record and flush it, so it survives the process being killed."""
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+
+def pytest_addoption(parser):
+    """Add the option that switches result recording on."""
+    parser.addoption(
+        "--record-results",
+        metavar="FILE",
+        help="Write each test's result to FILE as a JSON line once it finishes.",
+    )
+
+
+def pytest_configure(config):
+    """Register the recorder when result recording is on."""
+    path = config.getoption("record_results")
+    if path:
+        file = open(path, "a", encoding="utf-8")
+        config.add_cleanup(file.close)
+        recorder = ResultRecorder(str(config.rootpath), file)
+        config.pluginmanager.register(recorder, "result_recorder")
+
+
+def _recorded_report(results_file: str) -> dict:
+    """Build a report from the results recorded by a batch that was stopped."""
+    report = {"root": os.getcwd(), "tests": [], "collectors": [], "timed_out": True}
+    if os.path.exists(results_file):
+        with open(results_file, "r", encoding="utf-8") as file:
+            for line in file:
+                # The last line may have been cut off by the kill
+                with contextlib.suppress(json.JSONDecodeError):
+                    record = json.loads(line)
+                    if "root" in record:
+                        report["root"] = record["root"]
+                    else:
+                        report["tests"].append(record)
+    return report
+
+
+def _run_pytest(
+    identifiers: list[str], args: list[str] = (), timeout: float = BATCH_TIMEOUT
+) -> dict:
+    """
+    Run a batch of tests in one pytest process, under the sandbox's limits.
+
+    The node IDs are passed in an argument file, so the batch is not limited by the
+    maximum length of a command line.
+
+    Args:
+        identifiers (list[str]): The pytest node IDs of the tests to run.
+        args (list[str]): Further arguments for pytest.
+        timeout (float): The wall-clock and CPU seconds the batch may take.
+
+    Returns:
+        dict: The pytest-json-report report, with no tests if pytest did not run.
+            If the batch was stopped at its limits, the report holds the tests that
+            finished before then, and "timed_out" is True.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        args_file = os.path.join(temp_dir, "node_ids.txt")
+        report_file = os.path.join(temp_dir, "report.json")
+        results_file = os.path.join(temp_dir, "results.jsonl")
+        with open(args_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(identifiers))
+        command = [
+            sys.executable,
+            "-m",
+            "pytest",
+            f"@{args_file}",
+            "--json-report",
+            f"--json-report-file={report_file}",
+            "-p",
+            __name__,
+            f"--record-results={results_file}",
+            *PYTEST_ARGS,
+            *args,
+        ]
+        result, timed_out = run_limited(
+            command,
+            timeout=timeout,
+            cpu_seconds=int(timeout),
+            memory_bytes=TEST_MEMORY_LIMIT,
+            env=_pytest_env(),
+        )
+        if timed_out:
+            logger.error(
+                "pytest was stopped after %s seconds running %s tests",
+                timeout,
+                len(identifiers),
+            )
+            return _recorded_report(results_file)
+        if not os.path.exists(report_file):
+            logger.error(
+                "pytest did not write a report:\n%s%s", result.stdout, result.stderr
+            )
+            return {"root": os.getcwd(), "tests": [], "collectors": []}
+        with open(report_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+
+def _uncollectable_files(report: dict) -> set[str]:
+    """Get the absolute paths of the test files pytest failed to collect."""
+    root = report.get("root", os.getcwd())
+    return {
+        _file_key(os.path.join(root, collector["nodeid"].partition("::")[0]))
+        for collector in report.get("collectors", [])
+        if collector.get("outcome") == "failed" and collector.get("nodeid")
+    }
+
+
+def _file_key(file_path: str) -> str:
+    """Identify a file by its absolute path."""
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def run_tests(
+    identifiers: list[str], args: list[str] = (), timeout: float = BATCH_TIMEOUT
+) -> dict:
+    """
+    Run a batch of tests in one pytest process.
+
+    If a file in the batch cannot be collected, for instance because it has a
+    syntax error, pytest runs none of the batch. The tests of such files are then
+    dropped and the rest of the batch is run again. The failed collectors are kept
+    in the report, and the dropped tests are missing from it, so they count as
+    failing.
+
+    Args:
+        identifiers (list[str]): The pytest node IDs of the tests to run.
+        args (list[str]): Further arguments for pytest.
+        timeout (float): The wall-clock and CPU seconds each pytest run may take.
+
+    Returns:
+        dict: The pytest-json-report report, with no tests if pytest did not run.
+            "timed_out" is True if the run was stopped at its limits.
+    """
+    report = _run_pytest(identifiers, args, timeout)
+    failed_collectors = []
+    while True:
+        broken = _uncollectable_files(report)
+        remaining = [
+            identifier
+            for identifier in identifiers
+            if _file_key(identifier.partition("::")[0]) not in broken
+        ]
+        failed_collectors += [
+            collector
+            for collector in report.get("collectors", [])
+            if collector.get("outcome") == "failed"
+        ]
+        if not broken or not remaining or len(remaining) == len(identifiers):
+            break
+        logger.warning(
+            "Could not collect %s; running the other %s tests again",
+            ", ".join(sorted(broken)),
+            len(remaining),
+        )
+        identifiers = remaining
+        report = _run_pytest(identifiers, args, timeout)
+    collectors = report.get("collectors", [])
+    report["collectors"] = failed_collectors + [
+        collector for collector in collectors if collector not in failed_collectors
+    ]
+    return report
+
+
+def node_key(file_path: str, test_name: str) -> tuple[str, str]:
+    """Identify a test by its absolute file path and its name without parameters."""
+    name = test_name.rsplit("::", 1)[-1].split("[", 1)[0]
+    return os.path.normcase(os.path.abspath(file_path)), name
+
+
+def statuses_from_report(report: dict, identifiers: list[str]) -> dict[str, str]:
+    """
+    Get the status of each test from a pytest-json-report report.
+
+    A parametrized test fails if any of its cases fails. A test missing from the
+    report, for instance because its file failed to import, counts as failing, or
+    as timed out if the run was stopped at its limits before the test finished.
+
+    Args:
+        report (dict): The report of the run.
+        identifiers (list[str]): The identifiers of the tests, as file::name.
+
+    Returns:
+        dict[str, str]: The status, "pass", "fail" or "timeout", of each test
+            identifier.
+    """
+    missing_status = TIMEOUT_STATUS if report.get("timed_out") else "fail"
+    uncollectable = _uncollectable_files(report)
+    root = report.get("root", os.getcwd())
+    outcomes = {}
+    for test in report.get("tests", []):
+        path, _, name = test["nodeid"].partition("::")
+        key = node_key(os.path.join(root, path), name)
+        if outcomes.get(key) != "fail":
+            failed = test["outcome"] in FAILED_OUTCOMES
+            outcomes[key] = "fail" if failed else "pass"
+    statuses = {}
+    for identifier in identifiers:
+        file_path, _, test_name = identifier.partition("::")
+        key = node_key(file_path, test_name)
+        if key in outcomes:
+            statuses[identifier] = outcomes[key]
+        else:
+            statuses[identifier] = "fail" if key[0] in uncollectable else missing_status
+    return statuses
+
+
+def durations_from_report(report: dict) -> dict[tuple[str, str], float]:
+    """
+    Get the duration of each test in a report, summing a parametrized test's cases.
+
+    Args:
+        report (dict): The report of the run.
+
+    Returns:
+        dict[tuple[str, str], float]: The seconds taken by each test, by test key.
+    """
+    root = report.get("root", os.getcwd())
+    durations = {}
+    for test in report.get("tests", []):
+        path, _, name = test["nodeid"].partition("::")
+        key = node_key(os.path.join(root, path), name)
+        seconds = sum(test.get(phase, {}).get("duration", 0) for phase in TEST_PHASES)
+        durations[key] = durations.get(key, 0) + seconds
+    return durations
+
+
+def update_test_statuses(
+    session: Session, statuses: dict[int, str], durations: dict[int, float] = None
+) -> int:
+    """
+    Set the status, and optionally the duration, of many tests in one bulk update.
+
+    Args:
+        session (Session): The session to use.
+        statuses (dict[int, str]): The new status of each test ID.
+        durations (dict[int, float]): The new duration of each test ID.
+
+    Returns:
+        int: The number of tests updated.
+    """
+    rows = {test_id: {"id": test_id} for test_id in statuses}
+    for test_id, status in statuses.items():
+        rows[test_id]["test_status"] = status
+    for test_id, seconds in (durations or {}).items():
+        rows.setdefault(test_id, {"id": test_id})["duration"] = seconds
+    if rows:
+        session.execute(update(CodeTest), list(rows.values()))
+    return len(rows)
+
+
+def stored_tests(session: Session) -> dict[str, int]:
+    """
+    Get the ID of each stored test that has a file, by its identifier.
+
+    Args:
+        session (Session): The session to use.
+
+    Returns:
+        dict[str, int]: The test ID for each test identifier, as file::name.
+    """
+    stmt = select(CodeTest.id, CodeTest.file_path, CodeTest.test_name).where(
+        CodeTest.file_path.is_not(None)
+    )
+    return {
+        f"{file_path}::{test_name}": test_id
+        for test_id, file_path, test_name in session.execute(stmt)
+    }
+
+
+def load_test_durations(session: Session) -> dict[tuple[str, str], float]:
+    """
+    Get the recorded duration of each test, by test key.
+
+    Args:
+        session (Session): The session to use.
+
+    Returns:
+        dict[tuple[str, str], float]: The seconds each test took in its last run.
+    """
+    stmt = select(CodeTest.file_path, CodeTest.test_name, CodeTest.duration).where(
+        CodeTest.file_path.is_not(None), CodeTest.duration.is_not(None)
+    )
+    return {
+        node_key(file_path, test_name): duration
+        for file_path, test_name, duration in session.execute(stmt)
+    }
+
+
+def record_durations(session: Session, report: dict) -> int:
+    """
+    Store the durations of the stored tests that ran in a report.
+
+    Args:
+        session (Session): The session to use.
+        report (dict): The report of the run.
+
+    Returns:
+        int: The number of tests updated.
+    """
+    durations = durations_from_report(report)
+    test_durations = {}
+    for identifier, test_id in stored_tests(session).items():
+        file_path, _, test_name = identifier.partition("::")
+        key = node_key(file_path, test_name)
+        if key in durations:
+            test_durations[test_id] = durations[key]
+    return update_test_statuses(session, {}, test_durations)
+
+
+def shard_tests(
+    identifiers: list[str], workers: int, durations: dict[tuple[str, str], float]
+) -> list[list[str]]:
+    """
+    Split tests into shards of similar total duration.
+
+    Uses longest-processing-time-first scheduling: tests are taken longest first
+    and each is given to the shard with the least work so far. A test with no
+    recorded duration is assumed to take the median recorded duration. The cases
+    of a parametrized test share its recorded duration.
+
+    Args:
+        identifiers (list[str]): The node IDs of the tests.
+        workers (int): The number of shards.
+        durations (dict[tuple[str, str], float]): Recorded durations by test key.
+
+    Returns:
+        list[list[str]]: The non-empty shards.
+    """
+    default = (
+        statistics.median(durations.values()) if durations else DEFAULT_TEST_DURATION
+    )
+    keys = {}
+    for identifier in identifiers:
+        file_path, _, test_name = identifier.partition("::")
+        keys[identifier] = node_key(file_path, test_name)
+    cases = Counter(keys.values())
+    estimates = {
+        identifier: durations.get(key, default) / cases[key]
+        for identifier, key in keys.items()
+    }
+    shards = [[] for _ in range(max(1, workers))]
+    loads = [(0.0, index) for index in range(len(shards))]
+    for identifier in sorted(identifiers, key=estimates.get, reverse=True):
+        load, index = heapq.heappop(loads)
+        shards[index].append(identifier)
+        heapq.heappush(loads, (load + estimates[identifier], index))
+    return [shard for shard in shards if shard]
+
+
+def merge_reports(reports: list[dict]) -> dict:
+    """
+    Merge the reports of several pytest processes into one.
+
+    Args:
+        reports (list[dict]): The reports to merge.
+
+    Returns:
+        dict: A report covering all the tests, timed by the slowest process.
+    """
+    merged = dict(reports[0]) if reports else {"root": os.getcwd()}
+    summary = Counter()
+    for report in reports:
+        summary.update(
+            {
+                name: value
+                for name, value in report.get("summary", {}).items()
+                if isinstance(value, int)
+            }
+        )
+    merged["summary"] = dict(summary)
+    merged["duration"] = max(
+        (report.get("duration", 0) for report in reports), default=0
+    )
+    merged["exitcode"] = max(
+        (report.get("exitcode", 0) for report in reports), default=0
+    )
+    merged["tests"] = [test for report in reports for test in report.get("tests", [])]
+    merged["collectors"] = [
+        collector for report in reports for collector in report.get("collectors", [])
+    ]
+    if any(report.get("timed_out") for report in reports):
+        merged["timed_out"] = True
+    return merged
+
+
+def run_tests_parallel(
+    identifiers: list[str],
+    workers: int,
+    durations: dict[tuple[str, str], float] = None,
+    args: list[str] = (),
+) -> dict:
+    """
+    Run tests across several pytest processes and merge their reports.
+
+    Args:
+        identifiers (list[str]): The pytest node IDs of the tests to run.
+        workers (int): The number of pytest processes.
+        durations (dict[tuple[str, str], float]): Recorded durations by test key,
+            used to balance the processes.
+        args (list[str]): Further arguments for pytest.
+
+    Returns:
+        dict: The merged report.
+    """
+    shards = shard_tests(identifiers, workers, durations or {})
+    if len(shards) <= 1:
+        return run_tests(identifiers, args)
+    logger.info("Running %s tests in %s processes", len(identifiers), len(shards))
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        reports = list(executor.map(lambda shard: run_tests(shard, args), shards))
+    return merge_reports(reports)
+
+
+def collect_tests(args: list[str] = ()) -> list[str]:
+    """
+    Collect the node IDs of the tests pytest would run.
+
+    Args:
+        args (list[str]): Further arguments for pytest, e.g. the paths to search.
+
+    Returns:
+        list[str]: The node IDs.
+    """
+    command = [sys.executable, "-m", "pytest", "--collect-only", "-q", *args]
+    result = subprocess.run(command, capture_output=True, text=True, env=_pytest_env())  # nosec B603
+    return [line for line in result.stdout.splitlines() if "::" in line]
+
+
+def split_pytest_args(args: list[str]) -> tuple[list[str], list[str]]:
+    """
+    Split pytest arguments into the paths selecting tests and the other options.
+
+    Args:
+        args (list[str]): The arguments for pytest.
+
+    Returns:
+        tuple[list[str], list[str]]: The test paths, such as "tests" or
+            "tests/test_utils.py::test_add", and the remaining options.
+    """
+    paths, options = [], []
+    for arg in args:
+        follows_option = bool(options) and options[-1] in PATH_VALUE_OPTIONS
+        if (
+            not arg.startswith("-")
+            and not follows_option
+            and os.path.exists(arg.partition("::")[0])
+        ):
+            paths.append(arg)
+        else:
+            options.append(arg)
+    return paths, options
+
+
+def run_suite_parallel(
+    workers: int, args: list[str] = (), db_path: str = DEFAULT_DB_PATH
+) -> dict:
+    """
+    Run the whole test suite across several pytest processes.
+
+    The processes are balanced on the durations recorded in the DB, which are
+    refreshed from the run. Test paths in the arguments only select what is
+    collected; each process is given its own node IDs and the other options.
+
+    Args:
+        workers (int): The number of pytest processes.
+        args (list[str]): Further arguments for pytest, e.g. the paths to search.
+        db_path (str): The SQLAlchemy URL of the DB.
+
+    Returns:
+        dict: The merged report.
+    """
+    identifiers = collect_tests(args)
+    _, options = split_pytest_args(args)
+    with session_scope(db_path) as session:
+        durations = load_test_durations(session)
+    report = run_tests_parallel(identifiers, workers, durations, options)
+    with session_scope(db_path) as session:
+        record_durations(session, report)
+    return report
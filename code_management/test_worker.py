@@ -0,0 +1,276 @@
+"""A pytest process kept warm between test runs.
+
+Each cold pytest run re-imports the project and its dependencies, which takes
+seconds before a single test runs. The revise loop runs the same few tests over
+and over, so it keeps one worker process alive instead. The worker runs
+pytest.main in-process on request and, before each run, drops the project
+modules whose files have changed (and the modules that import them) so they are
+imported afresh, while third-party imports stay loaded.
+
+The worker runs in its own session, so a run that outlasts its timeout is
+stopped by killing the worker's whole process group, including any processes
+the tests started. Each run may also use only a set number of CPU seconds on
+top of what the worker has used so far.
+
+Usage:
+    with PytestWorker() as worker:
+        result = worker.run(["tests/test_utils.py::test_add_imports"])
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import signal
+import sys
+
+import pytest
+
+import utils
+from code_management.sandbox import (
+    TEST_CPU_LIMIT,
+    TEST_MEMORY_LIMIT,
+    kill_group,
+    resource,
+    set_limits,
+)
+from functions import logger
+
+# Arguments passed to every pytest run in the worker
+WORKER_PYTEST_ARGS = ["-p", "no:cacheprovider"]
+
+
+def _module_file(module) -> str:
+    """Get the absolute path of a module's source file, if it has one."""
+    path = getattr(module, "__file__", None)
+    return os.path.abspath(path) if path else None
+
+
+def _project_modules(root: str) -> dict[str, str]:
+    """Get the file of each loaded module that lives under the project root."""
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        path = _module_file(module)
+        if path and path.startswith(root) and "site-packages" not in path:
+            modules[name] = path
+    return modules
+
+
+def _dependants(names: set[str], modules: dict[str, str]) -> set[str]:
+    """Get the project modules that import any of the given modules, transitively."""
+    stale = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for name in modules:
+            if name in stale or name not in sys.modules:
+                continue
+            for value in vars(sys.modules[name]).values():
+                module_name = getattr(value, "__module__", None) or getattr(
+                    value, "__name__", None
+                )
+                if module_name in stale:
+                    stale.add(name)
+                    changed = True
+                    break
+    return stale
+
+
+def _modification_time(path: str) -> float:
+    """Get the modification time of a file, or None if it is gone."""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _record_mtimes(root: str, mtimes: dict[str, float]):
+    """Record the modification times of the loaded project modules."""
+    for path in _project_modules(root).values():
+        mtimes[path] = _modification_time(path)
+
+
+def _is_test_module(module) -> bool:
+    """Check whether pytest imported a module, as it does test files and conftests."""
+    loader = getattr(module, "__loader__", None)
+    return type(loader).__name__ == "AssertionRewritingHook"
+
+
+def _drop_stale_modules(root: str, mtimes: dict[str, float]) -> list[str]:
+    """Unload project modules whose files changed since the last run.
+
+    Test modules are always unloaded, as pytest re-collects them on every run.
+
+    Args:
+        root (str): The project root.
+        mtimes (dict[str, float]): The modification times recorded after the last
+            run.
+
+    Returns:
+        list[str]: The names of the unloaded modules.
+    """
+    modules = _project_modules(root)
+    changed = {
+        name
+        for name, path in modules.items()
+        if _is_test_module(sys.modules[name])
+        or mtimes.get(path) != _modification_time(path)
+    }
+    stale = _dependants(changed, modules) if changed else set()
+    for name in stale:
+        sys.modules.pop(name, None)
+    return sorted(stale)
+
+
+def _limit_run_cpu(cpu_seconds: int):
+    """
+    Let the next run use a number of CPU seconds beyond what the worker has used.
+
+    Only the soft limit is set, so it can be raised again for the run after. A run
+    going over it gets SIGXCPU, which stops the worker.
+
+    Args:
+        cpu_seconds (int): The CPU seconds allowed for the run, or None for no limit.
+    """
+    if resource is None or not cpu_seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft_limit = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_seconds
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard_limit != resource.RLIM_INFINITY:
+        soft_limit = min(soft_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft_limit, hard_limit))
+
+
+def _serve(connection, root: str, memory_limit: int = None, cpu_limit: int = None):
+    """Worker process: run pytest for each request until told to stop."""
+    if hasattr(os, "setsid"):
+        os.setsid()
+    os.chdir(root)
+    set_limits(memory_bytes=memory_limit)
+    mtimes = {}
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        identifiers, args = request
+        _drop_stale_modules(root, mtimes)
+        _limit_run_cpu(cpu_limit)
+        collector = utils.ResultCollector()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            exitcode = pytest.main(
+                [*identifiers, *WORKER_PYTEST_ARGS, *args], plugins=[collector]
+            )
+        _record_mtimes(root, mtimes)
+        connection.send(
+            {
+                "exitcode": int(exitcode),
+                "output": output.getvalue(),
+                "tests": collector.report["tests"],
+            }
+        )
+
+
+class PytestWorker:
+    """
+    A long-lived pytest process that runs tests on request.
+
+    If the worker dies, for instance because a test exits the interpreter, the run
+    is reported as failed and a fresh worker is started for the next one. A run that
+    outlasts its timeout or its CPU limit is reported as timed out, and the worker's
+    process group is killed. The worker's address space is limited, so a test
+    allocating without bound fails with a MemoryError rather than exhausting the
+    machine.
+    """
+
+    def __init__(
+        self,
+        root: str = ".",
+        memory_limit: int = TEST_MEMORY_LIMIT,
+        cpu_limit: int = TEST_CPU_LIMIT,
+    ):
+        self.root = os.path.abspath(root)
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.stats = {"runs": 0, "restarts": 0, "timeouts": 0}
+        self._process = None
+        self._connection = None
+
+    def start(self) -> "PytestWorker":
+        """Start the worker process."""
+        if self._process is None:
+            context = multiprocessing.get_context("spawn")
+            self._connection, child_connection = context.Pipe()
+            self._process = context.Process(
+                target=_serve,
+                args=(child_connection, self.root, self.memory_limit, self.cpu_limit),
+                name="pytest-worker",
+                daemon=True,
+            )
+            self._process.start()
+            child_connection.close()
+        return self
+
+    def stop(self, wait: float = 5):
+        """Stop the worker process, killing it if it has not stopped after `wait`."""
+        if self._process is not None:
+            try:
+                self._connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self._process.join(timeout=wait)
+            if self._process.is_alive():
+                kill_group(self._process)
+                self._process.join()
+            self._connection.close()
+            self._process = None
+            self._connection = None
+
+    def __enter__(self) -> "PytestWorker":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def run(
+        self, identifiers: list[str], args: list[str] = (), timeout: float = None
+    ) -> dict:
+        """
+        Run tests in the worker.
+
+        Args:
+            identifiers (list[str]): The pytest node IDs of the tests to run.
+            args (list[str]): Further arguments for pytest.
+            timeout (float): Seconds to wait for the run, or None to wait for ever.
+
+        Returns:
+            dict: The exitcode, the terminal output, and the tests as recorded by
+                utils.ResultCollector. If the run timed out, "timed_out" is True.
+        """
+        self.start()
+        self.stats["runs"] += 1
+        try:
+            self._connection.send((list(identifiers), list(args)))
+            if timeout is not None and not self._connection.poll(timeout):
+                logger.error("pytest worker timed out running %s", identifiers)
+                self.stop(wait=0)
+                self.stats["timeouts"] += 1
+                output = f"The test run was stopped after {timeout} seconds."
+                return {"exitcode": 1, "output": output, "tests": [], "timed_out": True}
+            return self._connection.recv()
+        except (EOFError, BrokenPipeError, OSError) as error:
+            self._process.join(timeout=5)
+            if resource is not None and self._process.exitcode == -signal.SIGXCPU:
+                logger.error("pytest worker hit its CPU limit running %s", identifiers)
+                self.stop(wait=0)
+                self.stats["timeouts"] += 1
+                output = f"The test run was stopped after {self.cpu_limit} CPU seconds."
+                return {"exitcode": 1, "output": output, "tests": [], "timed_out": True}
+            logger.error("pytest worker died while running %s: %s", identifiers, error)
+            self.stop()
+            self.stats["restarts"] += 1
+            return {"exitcode": 1, "output": str(error), "tests": []}
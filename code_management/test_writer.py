@@ -1,69 +1,120 @@
 """Code for generating test functions."""
+import contextlib
+import queue
 import re
 import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import subprocess  # nosec
 from sqlalchemy import select
-from code_management.code_database import setup_db
-from code_management.code_database import CodeTest
+from code_management import test_history, test_impact, test_runner
+from code_management.code_database import CodeTest, session_scope
+from code_management.db_snapshots import sync_db
+from code_management.db_writer import DatabaseWriter, save_revised_test
+from code_management.pytest_output import distil_pytest_output
+from code_management.sandbox import (
+    TEST_CPU_LIMIT,
+    TEST_TIMEOUT,
+    TIMEOUT_STATUS,
+    run_limited,
+)
+from code_management.test_worker import PytestWorker
 from functions import logger
 import llm.llm_interface
 import utils
-from git_management.git_handler import GitHandler
+from git_management.git_handler import GitCommandError, get_git_handler
+
+# Test statuses that mark a test for revision
+FAILING_STATUSES = ("fail", TIMEOUT_STATUS)
 
 
 def get_test_code(test_id):
     """Get the code for a test from the database."""
-    session = setup_db()
-    stmt = select(CodeTest).where(
-        CodeTest.id == test_id
-    )  # Assuming each test has an ID
-    result = session.execute(stmt).scalar_one()
-    return result.test_string
+    with session_scope() as session:
+        stmt = select(CodeTest).where(
+            CodeTest.id == test_id
+        )  # Assuming each test has an ID
+        result = session.execute(stmt).scalar_one()
+        return result.test_string
 
 
 def get_function_code(test_id):
     """Get the code for the function being tested from the database."""
-    session = setup_db()
-    stmt = select(CodeTest).where(CodeTest.id == test_id)
-    result = session.execute(stmt).scalar_one()
-    return result.tested_function
+    with session_scope() as session:
+        stmt = select(CodeTest).where(CodeTest.id == test_id)
+        result = session.execute(stmt).scalar_one()
+        return result.tested_function
 
 
 def update_test_status(test_id, status):
     """Update the status of a test in the database."""
-    session = setup_db()
-    stmt = select(CodeTest).where(CodeTest.id == test_id)
-    test = session.execute(stmt).scalar_one()
-    test.test_status = status
-    session.commit()
+    with session_scope() as session:
+        stmt = select(CodeTest).where(CodeTest.id == test_id)
+        test = session.execute(stmt).scalar_one()
+        test.test_status = status
 
 
-def run_specific_test(string_test_identifier):
+def run_specific_test(string_test_identifier, sandbox=True):
     """
     Runs a specific pytest test, returns the stdout as a string, and indicates pass/fail.
     :param string_test_identifier: String identifier of the test (e.g., 'test_module.py::test_function')
+    :param sandbox: Whether to run the test under the time, CPU and memory limits.
     :return: Tuple containing stdout from the test run as a string and a boolean indicating pass (True) or fail (False)
     """
+    output, status = run_test_for_status(string_test_identifier, sandbox)
+    return output, status == "pass"
+
+
+def run_test_for_status(string_test_identifier, sandbox=True):
+    """
+    Runs a specific pytest test and gets its status for CodeTest.test_status.
+
+    In sandbox mode the test runs under the limits in code_management.sandbox, and a
+    run stopped at the time or CPU limit gets the status "timeout".
+
+    :param string_test_identifier: String identifier of the test.
+    :param sandbox: Whether to run the test under the time, CPU and memory limits.
+    :return: Tuple containing stdout from the test run and "pass", "fail" or "timeout".
+    """
     pytest_path = shutil.which("pytest")
     if pytest_path is None:
-        return "pytest is not installed.", False
+        return "pytest is not installed.", "fail"
 
-    result = subprocess.run(
-        [pytest_path, string_test_identifier], capture_output=True, text=True
-    )  # nosec B603
-    test_passed = result.returncode == 0
-    return result.stdout, test_passed
+    if not sandbox:
+        result = subprocess.run(
+            [pytest_path, string_test_identifier], capture_output=True, text=True
+        )  # nosec B603
+        return result.stdout, "pass" if result.returncode == 0 else "fail"
 
+    result, timed_out = run_limited([pytest_path, string_test_identifier])
+    if timed_out:
+        logger.warning("Test %s hit its time limit.", string_test_identifier)
+        output = result.stdout + (
+            f"\nThe test was stopped after running for more than {TEST_TIMEOUT} "
+            f"seconds or using more than {TEST_CPU_LIMIT} CPU seconds.\n"
+        )
+        return output, TIMEOUT_STATUS
+    return result.stdout, "pass" if result.returncode == 0 else "fail"
 
-def run_test_by_id(test_id: int):
-    """Run a test by its ID."""
+
+def run_test_by_id(test_id: int, worker: PytestWorker = None):
+    """
+    Run a test by its ID, in a warm pytest worker if one is given.
+
+    :return: Tuple containing the output and "pass", "fail" or "timeout".
+    """
     logger.info("Running test ID %s", test_id)
-    session = setup_db()
-    stmt = select(CodeTest).where(CodeTest.id == test_id)
-    result = session.execute(stmt).scalar_one()
-    output, passed = run_specific_test(result.identifier)
-    return output, passed
+    with session_scope() as session:
+        stmt = select(CodeTest).where(CodeTest.id == test_id)
+        identifier = session.execute(stmt).scalar_one().identifier
+    if worker is not None:
+        result = worker.run([identifier], timeout=TEST_TIMEOUT)
+        if result.get("timed_out"):
+            return result["output"], TIMEOUT_STATUS
+        return result["output"], "pass" if result["exitcode"] == 0 else "fail"
+    return run_test_for_status(identifier)
 
 
 def run_pre_commit_hooks():
@@ -87,26 +138,83 @@ def run_pre_commit_hooks():
         return "pre-commit is not installed."
 
 
-def run_all_tests_and_update_status():
+def run_all_tests_and_update_status(workers: int = 1, record_dependencies=False):
     """
-    Iterates over all tests, runs each test, and updates the test_status based on the result.
+    Runs all tests and updates each test_status and duration from the result.
+
+    :param workers: Number of pytest processes to split the tests across, balanced
+        on the durations recorded by previous runs.
+    :param record_dependencies: Whether to record the functions each test runs, for
+        run_affected_tests.
+    :return: The number of tests that failed.
+    """
+    with session_scope() as session:
+        identifiers = list(test_runner.stored_tests(session))
+    return run_tests_and_update_status(identifiers, workers, record_dependencies)
+
+
+def run_affected_tests(changed_files=(), changed_function_ids=(), workers: int = 1):
     """
-    session = setup_db()
-    # Fetch all test records
-    stmt = select(CodeTest)
-    all_tests = session.execute(stmt).scalars().all()
+    Runs only the tests affected by a change, recording their dependencies afresh.
 
-    for test in all_tests:
-        # Run the test
-        output, passed = run_specific_test(test.identifier)
+    Falls back to running all tests when the recorded dependencies are missing or
+    cannot be trusted.
 
-        # Update the test_status
-        test_status = "pass" if passed else "fail"
-        test.test_status = test_status
-        session.commit()
+    :param changed_files: Paths of the changed files.
+    :param changed_function_ids: IDs of the changed functions.
+    :param workers: Number of pytest processes to split the tests across.
+    :return: The number of tests that failed.
+    """
+    with session_scope() as session:
+        identifiers = test_impact.select_affected_tests(
+            session, changed_files, changed_function_ids
+        )
+    if identifiers is None:
+        logger.info("Test dependencies are missing or stale; running all tests.")
+        return run_all_tests_and_update_status(workers, record_dependencies=True)
+    logger.info("Running %s tests affected by the change", len(identifiers))
+    return run_tests_and_update_status(identifiers, workers, record_dependencies=True)
+
+
+def run_tests_and_update_status(
+    identifiers, workers: int = 1, record_dependencies=False
+):
+    """
+    Runs the given tests, updates their test_status and duration from the result and
+    adds the run to their history.
 
-        # Optionally, you can log or print the output and status
-        logger.debug(f"Test ID {test.id}: {test_status}\nOutput: {output}")
+    :param identifiers: Identifiers of the stored tests to run.
+    :param workers: Number of pytest processes to split the tests across.
+    :param record_dependencies: Whether to record the functions each test runs.
+    :return: The number of tests that failed or timed out.
+    """
+    if not identifiers:
+        return 0
+    with session_scope() as session:
+        test_ids = test_runner.stored_tests(session)
+        durations = test_runner.load_test_durations(session)
+    with tempfile.TemporaryDirectory() as dependency_dir:
+        args = test_impact.recording_args(dependency_dir) if record_dependencies else []
+        if workers > 1:
+            report = test_runner.run_tests_parallel(
+                identifiers, workers, durations, args
+            )
+        else:
+            report = test_runner.run_tests(identifiers, args)
+        dependencies = test_impact.load_recorded_dependencies(dependency_dir)
+    statuses = test_runner.statuses_from_report(report, identifiers)
+    with session_scope() as session:
+        test_runner.update_test_statuses(
+            session,
+            {test_ids[identifier]: status for identifier, status in statuses.items()},
+        )
+        test_runner.record_durations(session, report)
+        run_ids = {identifier: test_ids[identifier] for identifier in statuses}
+        test_history.record_report(session, report, run_ids)
+        test_impact.store_dependencies(session, dependencies)
+    failed = sum(status in FAILING_STATUSES for status in statuses.values())
+    logger.info("Ran %s tests: %s failed", len(statuses), failed)
+    return failed
 
 
 def replace_test_in_file(test_file_name, old_test_name, new_test_code):
@@ -142,15 +250,20 @@ def replace_test_in_file(test_file_name, old_test_name, new_test_code):
         return False
 
 
-def get_revised_test(test_id: int):
-    """Get the code for a test from the database."""
+def get_revised_test(test_id: int, worker: PytestWorker = None, file_lock=None):
+    """Get the code for a test from the database.
+
+    The failing test is run while holding file_lock, if given, but the LLM is not.
+    """
     logger.info("Getting revised test for test ID %s", test_id)
     # Get the test code
     test_code = get_test_code(test_id)
     # Get the function code
     function_code = get_function_code(test_id)
-    # Get the failing test output
-    output, passed = run_test_by_id(test_id)
+    # Get the failing test output, cut down to what the LLM needs
+    with file_lock or contextlib.nullcontext():
+        output, _ = run_test_by_id(test_id, worker)
+    output = distil_pytest_output(output)
     # Send to the LLM for revised code
     revised_test_code, imports = llm.llm_interface.revise_test(
         test_code, function_code, output
@@ -161,13 +274,13 @@ def get_revised_test(test_id: int):
 
 def fetch_failing_tests():
     """
-    Fetches all failing tests from the database.
+    Fetches all failing tests from the database, including those that timed out.
 
     :return: List of failing tests.
     """
-    session = setup_db()
-    stmt = select(CodeTest).where(CodeTest.test_status == "fail")
-    failing_tests = session.execute(stmt).scalars().all()
+    with session_scope() as session:
+        stmt = select(CodeTest).where(CodeTest.test_status.in_(FAILING_STATUSES))
+        failing_tests = session.execute(stmt).scalars().all()
     return failing_tests
 
 
@@ -189,21 +302,22 @@ def write_revised_test_to_file(test_name, test_file_name, revised_test_code, imp
         logger.error("Failed to write revised test to file: %s", test_file_name)
 
 
-def update_test_in_db(test_id, new_test_code, passed):
+def update_test_in_db(test_id, new_test_code, status):
     """
     Updates the test code and status in the database.
 
     :param test_id: The ID of the test to update.
-    :param new_test_code: The new test code to insert.
-    :param passed: Boolean indicating whether the test passed or failed.
+    :param new_test_code: The new test code to insert, or None to keep the code.
+    :param status: The test's status: "pass", "fail" or "timeout".
     """
     logger.info("Updating test ID %s", test_id)
-    session = setup_db()
-    stmt = select(CodeTest).where(CodeTest.id == test_id)
-    test = session.execute(stmt).scalar_one()
-    test.test_string = new_test_code
-    test.test_status = "pass" if passed else "fail"
-    session.commit()
+    with session_scope() as session:
+        stmt = select(CodeTest).where(CodeTest.id == test_id)
+        test = session.execute(stmt).scalar_one()
+        if new_test_code is not None:
+            test.test_string = new_test_code
+            test.content_hash = utils.compute_source_hash(new_test_code)
+        test.test_status = status
 
 
 def any_tests_still_failing():
@@ -212,17 +326,168 @@ def any_tests_still_failing():
 
     :return: True if any tests are still failing, False otherwise.
     """
-    session = setup_db()
-    stmt = select(CodeTest).where(CodeTest.test_status == "fail")
-    failing_tests = session.execute(stmt).scalars().all()
-    return len(failing_tests) > 0
+    with session_scope() as session:
+        stmt = (
+            select(CodeTest.id)
+            .where(CodeTest.test_status.in_(FAILING_STATUSES))
+            .limit(1)
+        )
+        return session.execute(stmt).first() is not None
+
+
+def revise_failing_test(
+    test,
+    max_attempts_per_test,
+    worker=None,
+    file_lock=None,
+    save_test=None,
+    rerun_first=False,
+):
+    """
+    Revises a failing test until it passes or the maximum number of attempts is reached.
+
+    A test known to be flaky can be rerun once first, and is left unrevised if it
+    passes.
+
+    :param test: The failing test.
+    :param max_attempts_per_test: Maximum number of revision attempts.
+    :param worker: Warm pytest worker to run the test in, if any.
+    :param file_lock: Lock held while the test file is rewritten or run, if any.
+    :param save_test: Called with the test ID, revised code and test status,
+        to store each revision. Defaults to update_test_in_db.
+    :param rerun_first: Whether to rerun the test before revising it.
+    :return: The number of failed attempts, or None if the rerun passed.
+    """
+    file_lock = file_lock or contextlib.nullcontext()
+    save_test = save_test or update_test_in_db
+    if rerun_first:
+        with file_lock:
+            _, status = run_test_by_id(test.id, worker)
+        save_test(test.id, None, status)
+        if status == "pass":
+            logger.info("Flaky test %s passed on a rerun.", test.identifier)
+            return None
+    # Reset attempts and success flag
+    attempts = 0
+    success = False
+
+    while attempts < max_attempts_per_test and not success:
+        # Apply test revision logic
+        revised_test_code, revised_imports = get_revised_test(
+            test.id, worker, file_lock
+        )
+        if revised_test_code is None:
+            # No valid revision was generated, so there is nothing to write or run
+            attempts += 1
+            logger.info(
+                "No valid revision of %s on attempt %s.", test.identifier, attempts
+            )
+            continue
 
+        with file_lock:
+            # Write revised test to file
+            write_revised_test_to_file(
+                test.test_name, test.file_path, revised_test_code, revised_imports
+            )
 
-def revise_and_test_loop(max_attempts_per_test):
+            # Run revised test
+            output, status = run_test_by_id(test.id, worker)
+
+        if status == "pass":
+            success = True
+            logger.info(f"Test {test.identifier} passed after {attempts + 1} attempts.")
+        else:
+            attempts += 1
+            logger.info(
+                f"Test {test.identifier} failed on attempt {attempts}. Retrying..."
+            )
+
+        # Update test status in the database
+        save_test(test.id, revised_test_code, status)
+
+    if not success:
+        print(f"Test {test.identifier} failed after {max_attempts_per_test} attempts.")
+    return attempts
+
+
+def _commit_revision(git_handler, test, attempts, file_lock):
+    """Commits a revised test file, reporting rather than raising git errors."""
+    commit_message = f"Revised test {test.identifier} after {attempts} attempts."
+    with file_lock:
+        try:
+            git_handler.commit_files(commit_message, [test.file_path])
+        except GitCommandError as error:
+            logger.warning("Could not commit %s: %s", test.identifier, error)
+
+
+def revise_tests_concurrently(
+    failing_tests, max_attempts_per_test, concurrency, git_handler, flaky_ids=()
+):
+    """
+    Revises failing tests concurrently, so LLM requests and test runs overlap.
+
+    At most `concurrency` tests are revised at once, each with its own warm pytest
+    worker. Tests in the same file take turns to rewrite and run it. Database writes
+    go through a single DatabaseWriter and git commits through a single committer
+    thread, each commit covering only the revised test's file.
+
+    :param failing_tests: The failing tests.
+    :param max_attempts_per_test: Maximum number of revision attempts for each test.
+    :param concurrency: Maximum number of tests revised at once.
+    :param git_handler: The handler used to commit each revision.
+    :param flaky_ids: IDs of flaky tests, which are rerun before being revised.
+    """
+    file_locks = {test.file_path: threading.Lock() for test in failing_tests}
+    workers = queue.Queue()
+    for _ in range(min(concurrency, len(failing_tests))):
+        workers.put(PytestWorker())
+
+    with DatabaseWriter() as writer, ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="git-committer"
+    ) as committer, ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="revise"
+    ) as pool:
+
+        def save_test(test_id, test_code, status):
+            writer.submit(save_revised_test, test_id, test_code, status).result()
+
+        def revise(test):
+            logger.info("Test %s is failing, re-coding...", test.test_name)
+            worker = workers.get()
+            try:
+                attempts = revise_failing_test(
+                    test,
+                    max_attempts_per_test,
+                    worker,
+                    file_locks[test.file_path],
+                    save_test,
+                    rerun_first=test.id in flaky_ids,
+                )
+            finally:
+                workers.put(worker)
+            if attempts is not None:
+                file_lock = file_locks[test.file_path]
+                committer.submit(
+                    _commit_revision, git_handler, test, attempts, file_lock
+                )
+
+        for future in [pool.submit(revise, test) for test in failing_tests]:
+            try:
+                future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Revising a test failed: %s", error)
+
+    while not workers.empty():
+        workers.get().stop()
+
+
+def revise_and_test_loop(max_attempts_per_test, concurrency: int = 1):
     """
     Iterates over failing tests, revises each, and tests until passing or max attempts reached.
 
     :param max_attempts_per_test: Maximum number of revision attempts for each failing test.
+    :param concurrency: Maximum number of tests revised at once. Above 1, failing tests
+        are revised concurrently by revise_tests_concurrently.
     """
     # Fetch failing tests
     failing_tests = fetch_failing_tests()
@@ -231,52 +496,34 @@ def revise_and_test_loop(max_attempts_per_test):
     if not failing_tests:
         logger.info("No failing tests found.")
         return
-    git_handler = GitHandler()
+    git_handler = get_git_handler()
     git_handler.create_temp_test_branch()
-
-    for test in failing_tests:
-        logger.info(f"Test {test.test_name} is failing, re-coding...")
-        # Reset attempts and success flag
-        attempts = 0
-        success = False
-
-        while attempts < max_attempts_per_test and not success:
-            # Apply test revision logic
-            revised_test_code, revised_imports = get_revised_test(test.id)
-
-            # Write revised test to file
-            write_revised_test_to_file(
-                test.test_name, test.file_path, revised_test_code, revised_imports
-            )
-
-            # Run revised test
-            output, passed = run_test_by_id(test.id)
-
-            if passed:
-                success = True
-                logger.info(
-                    f"Test {test.identifier} passed after {attempts + 1} attempts."
-                )
-            else:
-                attempts += 1
-                logger.info(
-                    f"Test {test.identifier} failed on attempt {attempts}. Retrying..."
+    # Flaky tests get a rerun before an LLM is asked to revise them
+    with session_scope() as session:
+        flaky_ids = test_history.flaky_test_ids(
+            session, [test.id for test in failing_tests]
+        )
+
+    if concurrency > 1:
+        revise_tests_concurrently(
+            failing_tests, max_attempts_per_test, concurrency, git_handler, flaky_ids
+        )
+    else:
+        # Keep one pytest process warm for all the runs
+        with PytestWorker() as worker:
+            for test in failing_tests:
+                logger.info(f"Test {test.test_name} is failing, re-coding...")
+                attempts = revise_failing_test(
+                    test,
+                    max_attempts_per_test,
+                    worker,
+                    rerun_first=test.id in flaky_ids,
                 )
+                if attempts is None:
+                    continue
 
-            # Update test status in the database
-            update_test_in_db(
-                test.id, revised_test_code, passed
-            )  # Placeholder function
-
-        if not success:
-            print(
-                f"Test {test.identifier} failed after {max_attempts_per_test} attempts."
-            )
-
-        # Commit changes to Git for each test
-        # Create a commit message that refers to the test name and number of attempts
-        commit_message = f"Revised test {test.identifier} after {attempts} attempts."
-        git_handler.commit_changes(commit_message)  # Placeholder function
+                # Commit each revised test file, naming the test and attempts
+                _commit_revision(git_handler, test, attempts, contextlib.nullcontext())
 
     # Check for any remaining failing tests
     if any_tests_still_failing():
@@ -286,3 +533,4 @@ def revise_and_test_loop(max_attempts_per_test):
         logger.info("All tests passed or reached max attempts.")
         # Merge the temporary branch into the original branch
         git_handler.merge_temp_test_branch()
+        sync_db(git_handler=git_handler)
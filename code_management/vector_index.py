@@ -0,0 +1,330 @@
+"""Approximate nearest-neighbour (IVF-flat) index over function embeddings."""
+
+import os
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from code_management.code_database import CodeFunction
+from code_management.code_embeddings import VECTOR_DTYPE, blob_to_vector
+from functions import logger
+
+# Retrain the coarse quantiser once the index has grown this much since training
+RETRAIN_GROWTH_FACTOR = 4
+
+
+def _normalise(matrix: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of the matrix with unit-length rows."""
+    matrix = np.array(matrix, dtype=VECTOR_DTYPE, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def kmeans(
+    matrix: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0
+) -> np.ndarray:
+    """Cluster unit vectors with spherical k-means.
+
+    Args:
+        matrix (np.ndarray): The (n, dim) unit vectors to cluster.
+        n_clusters (int): The number of clusters.
+        n_iter (int, optional): The number of Lloyd iterations. Defaults to 20.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: The (n_clusters, dim) unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, matrix)
+        empty = ~np.bincount(assignments, minlength=n_clusters).astype(bool)
+        # Re-seed empty clusters with random points so every list stays usable
+        sums[empty] = matrix[rng.choice(len(matrix), int(empty.sum()))]
+        centroids = _normalise(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    An inverted-file index: vectors are bucketed by their nearest k-means centroid
+    and a query only scans the buckets of its n_probe nearest centroids.
+    """
+
+    def __init__(self, centroids: np.ndarray = None):
+        self.centroids = centroids
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, 0), dtype=VECTOR_DTYPE)
+        self.assignments = np.empty(0, dtype=np.int64)
+        self.trained_size = 0
+        # Lazily rebuilt view of the vectors sorted by list
+        self._order = None
+        self._offsets = None
+        self._sorted_ids = None
+        self._sorted_vectors = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_lists(self) -> int:
+        """The number of inverted lists."""
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def train(self, matrix: np.ndarray, n_lists: int = None, n_iter: int = 20):
+        """
+        Train the coarse quantiser on a sample of vectors.
+
+        Args:
+            matrix (np.ndarray): The (n, dim) training vectors.
+            n_lists (int, optional): The number of lists. Defaults to sqrt(n).
+            n_iter (int, optional): The number of k-means iterations. Defaults to 20.
+        """
+        matrix = _normalise(matrix)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(matrix))))
+        n_lists = min(n_lists, len(matrix))
+        # k-means quality plateaus long before using every point
+        sample_size = min(len(matrix), n_lists * 256)
+        sample = matrix[np.random.default_rng(0).permutation(len(matrix))[:sample_size]]
+        self.centroids = kmeans(sample, n_lists, n_iter=n_iter)
+        self.trained_size = len(matrix)
+
+    def build(self, ids: np.ndarray, matrix: np.ndarray, n_lists: int = None):
+        """
+        Train the index and add all vectors to it.
+
+        Args:
+            ids (np.ndarray): The function IDs.
+            matrix (np.ndarray): The (n, dim) vectors, row i belonging to ids[i].
+            n_lists (int, optional): The number of lists. Defaults to sqrt(n).
+        """
+        self.train(matrix, n_lists=n_lists)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, self.centroids.shape[1]), dtype=VECTOR_DTYPE)
+        self.assignments = np.empty(0, dtype=np.int64)
+        self.upsert(ids, matrix)
+
+    def remove(self, ids) -> int:
+        """
+        Remove vectors from the index.
+
+        Args:
+            ids: The function IDs to remove.
+
+        Returns:
+            int: The number of vectors removed.
+        """
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        removed = int(len(keep) - keep.sum())
+        if removed:
+            self.ids = self.ids[keep]
+            self.vectors = self.vectors[keep]
+            self.assignments = self.assignments[keep]
+            self._order = None
+        return removed
+
+    def upsert(self, ids, matrix: np.ndarray):
+        """
+        Add vectors to the index, replacing any existing vectors with the same IDs.
+
+        Args:
+            ids: The function IDs.
+            matrix (np.ndarray): The (n, dim) vectors, row i belonging to ids[i].
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        matrix = _normalise(matrix)
+        self.remove(ids)
+        assignments = np.argmax(matrix @ self.centroids.T, axis=1)
+        self.ids = np.concatenate([self.ids, ids])
+        self.vectors = np.concatenate(
+            [self.vectors.reshape(-1, matrix.shape[1]), matrix]
+        )
+        self.assignments = np.concatenate([self.assignments, assignments])
+        self._order = None
+
+    def needs_retraining(self) -> bool:
+        """Whether the index has outgrown the data its centroids were trained on."""
+        return len(self) > RETRAIN_GROWTH_FACTOR * max(self.trained_size, 1)
+
+    def _ensure_lists(self):
+        """Sort the stored vectors by list so each list is a contiguous slice."""
+        if self._order is not None:
+            return
+        self._order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=self.n_lists)
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._sorted_vectors = self.vectors[self._order]
+        self._sorted_ids = self.ids[self._order]
+
+    def search(
+        self, query: np.ndarray, k: int = 5, n_probe: int = 8
+    ) -> list[tuple[int, float]]:
+        """
+        Find the approximate nearest neighbours of a query vector.
+
+        Larger n_probe values scan more lists: higher recall, higher latency.
+        n_probe >= n_lists is an exact search.
+
+        Args:
+            query (np.ndarray): The query vector.
+            k (int, optional): The number of results. Defaults to 5.
+            n_probe (int, optional): The number of lists to scan. Defaults to 8.
+
+        Returns:
+            list[tuple[int, float]]: (function ID, cosine similarity) pairs, most
+                similar first.
+        """
+        if not len(self):
+            return []
+        self._ensure_lists()
+        query = _normalise(query)[0]
+        n_probe = min(n_probe, self.n_lists)
+        probes = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        slices = [slice(self._offsets[p], self._offsets[p + 1]) for p in probes]
+        candidates = np.concatenate([self._sorted_vectors[s] for s in slices])
+        candidate_ids = np.concatenate([self._sorted_ids[s] for s in slices])
+        if not len(candidate_ids):
+            return []
+        scores = candidates @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidate_ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        """
+        Persist the index to an .npz file.
+
+        Args:
+            path (str): The file path.
+        """
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            ids=self.ids,
+            vectors=self.vectors,
+            assignments=self.assignments,
+            trained_size=self.trained_size,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        """
+        Load an index saved with save().
+
+        Args:
+            path (str): The file path.
+
+        Returns:
+            IVFIndex: The loaded index.
+        """
+        with np.load(path) as data:
+            index = cls(data["centroids"])
+            index.ids = data["ids"]
+            index.vectors = data["vectors"]
+            index.assignments = data["assignments"]
+            index.trained_size = int(data["trained_size"])
+        return index
+
+
+def index_path_for_db(db_path: str = "sqlite:///code.db") -> str:
+    """
+    Get the path of the vector index stored next to a database.
+
+    Args:
+        db_path (str): The SQLAlchemy URL of the database.
+
+    Returns:
+        str: The index file path.
+    """
+    return db_path.split("///", 1)[-1] + ".ivf.npz"
+
+
+def _load_vectors(session: Session, ids=None) -> tuple[np.ndarray, np.ndarray]:
+    """Load (ids, matrix) for the given function IDs, or all embedded functions."""
+    stmt = select(CodeFunction.id, CodeFunction.vector).where(
+        CodeFunction.vector.is_not(None)
+    )
+    if ids is not None:
+        stmt = stmt.where(CodeFunction.id.in_([int(i) for i in ids]))
+    rows = session.execute(stmt).all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=VECTOR_DTYPE)
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.vstack([blob_to_vector(row[1]) for row in rows]),
+    )
+
+
+def update_vector_index(
+    session: Session, changed_ids, index_path: str, n_lists: int = None
+) -> IVFIndex:
+    """
+    Bring the persisted index in line with the database and save it.
+
+    Changed functions are re-assigned, deleted functions are dropped, and the index is
+    rebuilt from scratch only if it does not exist yet or has outgrown its training.
+
+    Args:
+        session (Session): The database session.
+        changed_ids: The IDs of functions embedded since the last update.
+        index_path (str): The file path of the index.
+        n_lists (int, optional): The number of lists for a full build.
+
+    Returns:
+        IVFIndex: The updated index.
+    """
+    index = IVFIndex.load(index_path) if os.path.exists(index_path) else None
+    if index is None or index.needs_retraining():
+        ids, matrix = _load_vectors(session)
+        index = IVFIndex()
+        if len(ids):
+            index.build(ids, matrix, n_lists=n_lists)
+        logger.info("Built vector index with %s vectors.", len(index))
+    else:
+        ids, matrix = _load_vectors(session, changed_ids)
+        index.upsert(ids, matrix)
+        existing_ids = session.execute(
+            select(CodeFunction.id).where(CodeFunction.vector.is_not(None))
+        ).scalars()
+        index.remove(np.setdiff1d(index.ids, np.fromiter(existing_ids, np.int64)))
+        logger.info("Updated %s vectors in the vector index.", len(ids))
+    if index.centroids is not None:
+        index.save(index_path)
+    return index
+
+
+def ann_top_k_similar(
+    session: Session, index: IVFIndex, function_id: int, k: int = 5, n_probe: int = 8
+) -> list[tuple[int, float]]:
+    """
+    Find the functions most similar to a given function using the vector index.
+
+    Args:
+        session (Session): The database session.
+        index (IVFIndex): The vector index.
+        function_id (int): The ID of the function to compare against.
+        k (int, optional): The number of results. Defaults to 5.
+        n_probe (int, optional): The number of lists to scan. Defaults to 8.
+
+    Returns:
+        list[tuple[int, float]]: (function ID, cosine similarity) pairs, most similar
+            first, excluding the query function itself.
+    """
+    blob = session.execute(
+        select(CodeFunction.vector).where(CodeFunction.id == function_id)
+    ).scalar_one_or_none()
+    if blob is None:
+        logger.info("Function %s has no embedding.", function_id)
+        return []
+    results = index.search(blob_to_vector(blob), k=k + 1, n_probe=n_probe)
+    return [result for result in results if result[0] != function_id][:k]
@@ -14,6 +14,7 @@ This module can be used to load environment variables, initialize a logger, and
 import logging
 import os
 import sys
+from functools import lru_cache
 
 import tiktoken
 
@@ -70,3 +71,17 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
         raise NotImplementedError(
             f"num_tokens_from_messages() is not presently implemented for model {model}."
         )
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Get (and cache) the tiktoken encoding for a model."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def num_tokens_from_string(string: str, model="gpt-3.5-turbo-0301") -> int:
+    """Returns the number of tokens in a string."""
+    return len(_get_encoding(model).encode(string or ""))
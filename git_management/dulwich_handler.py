@@ -0,0 +1,334 @@
+"""A git handler that works on the repository in-process with dulwich.
+
+Each GitHandler command forks and execs a git process, which costs far more
+than the work itself for the small, frequent operations of the revise loop:
+reading the current branch, creating a branch, and committing one file per
+revised test. DulwichGitHandler does these in-process, reading and writing the
+.git directory directly, and falls back to the git command for the rest (merge
+and push).
+
+dulwich is optional. Use git_handler.get_git_handler() to get this handler when
+dulwich is installed and GitHandler otherwise.
+"""
+
+import fnmatch
+import os
+import time
+from typing import List
+
+from dulwich import porcelain
+from dulwich.ignore import IgnoreFilterManager
+from dulwich.index import (
+    Index,
+    blob_from_path_and_stat,
+    cleanup_mode,
+    commit_tree,
+    index_entry_from_stat,
+)
+from dulwich.object_store import iter_tree_contents
+from dulwich.objects import Commit
+from dulwich.objectspec import parse_commit
+from dulwich.repo import Repo, get_user_identity
+
+from git_management.git_handler import GitCommandError, GitHandler
+
+# Hooks git runs on commit; if any is installed, commits go through dulwich's
+# slower commit, which runs them too
+COMMIT_HOOKS = ("pre-commit", "commit-msg", "post-commit")
+
+
+def _to_str(value) -> str:
+    """Decode a path or name that dulwich may give as bytes."""
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _seconds(value) -> int:
+    """Get the whole seconds of an index entry time, stored as a number or a pair."""
+    return int(value[0] if isinstance(value, tuple) else value)
+
+
+class DulwichGitHandler(GitHandler):
+    """
+    A handler for git operations that avoids a subprocess where it can.
+
+    Status, branch, add and commit operations run in-process with dulwich. The
+    commit identity and ignore rules are read once, when the handler is created,
+    and the index and the files in HEAD's tree are kept between operations until
+    they change.
+    """
+
+    def __init__(self, path: str = "."):
+        super().__init__()
+        self.repo = Repo.discover(path)
+        self.identity = get_user_identity(self.repo.get_config_stack())
+        self.ignore = IgnoreFilterManager.from_repo(self.repo)
+        self._index = None
+        self._index_stat = None
+        self._tree_entries = (None, {})
+
+    def _open_index(self) -> Index:
+        """Get the index, reading it again only if the file has changed."""
+        path = self.repo.index_path()
+        try:
+            stat = os.stat(path)
+            index_stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            index_stat = None
+        if self._index is None or index_stat != self._index_stat:
+            self._index = Index(path, read=index_stat is not None)
+            self._index_stat = index_stat
+        return self._index
+
+    def _write_index(self, index: Index):
+        """Write the index, remembering the file it was written to."""
+        index.write()
+        stat = os.stat(index.path)
+        self._index_stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _has_commit_hooks(self) -> bool:
+        """Check whether git would run a hook on commit."""
+        hooks_dir = os.path.join(self.repo.controldir(), "hooks")
+        return any(
+            os.path.isfile(os.path.join(hooks_dir, hook)) for hook in COMMIT_HOOKS
+        )
+
+    def _head(self) -> bytes:
+        """Get the ID of the commit HEAD points to, or None before the first commit."""
+        try:
+            return self.repo.head()
+        except KeyError:
+            return None
+
+    def _head_tree(self) -> bytes:
+        """Get the ID of the tree HEAD points to, or None before the first commit."""
+        head = self._head()
+        return self.repo[head].tree if head else None
+
+    def _head_entries(self) -> dict[bytes, tuple[bytes, int]]:
+        """Get the ID and mode of each file in HEAD's tree, by path."""
+        tree = self._head_tree()
+        if tree != self._tree_entries[0]:
+            entries = {
+                entry.path: (entry.sha, entry.mode)
+                for entry in iter_tree_contents(self.repo.object_store, tree)
+            }
+            self._tree_entries = (tree, entries)
+        return dict(self._tree_entries[1])
+
+    def _commit(self, commit_message: str, tree: bytes = None) -> None:
+        """Commit the index, or a given tree, to the current branch."""
+        message = commit_message.encode("utf-8")
+        if tree is None or self._has_commit_hooks():
+            if hasattr(self.repo, "get_worktree"):
+                self.repo.get_worktree().commit(message=message, tree=tree)
+            else:  # dulwich before 0.23
+                self.repo.do_commit(message, tree=tree)
+            return
+        head = self._head()
+        commit = Commit()
+        commit.tree = tree
+        commit.parents = [head] if head else []
+        commit.author = commit.committer = self.identity
+        commit.author_time = commit.commit_time = int(time.time())
+        timezone = time.localtime().tm_gmtoff
+        commit.author_timezone = commit.commit_timezone = timezone
+        commit.message = message if message.endswith(b"\n") else message + b"\n"
+        self.repo.object_store.add_object(commit)
+        first_line = message.splitlines()[0] if message else b""
+        if not self.repo.refs.set_if_equals(
+            b"HEAD",
+            head,
+            commit.id,
+            committer=self.identity,
+            timestamp=commit.commit_time,
+            timezone=timezone,
+            message=b"commit: " + first_line,
+        ):
+            raise GitCommandError("HEAD moved while committing.")
+
+    def create_new_branch(self, branch_name: str) -> None:
+        """
+        Create a new git branch from HEAD and check it out.
+
+        Args:
+            branch_name (str): The name of the new branch.
+
+        Raises:
+            GitCommandError: If the branch already exists.
+        """
+        ref = f"refs/heads/{branch_name}".encode("utf-8")
+        if ref in self.repo.refs:
+            raise GitCommandError(f"A branch named '{branch_name}' already exists.")
+        self.repo.refs[ref] = self.repo.head()
+        self.repo.refs.set_symbolic_ref(b"HEAD", ref)
+
+    def add_files(self) -> None:
+        """
+        Add all modified and new (untracked) files to git.
+        """
+        porcelain.add(self.repo)
+
+    def commit_changes(self, commit_message: str) -> None:
+        """
+        Commit the staged changes.
+
+        Args:
+            commit_message (str): The commit message.
+
+        Raises:
+            GitCommandError: If nothing is staged.
+        """
+        tree = self._open_index().commit(self.repo.object_store)
+        if tree == self._head_tree():
+            raise GitCommandError("There is nothing to commit.")
+        self._commit(commit_message, tree)
+
+    def commit_files(self, commit_message: str, paths: List[str]) -> None:
+        """
+        Stage and commit the changes to some files only.
+
+        Other staged or modified files are left out of the commit.
+
+        Args:
+            commit_message (str): The commit message.
+            paths (List[str]): The files to commit.
+
+        Raises:
+            GitCommandError: If the files have no changes to commit.
+        """
+        root = self.repo.path
+        store = self.repo.object_store
+        index = self._open_index()
+        entries = self._head_entries()
+        changed = False
+        for path in paths:
+            full_path = os.path.abspath(path)
+            key = os.path.relpath(full_path, root).replace(os.sep, "/").encode("utf-8")
+            try:
+                stat = os.lstat(full_path)
+            except FileNotFoundError:
+                entry = None
+                if key in index:
+                    del index[key]
+            else:
+                blob = blob_from_path_and_stat(full_path.encode("utf-8"), stat)
+                if blob.id not in store:
+                    store.add_object(blob)
+                index[key] = index_entry_from_stat(stat, blob.id)
+                entry = (blob.id, cleanup_mode(stat.st_mode))
+            if entries.get(key) != entry:
+                changed = True
+                if entry is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = entry
+        self._write_index(index)
+        if not changed:
+            raise GitCommandError(f"There is nothing to commit in {paths}.")
+        tree = commit_tree(
+            store, [(path, sha, mode) for path, (sha, mode) in entries.items()]
+        )
+        self._commit(commit_message, tree)
+        self._tree_entries = (tree, entries)
+
+    def get_current_branch(self) -> str:
+        """
+        Get the name of the current branch.
+
+        Returns:
+            str: The name of the current branch, or "HEAD" if it is detached.
+        """
+        try:
+            ref = self.repo.refs.read_ref(b"HEAD")
+        except KeyError:
+            return "HEAD"
+        if ref and ref.startswith(b"ref: refs/heads/"):
+            return _to_str(ref[len(b"ref: refs/heads/") :])
+        return "HEAD"
+
+    def get_tree_hash(self, ref: str = "HEAD") -> str:
+        """
+        Get the hash of the tree a commit points to.
+
+        Args:
+            ref (str): The commit to look up. Defaults to HEAD.
+
+        Returns:
+            str: The hash of the commit's tree.
+
+        Raises:
+            GitCommandError: If the commit does not exist.
+        """
+        try:
+            return _to_str(parse_commit(self.repo, ref).tree)
+        except KeyError as error:
+            raise GitCommandError(f"Unknown revision: {ref}") from error
+
+    def _is_modified(self, path: bytes, entry, index_time: int) -> bool:
+        """
+        Check whether a file differs from its index entry, hashing it if needed.
+
+        A file modified in the same second as the index was written may have
+        changed without its size or time changing, so it is always hashed.
+        """
+        full_path = os.path.join(self.repo.path, _to_str(path))
+        try:
+            stat = os.lstat(full_path)
+        except FileNotFoundError:
+            return True
+        mtime = _seconds(entry.mtime)
+        if stat.st_size == entry.size and int(stat.st_mtime) == mtime < index_time:
+            return False
+        blob = blob_from_path_and_stat(full_path.encode("utf-8"), stat)
+        return blob.id != entry.sha
+
+    def _untracked_paths(self, index):
+        """Yield the paths of the files that are neither tracked nor ignored."""
+        root = self.repo.path
+        for directory, dirs, files in os.walk(root):
+            relative_dir = os.path.relpath(directory, root).replace(os.sep, "/")
+            prefix = "" if relative_dir == "." else relative_dir + "/"
+            dirs[:] = [
+                name
+                for name in dirs
+                if name != ".git" and not self.ignore.is_ignored(prefix + name + "/")
+            ]
+            for name in files:
+                path = prefix + name
+                if path.encode("utf-8") not in index and not self.ignore.is_ignored(
+                    path
+                ):
+                    yield path
+
+    def is_working_tree_clean(self, pathspec: str = None) -> bool:
+        """
+        Check whether the working tree matches HEAD.
+
+        Files whose size and modification time match the index are taken to be
+        unchanged, as git does; others are hashed.
+
+        Args:
+            pathspec (str): Only check the paths matching this glob, e.g. "*.py".
+
+        Returns:
+            bool: True if there are no uncommitted or untracked changes.
+        """
+
+        def matches(path) -> bool:
+            return pathspec is None or fnmatch.fnmatch(_to_str(path), pathspec)
+
+        index = self._open_index()
+        staged = {path: (entry.sha, entry.mode) for path, entry in index.items()}
+        head = self._head_entries()
+        if any(
+            head.get(path) != staged.get(path) and matches(path)
+            for path in head.keys() | staged.keys()
+        ):
+            return False
+        index_time = int(os.stat(index.path).st_mtime)
+        if any(
+            matches(path) and self._is_modified(path, entry, index_time)
+            for path, entry in index.items()
+        ):
+            return False
+        return not any(matches(path) for path in self._untracked_paths(index))
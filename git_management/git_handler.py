@@ -44,6 +44,28 @@ class GitHandler:
                 f"An error occurred while running the git command: {' '.join(command)}"
             ) from error
 
+    @staticmethod
+    def read_command(command: List[str]) -> str:
+        """
+        Run a git command using subprocess and return its output.
+
+        Args:
+            command (List[str]): The git command to run as a list of strings.
+
+        Returns:
+            str: The output of the command.
+
+        Raises:
+            GitCommandError: If the git command fails.
+        """
+        try:
+            output = subprocess.check_output(command, shell=False)  # nosec B603
+        except subprocess.CalledProcessError as error:
+            raise GitCommandError(
+                f"An error occurred while running the git command: {' '.join(command)}"
+            ) from error
+        return output.decode("utf-8")
+
     def create_new_branch(self, branch_name: str) -> None:
         """
         Create a new git branch.
@@ -77,6 +99,22 @@ class GitHandler:
         """
         self.run_command([self.git_path, "commit", "-m", commit_message])
 
+    def commit_files(self, commit_message: str, paths: List[str]) -> None:
+        """
+        Stage and commit the changes to some files only.
+
+        Other staged or modified files are left out of the commit.
+
+        Args:
+            commit_message (str): The commit message.
+            paths (List[str]): The files to commit.
+
+        Raises:
+            GitCommandError: If the git command fails.
+        """
+        self.run_command([self.git_path, "add", "--", *paths])
+        self.run_command([self.git_path, "commit", "-m", commit_message, "--", *paths])
+
     def push_changes(self, branch_name: str) -> None:
         """
         Push changes to a git branch.
@@ -107,6 +145,42 @@ class GitHandler:
             .strip()
         )
 
+    def get_tree_hash(self, ref: str = "HEAD") -> str:
+        """
+        Get the hash of the tree a commit points to.
+
+        Commits with the same files share a tree hash, whichever branch they are on.
+
+        Args:
+            ref (str): The commit to look up. Defaults to HEAD.
+
+        Returns:
+            str: The hash of the commit's tree.
+
+        Raises:
+            GitCommandError: If the git command fails.
+        """
+        command = [self.git_path, "rev-parse", f"{ref}^{{tree}}"]
+        return self.read_command(command).strip()
+
+    def is_working_tree_clean(self, pathspec: str = None) -> bool:
+        """
+        Check whether the working tree matches HEAD.
+
+        Args:
+            pathspec (str): Only check the paths matching this, e.g. "*.py".
+
+        Returns:
+            bool: True if there are no uncommitted or untracked changes.
+
+        Raises:
+            GitCommandError: If the git command fails.
+        """
+        command = [self.git_path, "status", "--porcelain"]
+        if pathspec:
+            command += ["--", pathspec]
+        return not self.read_command(command).strip()
+
     def create_temp_test_branch(self, branch_name: str = None) -> str:
         """
         Create a new git branch.
@@ -126,7 +200,7 @@ class GitHandler:
             branch_name = (
                 current_branch + "_temp_" + datetime.now().strftime("%Y%m%d%H%M%S")
             )
-        self.run_command([self.git_path, "checkout", "-b", branch_name])
+        self.create_new_branch(branch_name)
         # Add branch to a class list to be deleted later
         self.temp_branches.append(branch_name)
         self.pre_temp_branch = current_branch
@@ -143,3 +217,25 @@ class GitHandler:
         self.run_command([self.git_path, "branch", "-d", self.temp_branches[-1]])
         self.temp_branches.pop()
         self.pre_temp_branch = None
+
+
+def get_git_handler(path: str = ".") -> GitHandler:
+    """
+    Get a git handler, working in-process with dulwich if it is installed.
+
+    Args:
+        path (str): A path inside the repository.
+
+    Returns:
+        GitHandler: A DulwichGitHandler if dulwich is installed and the path is in a
+        git repository, otherwise a GitHandler running the git command.
+    """
+    try:
+        from dulwich.errors import NotGitRepository
+        from git_management.dulwich_handler import DulwichGitHandler
+    except ImportError:  # dulwich is optional
+        return GitHandler()
+    try:
+        return DulwichGitHandler(path)
+    except NotGitRepository:
+        return GitHandler()
@@ -2,6 +2,8 @@
 This script would handle interactions with the LLM, 
 such as querying the LLM to generate new code or tests.
 """
+import ast
+import functools
 import json
 import random
 import time
@@ -14,6 +16,7 @@ from openai import OpenAI
 from config import OPENAI_API_KEY
 
 import llm.prompts as prompts
+from code_management.code_validation import validate_generated_code
 from functions import logger, num_tokens_from_messages
 
 
@@ -22,6 +25,12 @@ client = OpenAI(api_key=OPENAI_API_KEY)
 
 GOOD_MODEL = "gpt-4-0613"  # or whatever model you are using
 QUICK_MODEL = "gpt-3.5-turbo-0613"
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Running totals of the tokens used by api_request, e.g. for benchmarks
+token_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+# Number of requests for code that fails validation before giving up
+MAX_GENERATION_ATTEMPTS = 2
 
 
 def load_json_string(str_in: str) -> dict:
@@ -86,8 +95,11 @@ def api_request(
 
     for attempt in range(1, max_tries + 1):
         try:
-            response = client.chat.completions.create(**params)
-            return response.model_dump()
+            response = client.chat.completions.create(**params).model_dump()
+            for key, value in (response.get("usage") or {}).items():
+                if key in token_usage and isinstance(value, int):
+                    token_usage[key] += value
+            return response
         except (
             openai.APIError,
             openai.error.Timeout,
@@ -137,18 +149,37 @@ CODE_FUNCTIONS = [
 ]
 
 
-def generate_from_prompt(prepare_prompt_func, prepare_prompt_args):
+def generate_from_prompt(prepare_prompt_func, prepare_prompt_args, validate=None):
     """
     Use the LLM to generate Python code or a test based on a given prompt.
 
     Args:
         prepare_prompt_func (function): Function used to prepare the prompt.
         prepare_prompt_args (dict): Arguments to pass to the prepare prompt function.
+        validate (function, optional): Called with the code and import statements,
+            returning a list of problems. Code with problems is requested again,
+            with the problems added to the prompt, up to MAX_GENERATION_ATTEMPTS
+            times.
 
     Returns:
-        Tuple[str, str]: The generated Python code or test and the import statements.
+        Tuple[str, str]: The generated Python code or test and the import statements,
+        or (None, None) if no valid code was generated.
     """
-    prompt = prepare_prompt_func(**prepare_prompt_args)
+    original_prompt = prompt = prepare_prompt_func(**prepare_prompt_args)
+    for attempt in range(1, MAX_GENERATION_ATTEMPTS + 1):
+        code, imports = _request_code(prompt)
+        if validate is None or code is None:
+            return code, imports
+        problems = validate(code, imports)
+        if not problems:
+            return code, imports
+        logger.info("Generation attempt %s was rejected.", attempt)
+        prompt = prompts.rejected_code_prompt(original_prompt, code, problems)
+    return None, None
+
+
+def _request_code(prompt: str):
+    """Request code for a prompt and split the response into code and imports."""
     messages = prompts.build_messages(prompt)
     function_call = {"name": "add_function_to_file"}
     response = api_request(
@@ -170,6 +201,18 @@ def generate_from_prompt(prepare_prompt_func, prepare_prompt_args):
         return response_message["content"], None
 
 
+def _defined_function_name(code: str) -> str:
+    """Get the name of the first function defined in some code, if it parses."""
+    try:
+        module = ast.parse(code or "")
+    except SyntaxError:
+        return None
+    for node in module.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            return node.name
+    return None
+
+
 def generate_code(task_description: str, function_file: str) -> Tuple[str, List[str]]:
     """
     Use the LLM to generate Python code for a given task.
@@ -184,11 +227,15 @@ def generate_code(task_description: str, function_file: str) -> Tuple[str, List[
     return generate_from_prompt(
         prompts.create_function_prompt,
         {"task_description": task_description, "function_file": function_file},
+        validate=validate_generated_code,
     )
 
 
 def generate_test(
-    function_code: str, function_file: str, test_name: str = None
+    function_code: str,
+    function_file: str,
+    test_name: str = None,
+    callee_context: str = None,
 ) -> Tuple[str, str]:
     """
     Use the LLM to generate a Python test based on a given prompt.
@@ -197,6 +244,7 @@ def generate_test(
         function_code (str): Code of function to build a test for.
         function_file (str): File containing the function to build a test for.
         test_name (str, optional): The name of the test. Defaults to None.
+        callee_context (str, optional): Signatures of the functions it calls.
 
     Returns:
         Tuple[str, str]: A tuple containing the generated
@@ -208,7 +256,9 @@ def generate_test(
             "function_code": function_code,
             "function_file": function_file,
             "test_name": test_name,
+            "callee_context": callee_context,
         },
+        validate=functools.partial(validate_generated_code, expected_name=test_name),
     )
 
 
@@ -236,9 +286,30 @@ def revise_test(
             "function_code": function_code,
             "test_output": test_output,
         },
+        validate=functools.partial(
+            validate_generated_code,
+            expected_name=_defined_function_name(original_test_code),
+        ),
     )
 
 
+def generate_embeddings(
+    texts: list[str], model: str = EMBEDDING_MODEL
+) -> list[list[float]]:
+    """
+    Use the embeddings API to embed a batch of texts.
+
+    Args:
+        texts (list[str]): The texts to embed.
+        model (str, optional): The embedding model. Defaults to EMBEDDING_MODEL.
+
+    Returns:
+        list[list[float]]: One embedding per text, in the same order.
+    """
+    response = client.embeddings.create(model=model, input=texts)
+    return [item.embedding for item in sorted(response.data, key=lambda x: x.index)]
+
+
 def generate_todo_list() -> str:
     """
     Use the LLM to generate a to-do list.
@@ -72,7 +72,10 @@ def build_messages(
 
 
 def create_test_prompt(
-    function_code: str, function_file: str, test_name: str = None
+    function_code: str,
+    function_file: str,
+    test_name: str = None,
+    callee_context: str = None,
 ) -> str:
     """
     Create a prompt for the LLM to generate a test based on the provided function code.
@@ -81,6 +84,8 @@ def create_test_prompt(
         function_code (str): The source code of the function to test.
         function_file (str): The file containing the function to test.
         test_name (str, optional): The name of the test. Defaults to None.
+        callee_context (str, optional): Signatures of the functions called by the
+            function to test. Defaults to None.
 
     Returns:
         str: The generated prompt.
@@ -89,6 +94,11 @@ def create_test_prompt(
     prompt = "I would like you to write a pytest unit test.\n\n"
     prompt += "Here is code for the function to test:\n\n" + function_code + "\n\n"
     prompt += "The function to test is in the file " + function_file + "\n\n"
+    if callee_context:
+        prompt += (
+            "The function to test calls these functions from the project"
+            " (signatures only):\n\n" + callee_context + "\n\n"
+        )
     prompt += (
         "Import the function in the test file using the"
         " [function_file].[function_name] syntax.\n\n"
@@ -117,6 +127,18 @@ def revise_test_prompt(
     return prompt
 
 
+def rejected_code_prompt(prompt: str, code: str, problems: list[str]) -> str:
+    """Get a prompt repeating a request, with the problems of a rejected attempt."""
+    prompt += "----\n"
+    prompt += "A previous attempt at this was rejected before it was run:\n\n"
+    prompt += f"{code}\n\n"
+    prompt += "Problems:\n"
+    prompt += "".join(f"* {problem}\n" for problem in problems)
+    prompt += "\nPlease fix these problems, and only import modules and names "
+    prompt += "that exist in the project or its requirements.\n"
+    return prompt
+
+
 def create_function_prompt(task_description: str, function_file: str) -> str:
     """
     Create a prompt for the LLM to generate a function based on the provided task description.
@@ -1,6 +1,6 @@
 """Test the code_database module."""
 import os
-from unittest.mock import create_autospec, Mock
+from unittest.mock import Mock
 
 
 from code_management.code_database import (
@@ -9,24 +9,61 @@ from code_management.code_database import (
     CodeTest,
     Session,
     add_test_to_db,
+    build_callee_context,
+    build_name_trie,
+    get_callees,
+    dispose_engines,
+    get_engine,
     link_tests,
+    match_name_prefixes,
+    session_scope,
     setup_db,
 )
 
 
 def test_setup_db(mocker):
     """Test the setup_db function."""
-    mock_create_engine = mocker.patch("code_management.code_database.create_engine")
+    mock_get_engine = mocker.patch("code_management.code_database.get_engine")
     mock_sessionmaker = mocker.patch("code_management.code_database.sessionmaker")
     mock_Session = mocker.MagicMock()
     mock_sessionmaker.return_value = mock_Session
     db_path = "sqlite:///test.db"
     setup_db(db_path)
-    mock_create_engine.assert_called_once_with("sqlite:///test.db", echo=True)
-    mock_sessionmaker.assert_called_once_with(bind=mock_create_engine.return_value)
+    mock_get_engine.assert_called_once_with("sqlite:///test.db", echo=False)
+    mock_sessionmaker.assert_called_once_with(bind=mock_get_engine.return_value)
     mock_Session.assert_called_once()
-    if os.path.exists("test.db"):
-        os.remove("test.db")
+
+
+def test_get_engine_is_shared_and_tuned(tmp_path):
+    """One engine is created per URL, with echo off and the SQLite pragmas set."""
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = get_engine(db_path)
+    assert get_engine(db_path) is engine
+    assert engine.echo is False
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    dispose_engines()
+    assert get_engine(db_path) is not engine
+    dispose_engines()
+
+
+def test_session_scope(tmp_path):
+    """The scope commits on success, rolls back on error and keeps objects usable."""
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(db_path) as session:
+        session.add(CodeClass(class_name="Kept", class_string=""))
+    try:
+        with session_scope(db_path) as session:
+            session.add(CodeClass(class_name="Dropped", class_string=""))
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    with session_scope(db_path) as session:
+        classes = session.query(CodeClass).all()
+    assert [c.class_name for c in classes] == ["Kept"]
+    dispose_engines()
 
 
 def test_code_storage():
@@ -57,43 +94,53 @@ def test_code_storage():
     assert added_function.function_string == function_string
     assert added_function.class_id == new_class.id
     session.close()
+    dispose_engines()
     os.remove("test.db")
 
 
-def test_link_tests(mocker):
-    session = create_autospec(Session, instance=True)
-    mock_function = create_autospec(CodeFunction, instance=True)
-    mock_function.function_name = "mock_func"
-
-    # Give a unique 'id' attribute to the mock_function object
-    mock_function.id = 1
-
-    mock_test = create_autospec(CodeTest, instance=True)
-    mock_test.test_name = "test_mock_func"
-    mock_test.class_test = False
-    mock_test.function_id = None
-
-    mock_class = create_autospec(CodeClass, instance=True)
-    mock_class.class_name = "mock_class"  # Note this addition
-
-    session.query(CodeClass).all.return_value = [mock_class]
-    session.query(CodeTest).all.return_value = [mock_test]
-
-    session.query(CodeFunction).filter_by(
-        function_name="mock_func"
-    ).first.return_value = mock_function
+def test_link_tests(tmp_path):
+    """Tests are linked by name, matching whole class names only."""
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(db_path) as session:
+        git = CodeClass(class_name="Git", class_string="")
+        git_handler = CodeClass(class_name="GitHandler", class_string="")
+        session.add_all([git, git_handler])
+        session.flush()
+        clone = CodeFunction(function_name="clone", function_string="", class_id=git.id)
+        commit = CodeFunction(
+            function_name="commit", function_string="", class_id=git_handler.id
+        )
+        helper = CodeFunction(function_name="helper", function_string="")
+        session.add_all([clone, commit, helper])
+        session.add_all(
+            [
+                CodeTest(test_name="test_GitHandler_commit", test_string=""),
+                CodeTest(test_name="test_Git_clone", test_string=""),
+                CodeTest(test_name="test_helper", test_string=""),
+                CodeTest(test_name="test_missing", test_string=""),
+            ]
+        )
+        session.flush()
 
-    with mocker.patch(
-        "code_management.code_database.get_class_names", return_value=["mock_class"]
-    ):
-        link_tests(session)
+        assert link_tests(session) == 4
+        tests = {test.test_name: test for test in session.query(CodeTest).all()}
+        assert tests["test_GitHandler_commit"].class_id == git_handler.id
+        assert tests["test_GitHandler_commit"].function_id == commit.id
+        assert tests["test_Git_clone"].class_id == git.id
+        assert tests["test_Git_clone"].function_id == clone.id
+        assert tests["test_helper"].class_test is False
+        assert tests["test_helper"].function_id == helper.id
+        assert tests["test_missing"].function_id is None
+        assert link_tests(session) == 0
+    dispose_engines()
 
-    session.query(CodeTest).all.assert_called_once()
-    session.query(CodeFunction).filter_by.assert_called_with(function_name="mock_func")
 
-    # Assert mock_test.function_id equals the id of the returned function object
-    assert mock_test.function_id == mock_function.id
-    session.commit.assert_called_once()
+def test_match_name_prefixes():
+    """Names match whole, longest first."""
+    trie = build_name_trie(["Git", "GitHandler", "Git_Tools"])
+    assert match_name_prefixes(trie, "GitHandler_commit") == ["GitHandler"]
+    assert match_name_prefixes(trie, "Git_Tools_run") == ["Git_Tools", "Git"]
+    assert match_name_prefixes(trie, "Gi_run") == []
 
 
 def test_add_test_to_db(monkeypatch):
@@ -109,6 +156,7 @@ def test_add_test_to_db(monkeypatch):
     )
 
     db_session_mock = Mock(spec=Session)
+    db_session_mock.scalar.return_value = None
     function_mock = Mock(spec=CodeFunction)
     function_mock.id = 1
     function_mock.class_id = 2
@@ -126,6 +174,23 @@ def test_add_test_to_db(monkeypatch):
     assert new_test.class_id == function_mock.class_id
 
 
+def test_add_test_to_db_updates_existing_test(tmp_path):
+    """A test regenerated under a stored file and name replaces the stored row."""
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(db_path) as session:
+        first = CodeFunction(function_name="run", function_string="def run(): ...")
+        second = CodeFunction(function_name="run", function_string="def run(): ...")
+        session.add_all([first, second])
+        session.flush()
+        add_test_to_db(session, first, "def test_run(): pass", "tests/test_a.py")
+        session.flush()
+        add_test_to_db(session, second, "def test_run(): 1", "tests/test_a.py")
+    with session_scope(db_path) as session:
+        test = session.query(CodeTest).one()
+        assert (test.test_string, test.function_id) == ("def test_run(): 1", 2)
+    dispose_engines()
+
+
 def test_CodeClass___repr__():
     """
     Test the __repr__ method of the CodeClass.
@@ -161,3 +226,104 @@ def test_CodeTest___repr__():
     result = test_instance.__repr__()
     expected_repr = "<CodeTest(1, test_repr)>"
     assert result == expected_repr, f"Expected repr: {expected_repr}, but got: {result}"
+
+
+def test_get_callees_and_build_callee_context(tmp_path, mocker):
+    """Callees are resolved from the database, preferring the caller's own class."""
+    mocker.patch(
+        "code_management.code_database.num_tokens_from_string",
+        side_effect=lambda text: len(text.split()),
+    )
+    session = setup_db(f"sqlite:///{tmp_path / 'test.db'}")
+    my_class = CodeClass(class_name="MyClass", class_string="")
+    session.add(my_class)
+    session.commit()
+    caller = CodeFunction(
+        function_name="caller",
+        function_string="def caller(self):\n    self.helper()\n    other(1)",
+        file_path="a.py",
+        class_id=my_class.id,
+    )
+    method = CodeFunction(
+        function_name="helper",
+        function_string='def helper(self) -> int:\n    """Help."""\n    return 1',
+        file_path="a.py",
+        class_id=my_class.id,
+    )
+    session.add_all(
+        [
+            caller,
+            method,
+            CodeFunction(
+                function_name="helper",
+                function_string="def helper(x):\n    return x",
+                file_path="b.py",
+            ),
+            CodeFunction(
+                function_name="other",
+                function_string="def other(value: int):\n    return value",
+                file_path="b.py",
+            ),
+        ]
+    )
+    session.commit()
+
+    callees = get_callees(session, caller)
+    assert [callee.id for callee in callees] == [method.id, callees[1].id]
+    assert callees[1].function_name == "other"
+
+    context = build_callee_context(session, caller)
+    assert context == (
+        '# a.py\ndef helper(self) -> int:\n    """Help."""\n\n'
+        "# b.py\ndef other(value: int):\n    ..."
+    )
+    assert build_callee_context(session, caller, token_budget=6) == (
+        "# b.py\ndef other(value: int):\n    ..."
+    )
+    session.close()
+
+
+def test_get_callees_resolves_only_known_receivers(tmp_path):
+    """Method calls on unknown receivers are not matched to project functions."""
+    session = setup_db(f"sqlite:///{tmp_path / 'test.db'}")
+    caller = CodeFunction(
+        function_name="caller",
+        function_string=(
+            "def caller(data):\n    data.get('key')\n    items.append(1)\n"
+            "    helpers.get()\n    run()"
+        ),
+        file_path="agent/core.py",
+        imports="import tools.helpers as helpers",
+    )
+    module_get = CodeFunction(
+        function_name="get",
+        function_string="def get():\n    pass",
+        file_path="./tools/helpers.py",
+    )
+    run = CodeFunction(
+        function_name="run",
+        function_string="def run():\n    pass",
+        file_path="tools/runner.py",
+    )
+    session.add_all(
+        [
+            caller,
+            module_get,
+            run,
+            CodeFunction(
+                function_name="get",
+                function_string="def get():\n    pass",
+                file_path="store.py",
+            ),
+            CodeFunction(
+                function_name="append",
+                function_string="def append(self, item):\n    pass",
+                file_path="store.py",
+                class_id=1,
+            ),
+        ]
+    )
+    session.commit()
+
+    assert get_callees(session, caller) == [module_get, run]
+    session.close()
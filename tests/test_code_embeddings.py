@@ -0,0 +1,107 @@
+"""Test the code_embeddings module."""
+
+import numpy as np
+
+from code_management.code_database import CodeFunction, setup_db
+from code_management.code_embeddings import (
+    blob_to_vector,
+    embed_functions,
+    load_vector_matrix,
+    top_k_similar,
+    vector_to_blob,
+)
+
+
+def fake_embed(texts):
+    """Embed texts as simple character statistics."""
+    return [[text.count("a") + 1.0, text.count("b") + 1.0, len(text)] for text in texts]
+
+
+def test_vector_blob_round_trip():
+    """Vectors are stored as packed float32 bytes."""
+    blob = vector_to_blob([1.0, 2.5, -3.0])
+    assert isinstance(blob, bytes)
+    assert len(blob) == 12
+    assert blob_to_vector(blob).tolist() == [1.0, 2.5, -3.0]
+
+
+def test_embed_functions_only_reembeds_changed(tmp_path):
+    """Only functions whose source changed are sent to the embedder again."""
+    session = setup_db(f"sqlite:///{tmp_path / 'test.db'}")
+    session.add_all(
+        [
+            CodeFunction(function_name="f1", function_string="def f1(): aaa"),
+            CodeFunction(function_name="f2", function_string="def f2(): bbb"),
+        ]
+    )
+    session.commit()
+    calls = []
+
+    def recording_embed(texts):
+        calls.append(texts)
+        return fake_embed(texts)
+
+    assert len(embed_functions(session, batch_size=1, embed_func=recording_embed)) == 2
+    assert len(calls) == 2
+    assert embed_functions(session, embed_func=recording_embed) == []
+
+    function = session.query(CodeFunction).filter_by(function_name="f2").first()
+    function.function_string = "def f2(): bbbb"
+    session.commit()
+    assert embed_functions(session, embed_func=recording_embed) == [function.id]
+    assert isinstance(function.vector, bytes)
+    session.close()
+
+
+def test_embed_functions_uses_content_hash_and_skips_empty(tmp_path):
+    """Stored content hashes decide staleness, and empty sources are not embedded."""
+    session = setup_db(f"sqlite:///{tmp_path / 'test.db'}")
+    hashed = CodeFunction(
+        function_name="f1", function_string="def f1(): aaa", content_hash="h1"
+    )
+    session.add_all(
+        [
+            hashed,
+            CodeFunction(function_name="empty", function_string="  \n"),
+        ]
+    )
+    session.commit()
+    calls = []
+
+    def recording_embed(texts):
+        calls.append(texts)
+        return fake_embed(texts)
+
+    assert embed_functions(session, embed_func=recording_embed) == [hashed.id]
+    assert calls == [["def f1(): aaa"]]
+    assert hashed.vector_hash == "h1"
+    assert embed_functions(session, embed_func=recording_embed) == []
+
+    hashed.content_hash = "h2"
+    session.commit()
+    assert embed_functions(session, embed_func=recording_embed) == [hashed.id]
+    session.close()
+
+
+def test_top_k_similar(tmp_path):
+    """The most similar functions are returned first, excluding the query itself."""
+    session = setup_db(f"sqlite:///{tmp_path / 'test.db'}")
+    vectors = {"query": [1, 0, 0], "close": [0.9, 0.1, 0], "far": [0, 0, 1]}
+    for name, vector in vectors.items():
+        session.add(
+            CodeFunction(
+                function_name=name, function_string=name, vector=vector_to_blob(vector)
+            )
+        )
+    session.commit()
+    ids = {f.function_name: f.id for f in session.query(CodeFunction).all()}
+
+    loaded_ids, matrix = load_vector_matrix(session)
+    assert matrix.dtype == np.float32
+    assert matrix.flags["C_CONTIGUOUS"]
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+
+    result = top_k_similar(session, ids["query"], k=2, vectors=(loaded_ids, matrix))
+    assert [function_id for function_id, _ in result] == [ids["close"], ids["far"]]
+    assert top_k_similar(session, 9999) == []
+    session.close()
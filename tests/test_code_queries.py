@@ -0,0 +1,52 @@
+"""Test the code_queries module."""
+
+from sqlalchemy import event
+
+from code_management.code_database import (
+    CodeClass,
+    CodeFunction,
+    CodeTest,
+    compute_test_name,
+    dispose_engines,
+    get_engine,
+    session_scope,
+)
+from code_management.code_queries import functions_without_tests
+
+
+def test_functions_without_tests(tmp_path):
+    """Untested functions stream in one query, with their classes loaded."""
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(db_path) as session:
+        greeter = CodeClass(class_name="Greeter", class_string="")
+        session.add(greeter)
+        session.flush()
+        tested = CodeFunction(function_name="tested", function_string="")
+        session.add_all(
+            [
+                tested,
+                CodeFunction(function_name="untested", function_string=""),
+                CodeFunction(
+                    function_name="greet", function_string="", class_id=greeter.id
+                ),
+            ]
+        )
+        session.flush()
+        session.add(
+            CodeTest(test_name="test_tested", test_string="", function_id=tested.id)
+        )
+
+    statements = []
+    event.listen(
+        get_engine(db_path),
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+    with session_scope(db_path) as session:
+        names = [
+            compute_test_name(session, function)
+            for function in functions_without_tests(session, chunk_size=1)
+        ]
+    assert names == ["test_untested", "test_Greeter_greet"]
+    assert len(statements) == 1
+    dispose_engines()
@@ -6,10 +6,6 @@ from unittest import mock
 
 
 from code_management import code_reader
-from code_management.code_reader import (
-    create_code_objects,
-    handle_non_test_function_processing,
-)
 from config import PROJECT_DIRECTORY
 
 
@@ -131,168 +127,6 @@ def test_get_summary():
         assert result == "summary"
 
 
-def test_create_code_objects(mocker):
-    """
-    Test the create_code_objects function to ensure it processes classes and functions.
-    """
-    import code_management.code_reader
-
-    session_mock = mocker.MagicMock()
-    file_path = "path/to/file.py"
-    file_contents = "class TestClass:\n    pass\n\ndef test_func():\n    pass"
-    mocker.patch("builtins.open", mocker.mock_open(read_data=file_contents))
-    mocker.patch(
-        "code_management.code_reader.extract_classes_and_functions",
-        return_value=([("TestClass",)], [("test_func",)]),
-    )
-    mocker.patch("code_management.code_reader.handle_class_processing")
-    mocker.patch("code_management.code_reader.handle_function_processing")
-    mocker.patch("code_management.code_reader.link_tests")
-    create_code_objects(session_mock, file_path)
-    code_management.code_reader.extract_classes_and_functions.assert_called_once_with(
-        file_contents
-    )
-    code_management.code_reader.handle_class_processing.assert_called_once_with(
-        session_mock, ("TestClass",), file_path, file_contents
-    )
-    code_management.code_reader.handle_function_processing.assert_called_once_with(
-        session_mock, ("test_func",), file_path
-    )
-    code_management.code_reader.link_tests.assert_called_once_with(session_mock)
-    session_mock.commit.assert_called_once()
-
-
-def test_handle_class_processing(mocker):
-    """Test handle_class_processing function for managing class data."""
-
-    from sqlalchemy.orm import Session
-    from code_management.code_reader import handle_class_processing
-
-    mock_session = mocker.MagicMock(spec=Session)
-    mock_query = mock_session.query.return_value
-    mock_filter_by = mock_query.filter_by.return_value
-    mock_first = mock_filter_by.first
-    class_params = ("TestClass", "class TestClass:", '"""A test class."""', [])
-    file_path = "test_file.py"
-    contents = 'class TestClass:\n    """A test class."""'
-    mock_first.return_value = None
-
-    handle_class_processing(mock_session, class_params, file_path, contents)
-
-    assert mock_session.add.called
-    assert mock_session.commit.called
-    assert mock_session.refresh.called
-
-
-def test_handle_function_in_class_processing(mocker):
-    """Tests the handle_function_in_class_processing function for proper processing of
-    CodeFunction objects within a class."""
-    import code_management.code_reader
-
-    mock_session = mocker.MagicMock()
-    mock_node = mocker.MagicMock()
-    mock_node.name = "test_function"
-    mock_contents = "def test_function(): pass"
-    mock_class_obj = mocker.MagicMock()
-    mock_class_obj.functions = []
-    mock_query = mock_session.query.return_value
-    mock_filter_by = mock_query.filter_by.return_value
-    mock_filter_by.first.return_value = None
-    mocker.patch(
-        "code_management.code_reader.ast.get_source_segment", return_value=mock_contents
-    )
-    mocker.patch("code_management.code_reader.ast.get_docstring", return_value="")
-    code_management.code_reader.handle_function_in_class_processing(
-        mock_session, mock_node, "path/to/file.py", mock_contents, mock_class_obj
-    )
-    mock_session.add.assert_called_once()
-
-
-def test_handle_function_processing(mocker):
-    """
-    Test handle_function_processing to ensure it delegates to the correct handler.
-
-    This test verifies that handle_function_processing correctly determines whether a
-    function is a test function or not and calls the appropriate handler function
-    based on the function name and file path provided.
-    """
-    from sqlalchemy.orm import Session
-    import code_management.code_reader
-    from code_management.code_reader import handle_function_processing
-
-    mock_session = mocker.MagicMock(spec=Session)
-    function_params = (
-        "test_example",
-        "def test_example(): pass",
-        "Example test function",
-    )
-    file_path = "tests/test_example.py"
-    mocker.patch("code_management.code_reader.handle_test_function_processing")
-    mocker.patch("code_management.code_reader.handle_non_test_function_processing")
-    handle_function_processing(mock_session, function_params, file_path)
-    code_management.code_reader.handle_test_function_processing.assert_called_once_with(
-        mock_session,
-        "test_example",
-        "def test_example(): pass",
-        "tests/test_example.py",
-        "Example test function",
-    )
-    code_management.code_reader.handle_non_test_function_processing.assert_not_called()
-
-
-def test_handle_test_function_processing(mocker):
-    """
-    Test handle_test_function_processing to ensure it creates a new CodeTest object and
-    adds it to the session when an existing test is not found.
-    """
-    from unittest.mock import MagicMock
-
-    from sqlalchemy.orm import Session
-
-    from code_management.code_reader import handle_test_function_processing
-
-    mock_session = MagicMock(spec=Session)
-    mock_query = mock_session.query.return_value
-    mock_filter_by = mock_query.filter_by.return_value
-    mock_filter_by.first.return_value = None
-    function_name = "new_test_function"
-    function_string = "def new_test_function(): pass"
-    file_path = "tests/test_new.py"
-    function_doc_string = "This is a test function."
-    handle_test_function_processing(
-        mock_session, function_name, function_string, file_path, function_doc_string
-    )
-    mock_session.add.assert_called_once()
-
-
-def test_handle_non_test_function_processing(mocker):
-    """Test handle_non_test_function_processing when the function does not exist."""
-    session_mock = mocker.MagicMock()
-    query_mock = session_mock.query.return_value
-    filter_by_mock = query_mock.filter_by.return_value
-    filter_by_mock.first.return_value = None
-    code_function_mock = mocker.patch("code_management.code_reader.CodeFunction")
-    function_name = "test_func"
-    function_string = "def test_func(): pass"
-    file_path = "some/file/path.py"
-    function_doc_string = "Test function docstring."
-    handle_non_test_function_processing(
-        session=session_mock,
-        function_name=function_name,
-        function_string=function_string,
-        file_path=file_path,
-        function_doc_string=function_doc_string,
-    )
-    code_function_mock.assert_called_once_with(
-        function_string=function_string,
-        function_name=function_name,
-        file_path=file_path,
-        doc_string=function_doc_string,
-        is_function=True,
-    )
-    session_mock.add.assert_called_once_with(code_function_mock.return_value)
-
-
 def test_extract_classes_and_functions():
     from code_management.code_reader import extract_classes_and_functions
 
@@ -342,3 +176,77 @@ def test__is_test():
 
     # Test cases with mixed prefixes should still return True
     assert _is_test("test_function", "test_file.py") is True
+
+
+def test_bulk_create_code_objects(tmp_path):
+    """Files are ingested with upserts: re-ingesting updates rows without duplicates."""
+    from sqlalchemy import inspect, select
+
+    from code_management.code_database import (
+        CodeClass,
+        CodeFileBlob,
+        CodeFunction,
+        CodeTest,
+        dispose_engines,
+        session_scope,
+    )
+    from code_management.code_reader import bulk_create_code_objects
+    from code_management.code_search import search_code
+
+    source_file = tmp_path / "module.py"
+    source_file.write_text(
+        "class Greeter:\n    def greet(self):\n        return 'hi'\n\n"
+        "def helper():\n    return 1\n"
+    )
+    test_file = tmp_path / "test_module.py"
+    test_file.write_text("def test_helper():\n    assert True\n")
+    broken_file = tmp_path / "broken.py"
+    broken_file.write_text("def broken(:\n")
+    file_paths = [str(source_file), str(test_file), str(broken_file)]
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+
+    with session_scope(db_path) as session:
+        stats = bulk_create_code_objects(session, file_paths, batch_size=2)
+    assert stats["files"] == 2
+    assert stats["rows"] == stats["inserted"] == 4
+    assert stats["rows_per_second"] > 0
+
+    source_file.write_text(
+        "class Greeter:\n    def greet(self):\n        return 'hello'\n\n"
+        "def helper():\n    return 1\n"
+    )
+    with session_scope(db_path) as session:
+        stats = bulk_create_code_objects(session, file_paths)
+        greeter = session.query(CodeClass).one()
+        functions = (
+            session.query(CodeFunction).order_by(CodeFunction.function_name).all()
+        )
+        assert session.query(CodeTest).count() == 1
+        # The file blobs are only loaded once a row's source is read
+        assert "blob" in inspect(functions[0]).unloaded
+        assert "hello" in greeter.class_string
+        assert "hello" in functions[0].function_string
+    assert [f.function_name for f in functions] == ["greet", "helper"]
+    assert functions[0].class_id == greeter.id
+    assert functions[1].class_id is None
+    # The class and its method changed; the function and test did not
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (0, 2, 2)
+    # Each file is stored once and the rows slice their source from it
+    with session_scope(db_path) as session:
+        assert session.query(CodeFileBlob).count() == 2
+        greet = session.query(CodeFunction).filter_by(function_name="greet").one()
+        assert greet._function_string == ""
+        assert isinstance(greet.source_view, memoryview)
+        assert session.scalar(
+            select(CodeFunction.function_string).where(CodeFunction.id == greet.id)
+        ) == greet.function_string
+        results = search_code(session, "hello")
+        assert {result["name"] for result in results} == {"Greeter", "greet"}
+
+    source_file.write_text("class Greeter:\n    pass\n")
+    with session_scope(db_path) as session:
+        stats = bulk_create_code_objects(session, [str(source_file)], prune=True)
+        assert session.query(CodeFunction).count() == 0
+        assert session.query(CodeTest).count() == 0
+    assert (stats["updated"], stats["deleted"]) == (1, 3)
+    dispose_engines()
@@ -0,0 +1,95 @@
+"""Test the code_search module."""
+
+from code_management.code_database import (
+    CodeClass,
+    CodeFunction,
+    CodeTest,
+    dispose_engines,
+    get_engine,
+    session_scope,
+)
+from code_management.code_reader import bulk_create_code_objects
+from code_management.code_search import build_match_query, search_code
+
+
+def test_build_match_query():
+    """Terms are quoted so symbols are not parsed as query syntax."""
+    assert build_match_query('get_engine  "x" a.b') == '"get_engine" """x""" "a.b"'
+    assert build_match_query("   ") == ""
+
+
+def test_search_code(tmp_path):
+    """The index follows inserts, updates and deletes and ranks name matches first."""
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(db_path) as session:
+        session.add_all(
+            [
+                CodeFunction(
+                    function_name="get_engine",
+                    function_string="def get_engine(): return create_engine()",
+                    file_path="db.py",
+                ),
+                CodeFunction(
+                    function_name="setup_db",
+                    function_string="def setup_db(): return get_engine()",
+                    doc_string="Set up the DB.",
+                    file_path="db.py",
+                ),
+                CodeClass(
+                    class_name="Engine",
+                    class_string="class Engine: ...",
+                    file_path="e.py",
+                ),
+                CodeTest(test_name="test_get_engine", test_string="", file_path="t.py"),
+            ]
+        )
+
+    with session_scope(db_path) as session:
+        results = search_code(session, "get_engine")
+        names = [(r["kind"], r["name"]) for r in results]
+        assert set(names[:2]) == {
+            ("function", "get_engine"),
+            ("test", "test_get_engine"),
+        }
+        assert names[2] == ("function", "setup_db")
+        assert results[2]["snippet"] == "def setup_db(): return [get_engine]()"
+        assert [r["name"] for r in search_code(session, "engine", kind="class")] == [
+            "Engine"
+        ]
+
+        function = session.query(CodeFunction).filter_by(function_name="setup_db").one()
+        function.doc_string = "Prepare the database."
+        session.flush()
+        assert [r["id"] for r in search_code(session, "prepare")] == [function.id]
+        session.delete(function)
+        session.flush()
+        assert search_code(session, "prepare") == []
+        assert search_code(session, "prep*", raw=True) == []
+    dispose_engines()
+
+
+def test_search_index_stores_no_source(tmp_path):
+    """The index reads source from the file blobs and stays consistent with them."""
+    db_path = f"sqlite:///{tmp_path / 'test.db'}"
+    source_file = tmp_path / "module.py"
+    source_file.write_text("def helper():\n    return 'needle'\n")
+    with session_scope(db_path) as session:
+        bulk_create_code_objects(session, [str(source_file)])
+        results = search_code(session, "needle")
+        assert [r["name"] for r in results] == ["helper"]
+        assert results[0]["snippet"] == "def helper():\n    return '[needle]'"
+
+    source_file.write_text("def helper():\n    return 'thread'\n")
+    with session_scope(db_path) as session:
+        bulk_create_code_objects(session, [str(source_file)])
+        assert search_code(session, "needle") == []
+        assert [r["name"] for r in search_code(session, "thread")] == ["helper"]
+    with get_engine(db_path).begin() as connection:
+        tables = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE name = 'code_search_content'"
+        ).all()
+        assert tables == []
+        connection.exec_driver_sql(
+            "INSERT INTO code_search (code_search, rank) VALUES ('integrity-check', 1)"
+        )
+    dispose_engines()
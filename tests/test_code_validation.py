@@ -0,0 +1,40 @@
+"""Test the code_validation module."""
+
+from code_management.code_validation import validate_generated_code
+
+TEST_CODE = "def test_area():\n    assert area(2, 3) == 6\n"
+
+
+def test_valid_code_passes(tmp_path):
+    """Code that compiles, defines the test and imports existing names is valid."""
+    (tmp_path / "shapes.py").write_text("def area(w, h):\n    return w * h\n")
+    imports = ["import json", "from shapes import area", ""]
+    assert validate_generated_code(TEST_CODE, imports, "test_area", str(tmp_path)) == []
+
+
+def test_bad_generations_are_rejected(tmp_path):
+    """Syntax errors, unknown imports and a wrong test name are all reported."""
+    package = tmp_path / "geometry"
+    package.mkdir()
+    (package / "__init__.py").write_text("from geometry.shapes import *\n")
+    (package / "shapes.py").write_text("SIDES = {'square': 4}\n")
+    directory = str(tmp_path)
+
+    assert validate_generated_code("def test_area(:\n", [], None, directory)
+    assert validate_generated_code(TEST_CODE, [], "test_volume", directory) == [
+        "The code does not define a function test_volume."
+    ]
+    assert validate_generated_code(
+        TEST_CODE,
+        [
+            "import not_a_real_package",
+            "from geometry.shapes import SIDES, area",
+            "from geometry import shapes, anything",
+            "x = 1",
+        ],
+        directory=directory,
+    ) == [
+        "'x = 1' is not an import statement.",
+        "No module named 'not_a_real_package'.",
+        "Cannot import 'area' from 'geometry.shapes'.",
+    ]
@@ -15,13 +15,24 @@ It mocks the necessary functions and methods to simulate the formatting of Pytho
 These test functions ensure the correct behavior and functionality of the `agent.core` module.
 """
 import ast
+import sqlite3
 from unittest import mock
 from unittest.mock import MagicMock, patch
 
 
 import agent.core
 import llm.llm_interface as llm
-from agent.core import generate_test_from_function, populate_db
+from agent.core import (
+    generate_test_from_function,
+    generate_tests_from_db,
+    populate_db,
+)
+from code_management.code_database import (
+    CodeFunction,
+    CodeTest,
+    dispose_engines,
+    session_scope,
+)
 from functions import logger
 
 
@@ -139,7 +150,8 @@ def test_get_further_information(mocker):
 def test_run_task_from_next_issue(mocker):
     """Test the run_task_from_next_issue function."""
     mock_gh_issues = mocker.patch("agent.core.GitHubIssues", autospec=True)
-    mock_git_handler = mocker.patch("agent.core.GitHandler", autospec=True)
+    mock_git_handler = mocker.patch("agent.core.get_git_handler", autospec=True)
+    mock_sync_db = mocker.patch("agent.core.sync_db", autospec=True)
     mock_run_task = mocker.patch("agent.core.run_task", autospec=True)
     mock_generate_tests = mocker.patch("agent.core.generate_tests", autospec=True)
     mock_issue = mock_gh_issues.return_value.get_next_issue.return_value
@@ -149,6 +161,7 @@ def test_run_task_from_next_issue(mocker):
     mock_gh_issues.return_value.task_from_issue.assert_called_once_with(mock_issue)
     mock_gh_issues.return_value.generate_branch_name.assert_called_once_with(mock_issue)
     mock_git_handler.return_value.create_new_branch.assert_called_once()
+    mock_sync_db.assert_called_once_with(git_handler=mock_git_handler.return_value)
     mock_run_task.assert_called_once()
     mock_generate_tests.assert_called_once()
 
@@ -205,6 +218,7 @@ def test_generate_test_from_function(mocker):
         mock_function.function_string,
         function_file=mock_function.file_path,
         test_name=test_name,
+        callee_context=None,
     )
     assert output == ("test_code", "imports")
 
@@ -219,6 +233,7 @@ def test_generate_test_from_function(mocker):
         mock_function.function_string,
         function_file=mock_function.file_path,
         test_name=test_name,
+        callee_context=None,
     )
     assert output is None
 
@@ -245,17 +260,84 @@ def test_populate_db(mocker):
     """Test the populate_db function to ensure it correctly populates the database."""
 
     # Arrange
-    mock_setup_db = mocker.patch("agent.core.setup_db")
+    mock_session_scope = mocker.patch("agent.core.session_scope")
     mock_get_python_files = mocker.patch("agent.core.utils.get_python_files")
     mock_get_python_files.return_value = ["test_file.py"]
-    mock_create_code_objects = mocker.patch("agent.core.create_code_objects")
+    mock_bulk_create_code_objects = mocker.patch("agent.core.bulk_create_code_objects")
     mock_link_tests = mocker.patch("agent.core.link_tests")
 
     # Act
     populate_db(start_dir="test_dir")
 
     # Assert
-    mock_setup_db.assert_called_once()
+    mock_session_scope.assert_called_once()
     mock_get_python_files.assert_called_once_with("test_dir", skip_tests=False)
-    mock_create_code_objects.assert_called()
+    mock_bulk_create_code_objects.assert_called_once_with(
+        mock_session_scope.return_value.__enter__.return_value,
+        ["test_file.py"],
+        prune=True,
+    )
     mock_link_tests.assert_called_once()
+
+
+def test_generate_tests_from_db_keeps_earlier_tests(tmp_path, monkeypatch, mocker):
+    """A test that cannot be stored does not lose the tests generated before it."""
+    monkeypatch.chdir(tmp_path)
+    with session_scope() as session:
+        session.add_all(
+            [
+                CodeFunction(function_name=name, function_string="", file_path="m.py")
+                for name in ("first", "second")
+            ]
+        )
+    mocker.patch(
+        "agent.core.generate_test_from_function", return_value=("code", "imports")
+    )
+    mocker.patch("agent.core.write_test_to_file", return_value="tests/test_m.py")
+    add_test_to_db = agent.core.add_test_to_db
+
+    def add_or_conflict(session, function, test_code, test_file_name):
+        test = add_test_to_db(session, function, test_code, test_file_name)
+        if function.function_name == "second":
+            # Clashes with the test stored for the first function
+            session.add(
+                CodeTest(
+                    test_name="test_first", test_string="", file_path=test_file_name
+                )
+            )
+        return test
+
+    mocker.patch("agent.core.add_test_to_db", side_effect=add_or_conflict)
+    generate_tests_from_db()
+    with session_scope() as session:
+        assert [test.test_name for test in session.query(CodeTest)] == ["test_first"]
+    dispose_engines()
+
+
+def test_generate_tests_from_db_commits_each_test(tmp_path, monkeypatch, mocker):
+    """Tests are committed one by one, and no write lock is held while generating."""
+    monkeypatch.chdir(tmp_path)
+    with session_scope() as session:
+        session.add_all(
+            [
+                CodeFunction(function_name=name, function_string="", file_path="m.py")
+                for name in ("first", "second")
+            ]
+        )
+    stored = []
+
+    def generate(function_string, **kwargs):
+        # Another connection can write straight away, and sees the earlier tests
+        connection = sqlite3.connect(tmp_path / "code.db", timeout=0)
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS probe (x)")
+            connection.execute("INSERT INTO probe VALUES (1)")
+        stored.append(connection.execute("SELECT count(*) FROM code_test").fetchone())
+        connection.close()
+        return "code", "imports"
+
+    mocker.patch("agent.core.llm.generate_test", side_effect=generate)
+    mocker.patch("agent.core.write_test_to_file", return_value="tests/test_m.py")
+    generate_tests_from_db()
+    assert stored == [(0,), (1,)]
+    dispose_engines()
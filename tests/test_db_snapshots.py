@@ -0,0 +1,114 @@
+"""Test the db_snapshots module."""
+
+import pytest
+
+from code_management.code_database import (
+    CodeFunction,
+    CodeTest,
+    CodeTestRun,
+    dispose_engines,
+    session_scope,
+)
+from code_management.db_snapshots import (
+    prune_snapshots,
+    restore_snapshot,
+    save_snapshot,
+    snapshot_path,
+    sync_db,
+)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A database with one function."""
+    path = f"sqlite:///{tmp_path / 'code.db'}"
+    with session_scope(path) as session:
+        session.add(CodeFunction(function_name="f", function_string="def f(): ..."))
+    yield path
+    dispose_engines()
+
+
+def function_names(db_path):
+    """Get the names of the functions in a database."""
+    with session_scope(db_path) as session:
+        return sorted(name for (name,) in session.query(CodeFunction.function_name))
+
+
+def test_restore_snapshot(db_path, tmp_path):
+    """A restored snapshot replaces the live database, and its vector index."""
+    snapshot_dir = str(tmp_path / "snapshots")
+    index_path = tmp_path / "code.db.ivf.npz"
+    index_path.write_bytes(b"index")
+    save_snapshot("tree-a", db_path, snapshot_dir)
+    with session_scope(db_path) as session:
+        session.add(CodeFunction(function_name="g", function_string="def g(): ..."))
+    index_path.unlink()
+    assert function_names(db_path) == ["f", "g"]
+
+    assert restore_snapshot("tree-a", db_path, snapshot_dir)
+    assert function_names(db_path) == ["f"]
+    assert index_path.read_bytes() == b"index"
+    assert not restore_snapshot("tree-b", db_path, snapshot_dir)
+
+
+def test_restore_snapshot_keeps_recorded_data(db_path, tmp_path):
+    """Statuses, durations, embeddings and run history outlive a restore."""
+    snapshot_dir = str(tmp_path / "snapshots")
+    with session_scope(db_path) as session:
+        session.add(CodeTest(test_name="test_f", test_string="", file_path="t.py"))
+        function = session.query(CodeFunction).one()
+        function.file_path, function.content_hash = "f.py", "f-hash"
+    save_snapshot("tree-a", db_path, snapshot_dir)
+    with session_scope(db_path) as session:
+        test = session.query(CodeTest).one()
+        test.test_status, test.duration = "pass", 1.5
+        session.add(CodeTestRun(test_id=test.id, outcome="pass", duration=1.5))
+        function = session.query(CodeFunction).one()
+        function.vector, function.vector_hash = b"\x00" * 4, "f-hash"
+        session.add(CodeFunction(function_name="g", function_string="def g(): ..."))
+
+    assert restore_snapshot("tree-a", db_path, snapshot_dir)
+    assert function_names(db_path) == ["f"]
+    with session_scope(db_path) as session:
+        test = session.query(CodeTest).one()
+        assert (test.test_status, test.duration) == ("pass", 1.5)
+        assert [run.test_id for run in session.query(CodeTestRun)] == [test.id]
+        assert session.query(CodeFunction).one().vector == b"\x00" * 4
+
+
+def test_prune_snapshots(db_path, tmp_path):
+    """Only the most recently used snapshots are kept."""
+    snapshot_dir = str(tmp_path / "snapshots")
+    for tree_hash in ("a", "b", "c"):
+        save_snapshot(tree_hash, db_path, snapshot_dir, limit=10)
+    restore_snapshot("a", db_path, snapshot_dir)
+    prune_snapshots(snapshot_dir, limit=2)
+    assert (tmp_path / "snapshots" / "a.db").exists()
+    assert not (tmp_path / "snapshots" / "b.db").exists()
+    assert snapshot_path("c", snapshot_dir).endswith("c.db")
+
+
+def test_sync_db(mocker, db_path, tmp_path):
+    """A tree is ingested once; switching back to it restores its snapshot."""
+    snapshot_dir = str(tmp_path / "snapshots")
+    git_handler = mocker.Mock()
+    git_handler.get_tree_hash.return_value = "tree-a"
+    git_handler.is_working_tree_clean.return_value = True
+    mock_ingest = mocker.patch(
+        "code_management.db_snapshots.bulk_create_code_objects", autospec=True
+    )
+    mocker.patch("code_management.db_snapshots.utils.get_python_files")
+
+    assert not sync_db(".", db_path, snapshot_dir, git_handler)
+    assert mock_ingest.call_count == 1
+    with session_scope(db_path) as session:
+        session.add(CodeFunction(function_name="g", function_string="def g(): ..."))
+
+    assert sync_db(".", db_path, snapshot_dir, git_handler)
+    assert mock_ingest.call_count == 1
+    assert function_names(db_path) == ["f"]
+
+    # Uncommitted changes are ingested on top of the snapshot, which is kept as is
+    git_handler.is_working_tree_clean.return_value = False
+    assert sync_db(".", db_path, snapshot_dir, git_handler)
+    assert mock_ingest.call_count == 2
@@ -0,0 +1,100 @@
+"""Test the db_writer module."""
+
+import asyncio
+import threading
+
+import pytest
+
+from code_management.code_database import (
+    CodeFunction,
+    CodeTest,
+    dispose_engines,
+    session_scope,
+)
+from code_management.db_writer import DatabaseWriter, record_test, set_test_status
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A database with one function."""
+    path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(path) as session:
+        session.add(CodeFunction(function_name="f", function_string="def f(): ..."))
+    yield path
+    dispose_engines()
+
+
+def test_concurrent_writers(db_path):
+    """Writes from many threads are all applied."""
+    with DatabaseWriter(db_path) as writer:
+        test_ids = [
+            writer.submit(record_test, 1, f"def test_{i}(): ...", f"tests/t{i}.py")
+            for i in range(20)
+        ]
+        test_ids = [future.result(timeout=10) for future in test_ids]
+
+        def worker(test_id):
+            writer.submit(set_test_status, test_id, "pass").result(timeout=10)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in test_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    with session_scope(db_path) as session:
+        statuses = session.query(CodeTest.test_status).all()
+    assert statuses == [("pass",)] * 20
+    assert writer.stats["jobs"] == 40
+
+
+def test_jobs_queued_while_busy_are_committed_together(db_path):
+    """Jobs queued while the writer is busy share one commit."""
+    started, release = threading.Event(), threading.Event()
+
+    def block(session):
+        started.set()
+        release.wait(timeout=10)
+
+    with DatabaseWriter(db_path) as writer:
+        blocked = writer.submit(block)
+        assert started.wait(timeout=10)
+        futures = [
+            writer.submit(record_test, 1, f"def test_{i}(): ...", f"tests/t{i}.py")
+            for i in range(10)
+        ]
+        release.set()
+        blocked.result(timeout=10)
+        assert len({future.result(timeout=10) for future in futures}) == 10
+    assert writer.stats["jobs"] == 11
+    assert writer.stats["commits"] == 2
+
+
+def test_failing_job_is_isolated(db_path):
+    """A failing job raises through its own future without losing the others."""
+
+    def fail(session):
+        raise ValueError("boom")
+
+    with DatabaseWriter(db_path) as writer:
+        writer.submit(set_test_status, 999, "fail")
+        failed = writer.submit(fail)
+        recorded = writer.submit(record_test, 1, "def test_f(): ...", "tests/t.py")
+        with pytest.raises(ValueError):
+            failed.result(timeout=10)
+        assert recorded.result(timeout=10) == 1
+    assert writer.stats["failed"] == 1
+
+
+def test_run_from_asyncio(db_path):
+    """Jobs can be awaited from an event loop."""
+
+    async def main(writer):
+        return await asyncio.gather(
+            *[
+                writer.run(record_test, 1, "def test_f(): ...", f"tests/t{i}.py")
+                for i in range(3)
+            ]
+        )
+
+    with DatabaseWriter(db_path) as writer:
+        assert sorted(asyncio.run(main(writer))) == [1, 2, 3]
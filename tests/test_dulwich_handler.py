@@ -0,0 +1,75 @@
+"""Test the dulwich_handler module against the git command."""
+
+import shutil
+import subprocess  # nosec
+
+import pytest
+
+pytest.importorskip("dulwich")
+
+from git_management.dulwich_handler import DulwichGitHandler  # noqa: E402
+from git_management.git_handler import GitCommandError, get_git_handler  # noqa: E402
+
+GIT_PATH = shutil.which("git")
+
+
+def git(repo, *args) -> str:
+    """Run a git command in a repository and return its output."""
+    return subprocess.check_output(
+        [GIT_PATH, "-C", str(repo), *args], text=True
+    ).strip()  # nosec B603
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """A repository with one commit on main."""
+    git(tmp_path, "init", "-q", "-b", "main")
+    git(tmp_path, "config", "user.name", "Tester")
+    git(tmp_path, "config", "user.email", "tester@example.com")
+    (tmp_path / "tests").mkdir()
+    for name in ("tests/test_a.py", "tests/test_b.py"):
+        (tmp_path / name).write_text("def test():\n    pass\n", encoding="utf-8")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Initial commit")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_branches_and_tree_hash(repo):
+    """Branches made in-process are seen by git, and tree hashes agree."""
+    handler = get_git_handler()
+    assert isinstance(handler, DulwichGitHandler)
+    assert handler.get_current_branch() == "main"
+    assert handler.get_tree_hash() == git(repo, "rev-parse", "HEAD^{tree}")
+
+    branch = handler.create_temp_test_branch()
+    assert branch.startswith("main_temp_")
+    assert git(repo, "rev-parse", "--abbrev-ref", "HEAD") == branch
+    with pytest.raises(GitCommandError):
+        handler.create_new_branch(branch)
+
+
+def test_commit_files_commits_only_those_files(repo):
+    """Other modified and staged files stay out of the commit, as with git."""
+    handler = DulwichGitHandler()
+    assert handler.is_working_tree_clean("*.py")
+    for name in ("test_a.py", "test_b.py"):
+        (repo / "tests" / name).write_text("def test():\n    assert 1\n")
+    (repo / "notes.txt").write_text("notes\n")
+    git(repo, "add", "tests/test_b.py")
+    assert not handler.is_working_tree_clean("*.py")
+
+    handler.commit_files("Revise test_a", ["tests/test_a.py"])
+
+    assert git(repo, "log", "-1", "--format=%s") == "Revise test_a"
+    assert git(repo, "show", "--name-only", "--format=", "HEAD") == "tests/test_a.py"
+    assert git(repo, "status", "--porcelain").splitlines() == [
+        "M  tests/test_b.py",
+        "?? notes.txt",
+    ]
+    with pytest.raises(GitCommandError):
+        handler.commit_files("Nothing", ["tests/test_a.py"])
+
+    handler.commit_changes("Revise test_b")
+    assert handler.is_working_tree_clean("*.py")
+    assert not handler.is_working_tree_clean()
@@ -72,3 +72,80 @@ def test_GitHandler_push_changes(mocker):
 
     # Assert
     mock_run_command.assert_called_once_with([GIT_PATH, "push", "origin", branch_name])
+
+
+def test_GitHandler_get_tree_hash(mocker):
+    """
+    Test that get_tree_hash looks up the tree of the given commit.
+
+    Args:
+        mocker: A pytest-mock fixture used to mock objects and functions.
+    """
+    git_handler = GitHandler()
+    mock_check_output = mocker.patch("subprocess.check_output", return_value=b"abc\n")
+    assert git_handler.get_tree_hash() == "abc"
+    mock_check_output.assert_called_once_with(
+        [GIT_PATH, "rev-parse", "HEAD^{tree}"], shell=False
+    )
+
+
+def test_GitHandler_is_working_tree_clean(mocker):
+    """
+    Test that is_working_tree_clean reports changes to the matching paths.
+
+    Args:
+        mocker: A pytest-mock fixture used to mock objects and functions.
+    """
+    git_handler = GitHandler()
+    mock_check_output = mocker.patch("subprocess.check_output", return_value=b"")
+    assert git_handler.is_working_tree_clean("*.py")
+    mock_check_output.assert_called_once_with(
+        [GIT_PATH, "status", "--porcelain", "--", "*.py"], shell=False
+    )
+    mock_check_output.return_value = b" M utils.py\n"
+    assert not git_handler.is_working_tree_clean()
+
+
+def test_GitHandler_commit_files(mocker):
+    """
+    Test that commit_files stages and commits only the given files.
+
+    Args:
+        mocker: A pytest-mock fixture used to mock objects and functions.
+    """
+    git_handler = GitHandler()
+    mock_run_command = mocker.patch.object(git_handler, "run_command")
+    git_handler.commit_files("Revise test", ["tests/test_a.py"])
+    assert mock_run_command.call_args_list == [
+        mocker.call([GIT_PATH, "add", "--", "tests/test_a.py"]),
+        mocker.call([GIT_PATH, "commit", "-m", "Revise test", "--", "tests/test_a.py"]),
+    ]
+
+
+def test_GitHandler_create_temp_test_branch(mocker):
+    """
+    Test that create_temp_test_branch branches off the current branch and records it.
+
+    Args:
+        mocker: A pytest-mock fixture used to mock objects and functions.
+    """
+    git_handler = GitHandler()
+    mocker.patch.object(git_handler, "get_current_branch", return_value="main")
+    mock_create = mocker.patch.object(git_handler, "create_new_branch")
+    assert git_handler.create_temp_test_branch("main_temp") == "main_temp"
+    mock_create.assert_called_once_with("main_temp")
+    assert git_handler.temp_branches == ["main_temp"]
+    assert git_handler.pre_temp_branch == "main"
+
+
+def test_get_git_handler_without_dulwich(mocker):
+    """
+    Test that get_git_handler falls back to the git command without dulwich.
+
+    Args:
+        mocker: A pytest-mock fixture used to mock objects and functions.
+    """
+    from git_management.git_handler import get_git_handler
+
+    mocker.patch.dict("sys.modules", {"dulwich.errors": None})
+    assert type(get_git_handler()) is GitHandler
@@ -84,6 +84,45 @@ def test_generate_from_prompt():
         assert imports == ["import json"]
 
 
+def test_generate_from_prompt_requests_again_when_rejected():
+    """Code that fails validation is requested again, with the problems given."""
+    prepare_prompt_func = MagicMock(return_value="Test prompt")
+    responses = [
+        {
+            "choices": [
+                {
+                    "message": {
+                        "function_call": {
+                            "arguments": json.dumps(
+                                {
+                                    "function_code": code,
+                                    "import_statements": "import json",
+                                }
+                            )
+                        }
+                    }
+                }
+            ]
+        }
+        for code in ("def test_x(:", "def test_x():\n    pass")
+    ]
+    validate = MagicMock(side_effect=[["The code does not compile."], []])
+    with patch("llm.llm_interface.api_request", side_effect=responses) as mock_api:
+        (function_code, imports) = llm_interface.generate_from_prompt(
+            prepare_prompt_func, {}, validate=validate
+        )
+    assert function_code == "def test_x():\n    pass"
+    assert imports == ["import json"]
+    retry_prompt = mock_api.call_args.kwargs["messages"][-1]["content"]
+    assert "* The code does not compile." in retry_prompt
+
+    validate = MagicMock(return_value=["No module named 'x'."])
+    with patch("llm.llm_interface.api_request", side_effect=responses):
+        assert llm_interface.generate_from_prompt(
+            prepare_prompt_func, {}, validate=validate
+        ) == (None, None)
+
+
 def test_generate_code():
     """
     Test the generate_code function.
@@ -0,0 +1,89 @@
+"""Test the migrations module."""
+
+import sqlite3
+
+from sqlalchemy import inspect
+
+from code_management.code_database import dispose_engines, get_engine
+from code_management.migrations import SCHEMA_VERSION, get_schema_version, migrate
+
+# The schema of code.db before any migrations existed
+OLD_SCHEMA = """
+CREATE TABLE code_class (
+    id INTEGER PRIMARY KEY, class_string VARCHAR NOT NULL, class_name VARCHAR NOT NULL,
+    file_path VARCHAR, doc_string VARCHAR, imports VARCHAR, test_status VARCHAR
+);
+CREATE TABLE code_function (
+    id INTEGER PRIMARY KEY, function_string VARCHAR NOT NULL,
+    function_name VARCHAR NOT NULL, file_path VARCHAR, doc_string VARCHAR,
+    vector VARCHAR, test_status VARCHAR, imports VARCHAR, code_type VARCHAR,
+    is_test BOOLEAN, is_function BOOLEAN, class_id INTEGER REFERENCES code_class(id)
+);
+CREATE TABLE code_test (
+    id INTEGER PRIMARY KEY, test_string VARCHAR NOT NULL, test_name VARCHAR NOT NULL,
+    file_path VARCHAR, doc_string VARCHAR, test_status VARCHAR, class_test BOOLEAN,
+    function_id INTEGER REFERENCES code_function(id),
+    class_id INTEGER REFERENCES code_class(id)
+);
+INSERT INTO code_class VALUES (1, '', 'A', 'a.py', NULL, NULL, NULL);
+INSERT INTO code_class VALUES (2, '', 'A', 'a.py', NULL, NULL, NULL);
+INSERT INTO code_function (id, function_string, function_name, file_path, class_id)
+VALUES (1, '', 'f', 'a.py', NULL), (2, '', 'f', 'a.py', NULL), (3, '', 'm', 'a.py', 2);
+INSERT INTO code_test (id, test_string, test_name, file_path, function_id, class_id)
+VALUES (1, '', 'test_f', 'tests/test_a.py', 2, NULL),
+       (2, '', 'test_A_m', 'tests/test_a.py', 3, 2),
+       (3, '', 'test_A_m', 'tests/test_a.py', 3, 2);
+"""
+
+
+def test_migrate_upgrades_old_database(tmp_path):
+    """An old code.db gets the new columns, loses duplicates and gains indexes."""
+    db_file = tmp_path / "old.db"
+    connection = sqlite3.connect(db_file)
+    connection.executescript(OLD_SCHEMA)
+    connection.close()
+
+    engine = get_engine(f"sqlite:///{db_file}")
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == SCHEMA_VERSION
+        functions = connection.exec_driver_sql(
+            "SELECT id, class_id FROM code_function ORDER BY id"
+        ).all()
+        tests = connection.exec_driver_sql(
+            "SELECT id, function_id, class_id FROM code_test ORDER BY id"
+        ).all()
+        classes = connection.exec_driver_sql("SELECT id FROM code_class").all()
+    assert classes == [(1,)]
+    assert functions == [(1, None), (3, 1)]
+    assert tests == [(1, 1, None), (2, 3, 1)]
+
+    inspector = inspect(engine)
+    columns = {column["name"] for column in inspector.get_columns("code_function")}
+    assert "vector_hash" in columns
+    with engine.connect() as connection:
+        index_names = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE tbl_name = 'code_function' "
+            "AND type = 'index'"
+        ).scalars()
+        assert {"ux_code_function_natural_key", "ix_code_function_test_status"} <= (
+            set(index_names)
+        )
+    assert migrate(engine) == 0
+    dispose_engines()
+
+
+def test_new_database_matches_migrated_indexes(tmp_path):
+    """create_all and the migrations produce the same indexes."""
+    engine = get_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    inspector = inspect(engine)
+    index_names = {index["name"] for index in inspector.get_indexes("code_test")}
+    assert index_names == {
+        "ux_code_test_natural_key",
+        "ix_code_test_test_status",
+        "ix_code_test_function_id",
+        "ix_code_test_class_id",
+        "ix_code_test_blob_id",
+    }
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == SCHEMA_VERSION
+    dispose_engines()
@@ -110,6 +110,15 @@ def test_create_test_prompt():
     assert output == expected_output, f"Expected: {expected_output}, but got: {output}"
 
 
+def test_create_test_prompt_with_callee_context():
+    """Callee signatures are included when given."""
+    output = prompts.create_test_prompt(
+        "def f():\n    g()", "./f.py", callee_context="def g():\n    ..."
+    )
+    assert "calls these functions" in output
+    assert "def g():\n    ..." in output
+
+
 def test_create_function_docstring_prompt():
     """
     Test the create_function_docstring_prompt function.
@@ -0,0 +1,98 @@
+"""Test the pytest_output module."""
+
+import pytest
+
+from code_management import pytest_output
+from code_management.pytest_output import distil_pytest_output
+
+SAMPLE_OUTPUT = "\n".join(
+    [
+        "============================= test session starts ==============================",
+        "platform linux -- Python 3.11.7, pytest-7.4.3, pluggy-1.3.0",
+        "rootdir: /project",
+        "collected 1 item",
+        "",
+        "tests/test_sample.py F                                                   [100%]",
+        "",
+        "=================================== FAILURES ===================================",
+        "__________________________________ test_deep ___________________________________",
+        "",
+        "    def test_deep():",
+        ">       assert deep(3) == 1",
+        "",
+        "tests/test_sample.py:19: ",
+    ]
+    + [
+        "sample.py:16: in deep\n    return deep(n - 1)\n           ^^^^^^^^^^^"
+        for _ in range(3)
+    ]
+    + [
+        "/usr/lib/python3.11/site-packages/lib.py:5: in wrapper\n    return f()",
+        "",
+        "n = 0",
+        "",
+        "    def deep(n):",
+        "        if n == 0:",
+        '>           raise ValueError("boom")',
+        "E           ValueError: boom",
+        "",
+        "sample.py:15: ValueError",
+        "----------------------------- Captured stdout call -----------------------------",
+    ]
+    + [f"noise line {i}" for i in range(100)]
+    + [
+        "=========================== short test summary info ============================",
+        "FAILED tests/test_sample.py::test_deep - ValueError: boom",
+        "============================== 1 failed in 0.12s ===============================",
+    ]
+)
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(mocker):
+    """Count words as tokens so the tests do not need the tiktoken encodings."""
+    mocker.patch(
+        "code_management.pytest_output.num_tokens_from_string",
+        side_effect=lambda text: len(text.split()),
+    )
+
+
+def test_distil_pytest_output_keeps_the_essentials():
+    """The header, error, innermost frames, output tail and summary are kept."""
+    result = distil_pytest_output(SAMPLE_OUTPUT)
+    assert result.startswith("___")
+    assert "test session starts" not in result
+    assert ">       assert deep(3) == 1" in result
+    assert "E           ValueError: boom" in result
+    assert "[... 2 traceback frames omitted ...]" in result
+    assert "site-packages" not in result
+    assert "[... 1 traceback frames omitted ...]" in result
+    assert "noise line 99" in result
+    assert "noise line 50" not in result
+    assert "[... 80 lines omitted ...]" in result
+    assert result.endswith("FAILED tests/test_sample.py::test_deep - ValueError: boom")
+
+
+def test_distil_pytest_output_enforces_token_limit():
+    """Tighter settings, then truncation, keep the result within the token limit."""
+    before = dict(pytest_output.distil_stats)
+    result = distil_pytest_output(SAMPLE_OUTPUT, token_limit=40)
+    assert len(result.split()) <= 40
+    assert "E           ValueError: boom" in result
+    assert "noise line" not in result
+    assert pytest_output.distil_stats["calls"] == before["calls"] + 1
+    assert pytest_output.distil_stats["tokens_before"] - before["tokens_before"] == len(
+        SAMPLE_OUTPUT.split()
+    )
+
+    result = distil_pytest_output("collection error " * 100, token_limit=20)
+    assert result.endswith("[... truncated ...]")
+    assert len(result.split()) <= 20
+
+
+def test_distil_pytest_output_limit_below_the_marker():
+    """A limit too small for the truncation marker cuts the text on its own."""
+    result = distil_pytest_output("collection error " * 100, token_limit=1)
+    assert len(result.split()) == 1
+    assert "collection error".startswith(result)
+    assert distil_pytest_output("collection error", token_limit=0) == ""
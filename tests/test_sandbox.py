@@ -0,0 +1,62 @@
+"""Test the sandbox module."""
+
+import signal
+import sys
+import time
+
+import pytest
+
+from code_management.sandbox import resource, run_limited
+
+pytestmark = pytest.mark.skipif(resource is None, reason="needs POSIX rlimits")
+
+
+def python(code):
+    """A command running some Python code."""
+    return [sys.executable, "-c", code]
+
+
+def test_run_limited_passes_output_through():
+    """A command within its limits runs normally."""
+    result, timed_out = run_limited(python("print('hello')"), timeout=30)
+    assert (result.returncode, result.stdout, timed_out) == (0, "hello\n", False)
+
+
+def test_wall_clock_timeout_kills_the_process_group():
+    """On expiry the command and the processes it started are killed."""
+    code = (
+        "import subprocess, sys, time\n"
+        "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        "print('started', flush=True)\n"
+        "time.sleep(60)\n"
+    )
+    start = time.monotonic()
+    result, timed_out = run_limited(python(code), timeout=2)
+    # communicate only returns once the grandchild has closed the pipes too
+    assert time.monotonic() - start < 30
+    assert timed_out
+    assert result.stdout == "started\n"
+
+
+def test_cpu_limit_stops_a_busy_loop():
+    """A command spinning on the CPU is stopped at its CPU limit."""
+    result, timed_out = run_limited(python("while True: pass"), 30, cpu_seconds=1)
+    assert timed_out
+    assert result.returncode < 0
+
+
+def test_outside_kill_is_not_a_cpu_limit():
+    """A process killed by something other than its CPU limit has not timed out."""
+    code = "import os, signal; os.kill(os.getpid(), signal.SIGKILL)"
+    result, timed_out = run_limited(python(code), 30, cpu_seconds=30)
+    assert result.returncode == -signal.SIGKILL
+    assert not timed_out
+
+
+def test_memory_limit_raises_memory_error():
+    """A command allocating past its address-space limit fails, not timed out."""
+    code = "x = bytearray(2 * 1024 ** 3)"
+    result, timed_out = run_limited(python(code), 30, memory_bytes=1024**3)
+    assert not timed_out
+    assert result.returncode == 1
+    assert "MemoryError" in result.stderr
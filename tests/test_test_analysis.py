@@ -16,6 +16,12 @@ def test_parse_node_id():
         ("analysis.py", "parse_node_id"),
     )
     assert parse_node_id(node_id) == expected_output
+    node_id = "tests/test_analysis.py::TestCase::test_parse_node_id[1-a]"
+    expected_output = (
+        ("analysis.py", "parse_node_id"),
+        ("test_analysis.py", "test_parse_node_id"),
+    )
+    assert parse_node_id(node_id) == expected_output
 
 
 def test_get_full_path():
@@ -49,3 +55,57 @@ def test_run_tests_and_analyze_failures(mocker):
 
     # There are no asserts in this test as the function does not return anything.
     # The test is for the function to run without any exceptions.
+
+
+def test_failures_are_analysed_as_they_arrive(mocker):
+    """Each failure streamed by run_pytest is analysed, and passing tests are not."""
+    failed = {"nodeid": "tests/test_utils.py::test_x", "outcome": "failed"}
+    passed = {"nodeid": "tests/test_utils.py::test_y", "outcome": "passed"}
+
+    def run_pytest(on_test):
+        on_test(failed)
+        on_test(passed)
+        return {"collectors": [], "tests": [failed, passed]}
+
+    mocker.patch("utils.run_pytest", side_effect=run_pytest)
+    mocker.patch("logging.shutdown")
+    mock_analyse = mocker.patch("agent.test_analysis.analyse_failure")
+
+    test_analysis.run_tests_and_analyze_failures()
+
+    mock_analyse.assert_called_once_with(failed, mocker.ANY)
+
+
+def test_failure_analyzer_parses_each_file_once(tmp_path, mocker):
+    """Failures are grouped per test function, and files are found and parsed once."""
+    (tmp_path / "shapes.py").write_text(
+        "def area(w, h):\n    return w * h\n\n\ndef side(a):\n    return a\n",
+        encoding="utf-8",
+    )
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_shapes.py").write_text(
+        "def test_area(case):\n    assert False\n\n\n"
+        "def test_side():\n    assert False\n",
+        encoding="utf-8",
+    )
+    nodes = [
+        {
+            "nodeid": f"tests/test_shapes.py::test_{name}",
+            "outcome": "failed",
+            "call": {"outcome": "failed", "longrepr": "E   assert False"},
+        }
+        for name in ("area[1]", "area[2]", "side")
+    ]
+    get_python_files = mocker.spy(test_analysis.utils, "get_python_files")
+
+    analyzer = test_analysis.FailureAnalyzer(str(tmp_path))
+    records = analyzer.analyse_all(nodes)
+
+    assert [record["test_name"] for record in records] == ["test_area", "test_side"]
+    assert records[0]["nodeids"] == [nodes[0]["nodeid"], nodes[1]["nodeid"]]
+    assert records[0]["errors"][nodes[1]["nodeid"]] == [("call", "E   assert False")]
+    assert records[0]["function_code"] == "def area(w, h):\n    return w * h"
+    assert records[1]["test_code"] == "def test_side():\n    assert False"
+    assert records[1]["source_file"] == str(tmp_path / "shapes.py")
+    assert analyzer.stats == {"failures": 3, "files_parsed": 2}
+    get_python_files.assert_called_once()
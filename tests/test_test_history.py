@@ -0,0 +1,108 @@
+"""Test the test_history module."""
+
+import pytest
+
+from code_management.code_database import (
+    CodeTest,
+    CodeTestRun,
+    dispose_engines,
+    session_scope,
+)
+from code_management.test_history import (
+    failure_signature,
+    flaky_test_ids,
+    flakiness_scores,
+    history_report,
+    prune_history,
+    record_report,
+)
+
+TEST_IDS = {"t.py::test_a": 1, "t.py::test_b": 2}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A database with two tests."""
+    path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(path) as session:
+        session.add_all(
+            [
+                CodeTest(
+                    test_name="test_a",
+                    test_string="",
+                    file_path="t.py",
+                    content_hash="a",
+                ),
+                CodeTest(
+                    test_name="test_b",
+                    test_string="",
+                    file_path="t.py",
+                    content_hash="b",
+                ),
+            ]
+        )
+    yield path
+    dispose_engines()
+
+
+def make_report(outcome_a: str, outcome_b: str = "passed") -> dict:
+    """A report of one run of both tests, with test_b taking a second."""
+    return {
+        "root": ".",
+        "tests": [
+            {
+                "nodeid": "t.py::test_a",
+                "outcome": outcome_a,
+                "call": {"duration": 0.1, "longrepr": "E   assert 0x7f12 == 42"},
+            },
+            {"nodeid": "t.py::test_b", "outcome": outcome_b, "call": {"duration": 1}},
+        ],
+    }
+
+
+def test_failure_signature():
+    """Repeats of a failure share a signature, whatever addresses they print."""
+    first = "def test():\n>   assert f() == 3\nE   assert <F at 0x7f01> == 3\nt.py:2"
+    second = first.replace("0x7f01", "0x7e99")
+    assert (
+        failure_signature(first) == failure_signature(second) == "assert <F at N> == N"
+    )
+    assert failure_signature("t.py:2: in test\nValueError") == "ValueError"
+
+
+def test_record_report_and_flakiness(db_path):
+    """Runs are recorded per test, and only flips of unchanged tests count as flaky."""
+    with session_scope(db_path) as session:
+        for outcome in ("passed", "failed", "passed", "failed"):
+            assert record_report(session, make_report(outcome), TEST_IDS) == 2
+    with session_scope(db_path) as session:
+        run = session.query(CodeTestRun).filter_by(test_id=1).order_by("id").all()[1]
+        assert run.outcome == "fail"
+        assert run.failure_signature == "assert N == N"
+        assert run.test_hash == "a"
+        assert flakiness_scores(session) == {1: (1.0, 4), 2: (0.0, 4)}
+        assert flaky_test_ids(session, [1, 2]) == {1}
+
+        # A test that passes once it has been revised is not flaky
+        session.get(CodeTest, 2).content_hash = "revised"
+        record_report(session, make_report("failed", "failed"), TEST_IDS)
+        session.get(CodeTest, 2).content_hash = "fixed"
+        record_report(session, make_report("failed", "passed"), TEST_IDS)
+        assert flakiness_scores(session, [2], window=3) == {2: (0.0, 3)}
+
+
+def test_prune_history_and_report(db_path):
+    """Only the latest runs are kept, and the report ranks slow and flaky tests."""
+    with session_scope(db_path) as session:
+        for outcome in ("passed", "failed", "passed"):
+            record_report(session, make_report(outcome), TEST_IDS)
+        prune_history(session, [1, 2], keep=2)
+        assert session.query(CodeTestRun).count() == 4
+
+        report = history_report(session, limit=1)
+    assert report["slowest"] == [
+        {"identifier": "t.py::test_b", "mean_duration": 1.0, "runs": 2}
+    ]
+    assert report["flakiest"] == [
+        {"identifier": "t.py::test_a", "score": 1.0, "runs": 2}
+    ]
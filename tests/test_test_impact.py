@@ -0,0 +1,86 @@
+"""Test the test_impact module."""
+
+import pytest
+
+from code_management.code_database import (
+    CodeFunction,
+    CodeTest,
+    CodeTestDependency,
+    dispose_engines,
+    session_scope,
+)
+from code_management.test_impact import (
+    load_recorded_dependencies,
+    recording_args,
+    select_affected_tests,
+    store_dependencies,
+)
+from code_management.test_runner import run_tests
+
+PROJECT_FILES = {
+    "mod_a.py": "def a():\n    return 1\n",
+    "mod_b.py": "def b():\n    return 2\n",
+    "test_a.py": "from mod_a import a\n\n\ndef test_a():\n    assert a() == 1\n",
+    "test_b.py": "from mod_b import b\n\n\ndef test_b():\n    assert b() == 2\n",
+}
+IDENTIFIERS = ["./test_a.py::test_a", "./test_b.py::test_b"]
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """A project of two modules, each with a test, and its database."""
+    monkeypatch.chdir(tmp_path)
+    for name, source in PROJECT_FILES.items():
+        (tmp_path / name).write_text(source, encoding="utf-8")
+    path = f"sqlite:///{tmp_path / 'code.db'}"
+    with session_scope(path) as session:
+        for name in ("a", "b"):
+            session.add(
+                CodeFunction(
+                    function_name=name,
+                    function_string="",
+                    file_path=f"./mod_{name}.py",
+                    start_line=1,
+                    end_line=2,
+                )
+            )
+            session.add(
+                CodeTest(
+                    test_name=f"test_{name}",
+                    test_string="",
+                    file_path=f"./test_{name}.py",
+                    content_hash=name,
+                )
+            )
+    yield path
+    dispose_engines()
+
+
+def test_select_affected_tests(db_path, tmp_path):
+    """Only the tests that ran changed code are selected once dependencies exist."""
+    with session_scope(db_path) as session:
+        assert select_affected_tests(session, ["mod_a.py"]) is None
+
+    dependency_dir = str(tmp_path / "dependencies")
+    report = run_tests(IDENTIFIERS, recording_args(dependency_dir))
+    assert report["summary"]["passed"] == 2
+    with session_scope(db_path) as session:
+        dependencies = load_recorded_dependencies(dependency_dir)
+        assert store_dependencies(session, dependencies) == 2
+    with session_scope(db_path) as session:
+        function_ids = {
+            row.file_path: row.function_id
+            for row in session.query(CodeTestDependency).filter_by(test_id=1)
+        }
+        assert function_ids["mod_a.py"] == 1
+
+        assert select_affected_tests(session, ["./mod_a.py"]) == IDENTIFIERS[:1]
+        assert select_affected_tests(session, [], [2]) == IDENTIFIERS[1:]
+        assert select_affected_tests(session, ["test_b.py"]) == IDENTIFIERS[1:]
+        assert select_affected_tests(session, ["other.py"]) == []
+        assert select_affected_tests(session, ["conftest.py"]) is None
+
+        # A test edited since its dependencies were recorded is always selected
+        session.get(CodeTest, 2).content_hash = "edited"
+        session.flush()
+        assert select_affected_tests(session, ["other.py"]) == IDENTIFIERS[1:]
@@ -0,0 +1,224 @@
+"""Test the test_runner module."""
+
+import pytest
+
+from code_management.code_database import CodeTest, dispose_engines, session_scope
+from code_management.test_runner import (
+    node_key,
+    load_test_durations,
+    merge_reports,
+    record_durations,
+    run_tests,
+    run_suite_parallel,
+    run_tests_parallel,
+    shard_tests,
+    split_pytest_args,
+    statuses_from_report,
+    update_test_statuses,
+)
+
+SAMPLE_TESTS = """
+import pytest
+
+
+def test_passes():
+    assert True
+
+
+def test_fails():
+    assert False
+
+
+@pytest.mark.parametrize("value", [1, 2])
+def test_one_case_fails(value):
+    assert value == 1
+"""
+
+
+def test_run_tests_in_one_process(tmp_path, monkeypatch):
+    """All requested tests run in one batch and map back to their identifiers."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "test_sample.py").write_text(SAMPLE_TESTS, encoding="utf-8")
+    identifiers = [
+        "./test_sample.py::test_passes",
+        "./test_sample.py::test_fails",
+        "./test_sample.py::test_one_case_fails",
+    ]
+    report = run_tests(identifiers)
+    assert len(report["tests"]) == 4
+
+    statuses = statuses_from_report(report, identifiers + ["missing.py::test_x"])
+    assert statuses == {
+        "./test_sample.py::test_passes": "pass",
+        "./test_sample.py::test_fails": "fail",
+        "./test_sample.py::test_one_case_fails": "fail",
+        "missing.py::test_x": "fail",
+    }
+
+
+def test_run_tests_skips_uncollectable_files(tmp_path, monkeypatch):
+    """A file that cannot be collected fails its own tests, not the whole batch."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "test_sample.py").write_text(SAMPLE_TESTS, encoding="utf-8")
+    (tmp_path / "test_broken.py").write_text("def test_x(:\n", encoding="utf-8")
+    identifiers = ["./test_sample.py::test_passes", "./test_broken.py::test_x"]
+    report = run_tests(identifiers)
+
+    assert statuses_from_report(report, identifiers) == {
+        "./test_sample.py::test_passes": "pass",
+        "./test_broken.py::test_x": "fail",
+    }
+    failed = [c["nodeid"] for c in report["collectors"] if c["outcome"] == "failed"]
+    assert failed == ["test_broken.py"]
+
+
+def test_run_tests_times_out(tmp_path, monkeypatch):
+    """A batch stopped at its limit keeps the results that came in before then."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "test_slow.py").write_text(
+        "import time\n\n\ndef test_a():\n    pass\n\n\n"
+        "def test_slow():\n    time.sleep(60)\n\n\ndef test_c():\n    pass\n",
+        encoding="utf-8",
+    )
+    names = ("test_a", "test_slow", "test_c")
+    identifiers = [f"test_slow.py::{name}" for name in names]
+    report = run_tests(identifiers, timeout=5)
+
+    assert report["timed_out"] is True
+    assert statuses_from_report(report, identifiers) == {
+        "test_slow.py::test_a": "pass",
+        "test_slow.py::test_slow": "timeout",
+        "test_slow.py::test_c": "timeout",
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A database with two tests."""
+    path = f"sqlite:///{tmp_path / 'test.db'}"
+    with session_scope(path) as session:
+        session.add_all(
+            [
+                CodeTest(test_name="test_a", test_string="", file_path="t.py"),
+                CodeTest(test_name="test_b", test_string="", file_path="t.py"),
+            ]
+        )
+    yield path
+    dispose_engines()
+
+
+def test_update_test_statuses(db_path):
+    """Statuses are written in one bulk update."""
+    with session_scope(db_path) as session:
+        assert update_test_statuses(session, {1: "pass", 2: "fail"}) == 2
+        assert update_test_statuses(session, {}) == 0
+    with session_scope(db_path) as session:
+        statuses = session.query(CodeTest.test_name, CodeTest.test_status).all()
+    assert sorted(statuses) == [("test_a", "pass"), ("test_b", "fail")]
+
+
+def test_update_test_durations(db_path):
+    """Durations can be written with or without statuses, and read back by key."""
+    with session_scope(db_path) as session:
+        update_test_statuses(session, {1: "pass"}, {1: 0.5, 2: 2.0})
+    with session_scope(db_path) as session:
+        assert load_test_durations(session) == {
+            node_key("t.py", "test_a"): 0.5,
+            node_key("t.py", "test_b"): 2.0,
+        }
+        assert session.get(CodeTest, 2).test_status is None
+
+
+def test_shard_tests_longest_first():
+    """Shards are balanced on durations, with unknown tests taking the median."""
+    durations = {
+        node_key("t.py", name): seconds
+        for name, seconds in {"a": 8, "b": 5, "c": 4, "d": 3}.items()
+    }
+    identifiers = ["t.py::a", "t.py::b", "t.py::c", "t.py::d", "t.py::e"]
+    shards = shard_tests(identifiers, 2, durations)
+    assert sorted(map(sorted, shards)) == [
+        ["t.py::a", "t.py::c"],
+        ["t.py::b", "t.py::d", "t.py::e"],
+    ]
+    assert shard_tests(identifiers[:1], 4, durations) == [["t.py::a"]]
+    # The cases of a parametrized test share its duration
+    cases = ["t.py::a[1]", "t.py::a[2]", "t.py::b"]
+    assert sorted(map(sorted, shard_tests(cases, 2, durations))) == [
+        ["t.py::a[1]", "t.py::a[2]"],
+        ["t.py::b"],
+    ]
+
+
+def test_merge_reports():
+    """Merged reports cover all tests and are timed by the slowest process."""
+    reports = [
+        {
+            "root": "/r",
+            "duration": 2,
+            "summary": {"passed": 1, "total": 1},
+            "tests": [{"nodeid": "a"}],
+            "collectors": [],
+        },
+        {
+            "root": "/r",
+            "duration": 3,
+            "summary": {"failed": 1, "total": 1},
+            "tests": [{"nodeid": "b"}],
+            "collectors": [],
+        },
+    ]
+    merged = merge_reports(reports)
+    assert merged["summary"] == {"passed": 1, "failed": 1, "total": 2}
+    assert merged["duration"] == 3
+    assert [test["nodeid"] for test in merged["tests"]] == ["a", "b"]
+
+
+def test_run_tests_parallel(tmp_path, monkeypatch, db_path):
+    """A parallel run reports every test, and its durations can be recorded."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "t.py").write_text(
+        "def test_a():\n    pass\n\n\ndef test_b():\n    assert False\n",
+        encoding="utf-8",
+    )
+    report = run_tests_parallel(["t.py::test_a", "t.py::test_b"], workers=2)
+    assert report["summary"]["total"] == 2
+    assert statuses_from_report(report, ["t.py::test_a", "t.py::test_b"]) == {
+        "t.py::test_a": "pass",
+        "t.py::test_b": "fail",
+    }
+    with session_scope(db_path) as session:
+        assert record_durations(session, report) == 2
+    with session_scope(db_path) as session:
+        assert len(load_test_durations(session)) == 2
+
+
+def test_split_pytest_args(tmp_path, monkeypatch):
+    """Existing paths select tests; options and their values are kept apart."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "t.py").write_text("", encoding="utf-8")
+    args = ["tests", "-x", "--rootdir", "tests", "tests/t.py::test_a", "-k", "a"]
+    assert split_pytest_args(args) == (
+        ["tests", "tests/t.py::test_a"],
+        ["-x", "--rootdir", "tests", "-k", "a"],
+    )
+
+
+def test_run_suite_parallel_with_path(tmp_path, monkeypatch, db_path):
+    """Each test under a given path is run once, not once per process."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tests").mkdir()
+    for name in ("test_one.py", "test_two.py"):
+        (tmp_path / "tests" / name).write_text(
+            "def test_a():\n    pass\n\n\ndef test_b():\n    pass\n",
+            encoding="utf-8",
+        )
+    report = run_suite_parallel(3, ["tests"], db_path)
+    node_ids = [test["nodeid"] for test in report["tests"]]
+    assert sorted(node_ids) == [
+        "tests/test_one.py::test_a",
+        "tests/test_one.py::test_b",
+        "tests/test_two.py::test_a",
+        "tests/test_two.py::test_b",
+    ]
@@ -0,0 +1,126 @@
+"""Test the test_worker module."""
+
+import os
+import time
+
+import pytest
+
+from code_management.sandbox import resource
+from code_management.test_worker import PytestWorker
+
+needs_rlimits = pytest.mark.skipif(resource is None, reason="needs POSIX rlimits")
+
+
+def write_module(path, value, mtime):
+    """Write a module returning a value, with a given modification time."""
+    path.write_text(f"def value():\n    return {value}\n", encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def is_running(pid):
+    """Check whether a process is alive, counting one not yet reaped as dead."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as file:
+            return file.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return True
+
+
+def test_worker_reloads_changed_modules(tmp_path):
+    """A warm worker picks up edits to project modules and to tests."""
+    write_module(tmp_path / "mod.py", 1, 1_000_000)
+    test_file = tmp_path / "test_mod.py"
+    test_file.write_text(
+        "import mod\n\n\ndef test_value():\n    assert mod.value() == 1\n",
+        encoding="utf-8",
+    )
+    with PytestWorker(str(tmp_path)) as worker:
+        result = worker.run(["test_mod.py::test_value"])
+        assert result["exitcode"] == 0
+        assert [test["outcome"] for test in result["tests"]] == ["passed"]
+
+        write_module(tmp_path / "mod.py", 2, 2_000_000)
+        result = worker.run(["test_mod.py::test_value"])
+        assert result["exitcode"] == 1
+        assert result["tests"][0]["outcome"] == "failed"
+        assert "assert 2 == 1" in result["output"]
+
+        test_file.write_text(
+            "import mod\n\n\ndef test_value():\n    assert mod.value() == 2\n",
+            encoding="utf-8",
+        )
+        assert worker.run(["test_mod.py::test_value"])["exitcode"] == 0
+        assert worker.stats == {"runs": 3, "restarts": 0, "timeouts": 0}
+
+
+def test_worker_restarts_after_crash(tmp_path):
+    """A test that kills the worker fails, and the next run gets a fresh worker."""
+    (tmp_path / "test_exit.py").write_text(
+        "import os\n\n\ndef test_exit():\n    os._exit(3)\n\n\n"
+        "def test_ok():\n    pass\n",
+        encoding="utf-8",
+    )
+    with PytestWorker(str(tmp_path)) as worker:
+        assert worker.run(["test_exit.py::test_exit"])["exitcode"] == 1
+        assert worker.run(["test_exit.py::test_ok"])["exitcode"] == 0
+        assert worker.stats["restarts"] == 1
+
+
+def test_worker_times_out(tmp_path):
+    """A test that outlasts the timeout is reported and the worker replaced."""
+    (tmp_path / "test_slow.py").write_text(
+        "import time\n\n\ndef test_slow():\n    time.sleep(60)\n\n\n"
+        "def test_ok():\n    pass\n",
+        encoding="utf-8",
+    )
+    with PytestWorker(str(tmp_path)) as worker:
+        worker.run(["test_slow.py::test_ok"])
+        result = worker.run(["test_slow.py::test_slow"], timeout=1)
+        assert result["timed_out"] is True
+        assert worker.run(["test_slow.py::test_ok"], timeout=30)["exitcode"] == 0
+        assert worker.stats == {"runs": 3, "restarts": 0, "timeouts": 1}
+
+
+@needs_rlimits
+def test_worker_kills_its_process_group(tmp_path):
+    """On timeout, processes started by the tests are killed with the worker."""
+    pid_file = tmp_path / "child.pid"
+    (tmp_path / "test_child.py").write_text(
+        "import subprocess, sys, time\n\n\ndef test_child():\n"
+        "    child = subprocess.Popen([sys.executable, '-c', 'import time; "
+        "time.sleep(60)'])\n"
+        f"    open({str(pid_file)!r}, 'w').write(str(child.pid))\n"
+        "    time.sleep(60)\n",
+        encoding="utf-8",
+    )
+    with PytestWorker(str(tmp_path)) as worker:
+        result = worker.run(["test_child.py::test_child"], timeout=5)
+        assert result["timed_out"] is True
+    child_pid = int(pid_file.read_text())
+    for _ in range(50):
+        if not is_running(child_pid):
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError("the test's child process outlived the worker")
+
+
+@needs_rlimits
+def test_worker_limits_cpu_per_run(tmp_path):
+    """A run spinning past its CPU seconds is stopped, however long it has left."""
+    (tmp_path / "test_spin.py").write_text(
+        "def test_spin():\n    while True:\n        pass\n\n\n"
+        "def test_ok():\n    pass\n",
+        encoding="utf-8",
+    )
+    with PytestWorker(str(tmp_path), cpu_limit=1) as worker:
+        assert worker.run(["test_spin.py::test_ok"])["exitcode"] == 0
+        result = worker.run(["test_spin.py::test_spin"], timeout=60)
+        assert result["timed_out"] is True
+        assert "CPU seconds" in result["output"]
+        assert worker.run(["test_spin.py::test_ok"], timeout=30)["exitcode"] == 0
+        assert worker.stats == {"runs": 3, "restarts": 0, "timeouts": 1}
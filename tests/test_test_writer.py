@@ -9,8 +9,9 @@ def test_get_test_code(mocker):
     mock_result = mocker.MagicMock()
     mock_result.test_string = "sample_test_code"
 
-    # Patching 'setup_db' to return the mock session
-    mocker.patch("code_management.test_writer.setup_db", return_value=mock_session)
+    # Patching 'session_scope' to yield the mock session
+    mock_scope = mocker.patch("code_management.test_writer.session_scope")
+    mock_scope.return_value.__enter__.return_value = mock_session
 
     # Instead of returning a string, 'select' should return a mock
     mocker.patch("code_management.test_writer.select", return_value=mocker.MagicMock())
@@ -35,7 +36,8 @@ def test_get_function_code(mocker):
     mock_result.tested_function = "sample_function_code"
 
     # Call the function
-    mocker.patch("code_management.test_writer.setup_db", return_value=mock_session)
+    mock_scope = mocker.patch("code_management.test_writer.session_scope")
+    mock_scope.return_value.__enter__.return_value = mock_session
     mocker.patch("code_management.test_writer.select", return_value=mocker.MagicMock())
 
     mock_session.execute.return_value.scalar_one.return_value = mock_result
@@ -55,7 +57,7 @@ def test_run_specific_test(mocker):
     mock_subprocess.return_value.returncode = 0
     mock_subprocess.return_value.stdout = "test output"
 
-    output, passed = run_specific_test("test_module.py::test_function")
+    output, passed = run_specific_test("test_module.py::test_function", sandbox=False)
 
     pytest_path = shutil.which("pytest")
 
@@ -66,23 +68,38 @@ def test_run_specific_test(mocker):
     assert output == "test output"
 
 
+def test_run_test_for_status_reports_timeouts(mocker):
+    """A sandboxed run stopped at its limits gets the timeout status."""
+    from code_management.test_writer import run_test_for_status
+
+    mock_run = mocker.patch("code_management.test_writer.run_limited")
+    mock_run.return_value = (mocker.Mock(returncode=-9, stdout="partial"), True)
+
+    output, status = run_test_for_status("test_module.py::test_function")
+
+    assert status == "timeout"
+    assert output.startswith("partial\nThe test was stopped")
+    mock_run.return_value = (mocker.Mock(returncode=1, stdout=""), False)
+    assert run_test_for_status("test_module.py::test_function") == ("", "fail")
+
+
 def test_update_test_status(mocker):
     from code_management.test_writer import update_test_status
 
     # Mock session and CodeTest
     mock_session = mocker.MagicMock()
     mock_result = mocker.MagicMock()
-    mocker.patch("code_management.test_writer.setup_db", return_value=mock_session)
+    mock_scope = mocker.patch("code_management.test_writer.session_scope")
+    mock_scope.return_value.__enter__.return_value = mock_session
     mocker.patch("code_management.test_writer.select", return_value=mocker.MagicMock())
     mock_session.execute.return_value.scalar_one.return_value = mock_result
-    mock_session.commit.return_value = None
 
     # Call the function
     update_test_status(test_id=123, status="pass")
 
-    # Assertions
-    mock_result.test_status = "pass"
-    mock_session.commit.assert_called_once()
+    # Assertions: the status is set inside the scope, which commits on exit
+    assert mock_result.test_status == "pass"
+    mock_scope.return_value.__exit__.assert_called_once()
 
 
 def test_replace_test_in_file():
@@ -123,3 +140,84 @@ def test_function_two():
     assert True
 """
     assert updated_content == expected_content
+
+
+def test_revise_tests_concurrently(mocker):
+    """Failing tests are revised at the same time and each is committed on its own."""
+    import threading
+
+    from code_management.test_writer import revise_tests_concurrently
+
+    tests = [
+        mocker.Mock(id=i, test_name=f"test_{i}", file_path=f"tests/test_{i}.py")
+        for i in range(3)
+    ]
+    for test in tests:
+        test.identifier = f"{test.file_path}::{test.test_name}"
+    # Every revision waits here, so the test only finishes if they overlap
+    in_flight = threading.Barrier(3, timeout=10)
+
+    def get_revised_test(test_id, worker, file_lock):
+        in_flight.wait()
+        return f"def test_{test_id}(): pass", None
+
+    mocker.patch(
+        "code_management.test_writer.get_revised_test", side_effect=get_revised_test
+    )
+    mocker.patch("code_management.test_writer.write_revised_test_to_file")
+    mocker.patch(
+        "code_management.test_writer.run_test_by_id", return_value=("", "pass")
+    )
+    mocker.patch("code_management.test_writer.PytestWorker")
+    mock_writer = mocker.patch("code_management.test_writer.DatabaseWriter")
+    git_handler = mocker.Mock()
+
+    revise_tests_concurrently(tests, 2, 3, git_handler)
+
+    submit = mock_writer.return_value.__enter__.return_value.submit
+    assert submit.call_count == 3
+    committed = sorted(call.args[1] for call in git_handler.commit_files.mock_calls)
+    assert committed == [[test.file_path] for test in tests]
+
+
+def test_revise_and_test_loop_commits_each_revised_file(mocker):
+    """Revised tests are committed one file at a time, as in concurrent mode."""
+    from code_management.test_writer import revise_and_test_loop
+
+    test = mocker.Mock(id=1, test_name="test_a", file_path="tests/test_a.py")
+    test.identifier = "tests/test_a.py::test_a"
+    mocker.patch("code_management.test_writer.fetch_failing_tests", return_value=[test])
+    git_handler = mocker.patch("code_management.test_writer.get_git_handler")()
+    mocker.patch("code_management.test_writer.session_scope")
+    mocker.patch(
+        "code_management.test_writer.test_history.flaky_test_ids", return_value=set()
+    )
+    mocker.patch("code_management.test_writer.PytestWorker")
+    mocker.patch("code_management.test_writer.revise_failing_test", return_value=2)
+    mocker.patch(
+        "code_management.test_writer.any_tests_still_failing", return_value=True
+    )
+
+    revise_and_test_loop(2)
+
+    git_handler.commit_files.assert_called_once_with(
+        "Revised test tests/test_a.py::test_a after 2 attempts.", ["tests/test_a.py"]
+    )
+    git_handler.commit_changes.assert_not_called()
+
+
+def test_flaky_test_is_rerun_before_revising(mocker):
+    """A flaky test that passes on a rerun keeps its code and is not revised."""
+    from code_management.test_writer import revise_failing_test
+
+    mock_revise = mocker.patch("code_management.test_writer.get_revised_test")
+    mocker.patch(
+        "code_management.test_writer.run_test_by_id", return_value=("", "pass")
+    )
+    save_test = mocker.Mock()
+    test = mocker.Mock(id=7, identifier="tests/test_x.py::test_x")
+
+    assert revise_failing_test(test, 2, save_test=save_test, rerun_first=True) is None
+
+    mock_revise.assert_not_called()
+    save_test.assert_called_once_with(7, None, "pass")
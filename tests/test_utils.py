@@ -1,11 +1,8 @@
 """Tests for the utils module. """
-import json
 import os
 import tempfile
 from unittest.mock import mock_open, patch
 
-import pytest
-
 import utils
 
 
@@ -224,23 +221,63 @@ def test_add_docstring_to_function():
     os.remove(file_path)
 
 
-def test_run_pytest(mocker):
-    """Test the function run_pytest"""
-
-    # Arrange
-    # Mock the pytest.main call
-    mocker.patch("pytest.main", return_value=None)
-    # Mock the opening and reading of the file
-    mocked_open = mocker.patch(
-        "builtins.open", mocker.mock_open(read_data=json.dumps({"success": True}))
+def test_extract_calls():
+    """Calls are returned once each, in order of first call, with their receivers."""
+    code = (
+        "def f(x):\n    y = helper(x)\n    self.run(utils.helper(y))\n"
+        "    get().run()\n    return len(y)"
+    )
+    assert utils.extract_calls(code) == [
+        ("", "helper"),
+        ("self", "run"),
+        ("utils", "helper"),
+        (None, "run"),
+        ("", "get"),
+        ("", "len"),
+    ]
+
+
+def test_extract_module_aliases():
+    """Imported names map to the dotted paths they import."""
+    code = (
+        "import os.path\nimport llm.llm_interface as llm\n"
+        "from code_management import code_reader as reader\nfrom . import local\n"
+    )
+    assert utils.extract_module_aliases(code) == {
+        "os": "os",
+        "llm": "llm.llm_interface",
+        "reader": "code_management.code_reader",
+    }
+
+
+def test_get_function_signature():
+    """The signature keeps the def line and the docstring summary only."""
+    code = (
+        "@decorator\ndef add(a: int, b: int = 1) -> int:\n"
+        '    """Add two numbers.\n\n    More detail.\n    """\n    return a + b\n'
     )
+    assert utils.get_function_signature(code) == (
+        "def add(a: int, b: int=1) -> int:\n    \"\"\"Add two numbers.\"\"\""
+    )
+    assert utils.get_function_signature("def f(): pass") == "def f():\n    ..."
+    assert utils.get_function_signature("x = 1") is None
+
 
-    # Act
-    result = utils.run_pytest()
+def test_run_pytest(tmp_path):
+    """Test that run_pytest streams each result and returns them all in memory."""
+    (tmp_path / "test_sample.py").write_text(
+        "def test_passes():\n    pass\n\n\ndef test_fails():\n    assert False\n",
+        encoding="utf-8",
+    )
+    streamed = []
 
-    # Assert
-    pytest.main.assert_called_once_with(
-        ["--json-report", "--json-report-file=temp_test_results.json"]
+    result = utils.run_pytest(
+        on_test=streamed.append, args=[str(tmp_path), "-p", "no:cacheprovider"]
     )
-    mocked_open.assert_called_once_with("temp_test_results.json", "r", encoding="utf-8")
-    assert result == {"success": True}
+
+    assert [test["outcome"] for test in streamed] == ["passed", "failed"]
+    assert result["tests"] == streamed
+    assert result["summary"] == {"passed": 1, "failed": 1, "total": 2}
+    assert result["exitcode"] == 1
+    assert "assert False" in streamed[1]["call"]["longrepr"]
+    assert not (tmp_path / "temp_test_results.json").exists()
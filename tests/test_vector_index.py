@@ -0,0 +1,76 @@
+"""Test the vector_index module."""
+
+import numpy as np
+
+from code_management.code_database import CodeFunction, setup_db
+from code_management.code_embeddings import vector_to_blob
+from code_management.vector_index import (
+    IVFIndex,
+    ann_top_k_similar,
+    index_path_for_db,
+    update_vector_index,
+)
+
+
+def random_vectors(size, dim=16, seed=0):
+    """Generate random ids and vectors."""
+    rng = np.random.default_rng(seed)
+    return np.arange(1, size + 1), rng.standard_normal((size, dim)).astype(np.float32)
+
+
+def test_IVFIndex_search_matches_exact_when_probing_all_lists():
+    """Probing every list is an exact search."""
+    ids, matrix = random_vectors(500)
+    index = IVFIndex()
+    index.build(ids, matrix, n_lists=10)
+    query = matrix[42]
+    unit = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    expected = ids[np.argsort(-(unit @ (query / np.linalg.norm(query))))[:5]]
+    result = index.search(query, k=5, n_probe=index.n_lists)
+    assert [function_id for function_id, _ in result] == expected.tolist()
+
+
+def test_IVFIndex_upsert_remove_save_load(tmp_path):
+    """Vectors can be replaced and removed, and the index round-trips to disk."""
+    ids, matrix = random_vectors(100)
+    index = IVFIndex()
+    index.build(ids, matrix, n_lists=4)
+    index.upsert([1], -matrix[1:2])
+    assert len(index) == 100
+    assert index.remove([2, 3, 999]) == 2
+    path = str(tmp_path / "index.ivf.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert len(loaded) == 98
+    assert loaded.search(-matrix[1], k=1, n_probe=4)[0][0] == 1
+
+
+def test_index_path_for_db():
+    """The index is stored next to the database file."""
+    assert index_path_for_db("sqlite:///code.db") == "code.db.ivf.npz"
+
+
+def test_update_vector_index_and_ann_top_k_similar(tmp_path):
+    """The persisted index follows changes and deletions in the database."""
+    session = setup_db(f"sqlite:///{tmp_path / 'test.db'}")
+    index_path = str(tmp_path / "test.db.ivf.npz")
+    _, matrix = random_vectors(20)
+    functions = [
+        CodeFunction(
+            function_name=f"f{i}", function_string="", vector=vector_to_blob(v)
+        )
+        for i, v in enumerate(matrix)
+    ]
+    session.add_all(functions)
+    session.commit()
+    index = update_vector_index(session, [], index_path, n_lists=2)
+    assert len(index) == 20
+
+    functions[1].vector = vector_to_blob(matrix[0] * 2)
+    session.delete(functions[2])
+    session.commit()
+    index = update_vector_index(session, [functions[1].id], index_path)
+    assert len(IVFIndex.load(index_path)) == 19
+    result = ann_top_k_similar(session, index, functions[0].id, k=1, n_probe=2)
+    assert result[0][0] == functions[1].id
+    session.close()
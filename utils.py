@@ -11,10 +11,11 @@ This module is part of the Agent project, which uses a Language Learning Model (
 code, tests, and manage a GitHub repository.
 """
 import ast
-import json
+import hashlib
 import os
 import re
-from typing import Any, Dict
+import time
+from typing import Any, Callable, Dict, List
 
 import black
 import isort
@@ -159,6 +160,114 @@ def extract_functions_from_file(file_path: str):
     return function_data
 
 
+def _dotted_name(node: ast.AST) -> str:
+    """Get the dotted name of a chain of attributes on a name, or None."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def extract_calls(function_code: str) -> list[tuple[str, str]]:
+    """
+    Get the functions and methods called by a piece of code, with their receivers.
+
+    Args:
+        function_code (str): The source code of the function.
+
+    Returns:
+        list[tuple[str, str]]: (receiver, name) pairs, in order of first call. The
+        receiver is "" for a bare call such as `helper()`, the dotted name before the
+        call for `self.run_command()` or `llm.generate()`, and None where it is not a
+        plain name, as in `get_session().query()`.
+    """
+    nodes = [
+        node for node in ast.walk(ast.parse(function_code)) if isinstance(node, ast.Call)
+    ]
+    calls = []
+    for node in sorted(nodes, key=lambda node: (node.lineno, node.col_offset)):
+        if isinstance(node.func, ast.Name):
+            call = ("", node.func.id)
+        elif isinstance(node.func, ast.Attribute):
+            call = (_dotted_name(node.func.value), node.func.attr)
+        else:
+            continue
+        if call not in calls:
+            calls.append(call)
+    return calls
+
+
+def extract_module_aliases(code: str) -> dict[str, str]:
+    """
+    Map the names bound by the absolute imports in a piece of code to what they import.
+
+    Args:
+        code (str): The source code.
+
+    Returns:
+        dict[str, str]: The dotted path each name refers to, e.g. {"llm":
+        "llm.llm_interface"} for `import llm.llm_interface as llm`, or {"os": "os"}
+        for `import os.path`.
+    """
+    aliases = {}
+    for node in ast.walk(ast.parse(code)):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    aliases[alias.asname] = alias.name
+                else:
+                    root = alias.name.split(".")[0]
+                    aliases[root] = root
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            for alias in node.names:
+                name = alias.asname or alias.name
+                aliases[name] = f"{node.module}.{alias.name}"
+    return aliases
+
+
+def get_function_signature(function_code: str) -> str:
+    """
+    Get the signature of a function, with the first line of its docstring.
+
+    Args:
+        function_code (str): The source code of the function.
+
+    Returns:
+        str: The `def` line and docstring summary, or None if no function is found.
+    """
+    module = ast.parse(function_code)
+    nodes = [
+        node
+        for node in module.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    ]
+    if not nodes:
+        return None
+    node = nodes[0]
+    docstring = ast.get_docstring(node)
+    summary = docstring.strip().splitlines()[0] if docstring else ""
+    node.decorator_list = []
+    node.body = [ast.Expr(value=ast.Constant(value=summary or Ellipsis))]
+    return ast.unparse(node)
+
+
+def compute_source_hash(source: str) -> str:
+    """
+    Compute a stable hash of a piece of source code.
+
+    Args:
+        source (str): The source code.
+
+    Returns:
+        str: The hex digest of the source.
+    """
+    return hashlib.sha256((source or "").encode("utf-8")).hexdigest()
+
+
 def add_imports(file_path: str, new_imports: list[str]):
     """
     Add import statements to a Python file, avoiding duplicates.
@@ -322,15 +431,103 @@ def add_docstring_to_function(file_path: str, function_name: str, docstring: str
         file.write(new_code)
 
 
-def run_pytest() -> Dict[str, Any]:
-    """Run pytest with the pytest-json-report plug-in and return the results as a dictionary.
+class ResultCollector:
+    """pytest plugin that hands each test's result to a callback as soon as it finishes.
+
+    Results are shaped like the entries of a pytest-json-report report: each test
+    has its nodeid, outcome, total duration, the longrepr of its first failure and
+    the outcome and duration of its setup, call and teardown phases.
+    """
 
-    The function saves the results to a file named 'temp_test_results.json'.
+    def __init__(self, on_test: Callable[[dict], None] = None, keep: bool = True):
+        """
+        Args:
+            on_test (Callable[[dict], None]): Called with each test's result.
+            keep (bool): Whether to keep every result in the report. Without it,
+                only the summary counts and the failed collectors are kept.
+        """
+        self.on_test = on_test
+        self.keep = keep
+        self.report = {"collectors": [], "tests": [], "summary": {"total": 0}}
+        self._running = {}
+
+    def pytest_collectreport(self, report):
+        """Record the outcome of collecting a file or class."""
+        collector = {"nodeid": report.nodeid, "outcome": report.outcome}
+        if report.failed:
+            collector["longrepr"] = report.longreprtext
+        if report.failed or self.keep:
+            self.report["collectors"].append(collector)
+
+    def pytest_runtest_logreport(self, report):
+        """Record a test phase, passing the test on once its teardown is done."""
+        test = self._running.setdefault(
+            report.nodeid,
+            {"nodeid": report.nodeid, "outcome": "passed", "duration": 0.0},
+        )
+        phase = {"outcome": report.outcome, "duration": report.duration}
+        if report.failed:
+            phase["longrepr"] = report.longreprtext
+            test.setdefault("longrepr", report.longreprtext)
+        test[report.when] = phase
+        test["duration"] += report.duration
+        if report.failed:
+            if test["outcome"] in ("passed", "skipped"):
+                test["outcome"] = "failed" if report.when == "call" else "error"
+        elif report.when != "teardown" and hasattr(report, "wasxfail"):
+            test["outcome"] = "xfailed" if report.skipped else "xpassed"
+        elif report.skipped:
+            test["outcome"] = "skipped"
+        if report.when == "teardown":
+            self._finish(self._running.pop(report.nodeid))
+
+    def _finish(self, test: dict):
+        """Count a finished test, keep it if asked to, and pass it on."""
+        summary = self.report["summary"]
+        summary[test["outcome"]] = summary.get(test["outcome"], 0) + 1
+        summary["total"] += 1
+        if self.keep:
+            self.report["tests"].append(test)
+        if self.on_test is not None:
+            self.on_test(test)
+
+
+def run_pytest(
+    workers: int = 1,
+    on_test: Callable[[dict], None] = None,
+    args: List[str] = (),
+    keep: bool = True,
+) -> Dict[str, Any]:
+    """Run pytest and return the results as a dictionary, like a pytest-json-report.
+
+    Results are collected in memory by a ResultCollector plug-in, which passes each
+    test to on_test as soon as it finishes, so callers can act on failures while the
+    rest of the suite runs. With more than one worker, the tests are split across
+    that many pytest processes, balanced on the test durations stored in the code
+    DB, and their reports merged; on_test is then called once the run is over.
+
+    Args:
+        workers (int): The number of pytest processes. Defaults to 1 (in-process).
+        on_test (Callable[[dict], None]): Called with each test's result.
+        args (List[str]): Further arguments for pytest.
+        keep (bool): Whether to keep every test's result in the returned report.
 
     Returns:
         Dict[str, Any]: The dictionary with the test results.
     """
-    pytest.main(["--json-report", "--json-report-file=temp_test_results.json"])
-    with open("temp_test_results.json", "r", encoding="utf-8") as file:
-        test_results = json.load(file)
+    if workers > 1:
+        # Imported here, as the code DB modules themselves import utils
+        from code_management.test_runner import run_suite_parallel
+
+        test_results = run_suite_parallel(workers, list(args))
+        if on_test is not None:
+            for test in test_results.get("tests", []):
+                on_test(test)
+        return test_results
+    collector = ResultCollector(on_test, keep=keep)
+    start = time.perf_counter()
+    exitcode = pytest.main(list(args), plugins=[collector])
+    test_results = collector.report
+    test_results["exitcode"] = int(exitcode or 0)
+    test_results["duration"] = time.perf_counter() - start
     return test_results